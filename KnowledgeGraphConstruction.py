@@ -1,19 +1,123 @@
-import spacy    # Importing spaCy, a library for NLP
 import networkx as nx       # Importing NetworkX, a library for graph manipulation
 import pandas as pd     # Importing pandas, a library for data manipulation
 import json     # Importing json, a library for JSON manipulation
+import os       # Importing os, to read the pipeline profile from the environment
+import hashlib      # Importing hashlib, to key the parse cache on the paragraph text
+import sqlite3      # Importing sqlite3, for the on-disk parse cache
+import threading        # Importing threading, to share the parse cache between request threads
+import mmap     # Importing mmap, to memory-map binary graph snapshots
+import io       # Importing io, to build binary graph snapshots in memory
+import contextlib       # Importing contextlib, for the atomic file writer
+import re       # Importing re, to clean and normalize node names
+import math     # Importing math, to tell unscored nodes in binary graph snapshots
+import weakref      # Importing weakref, to keep the node name index of a graph next to it
+import numpy as np      # Importing NumPy, for the arrays of binary graph snapshots
+import metrics      # Importing metrics, for the per-stage timings and counters
+import node_vectors     # Importing node_vectors, for the node vectors of similarity search
 
-# Load the spaCy model
-nlp = spacy.load('en_core_web_lg')      # Loading the large English NLP model from spaCy
+# spaCy components the extraction needs: NER for entities, the parser for relationships and the
+# lemmatizer for the relation and head noun lemmas. The tagger and attribute ruler stay: the rule-based lemmatizer
+# and the head noun check (head_lemmas) read the POS tags they set. Of the en_core_web models' components this
+# leaves out only senter, which those models disable by default, so 'lean' runs the same components as 'full'.
+EXTRACTION_COMPONENTS = ('tok2vec', 'tagger', 'attribute_ruler', 'lemmatizer', 'parser', 'ner')
 
-# Function to extract named entities from text
-def extract_entities(text):
-    doc = nlp(text)     # Process the text using the spaCy model
+# Pipeline profiles: which model to load and which of its components to keep (None keeps all of them)
+PIPELINE_PROFILES = {
+    'full': {'model': 'en_core_web_lg', 'components': None},
+    'lean': {'model': 'en_core_web_lg', 'components': EXTRACTION_COMPONENTS},
+    'small': {'model': 'en_core_web_sm', 'components': EXTRACTION_COMPONENTS},
+}
+
+# Profile used when the model is first needed, overridable with the KG_SPACY_PROFILE environment variable
+PIPELINE_PROFILE = os.environ.get('KG_SPACY_PROFILE', 'lean')
+
+nlp = None      # The spaCy model, loaded lazily by get_nlp() on first use
+vectors_nlp = None      # The same model without its pipeline components, loaded by get_vectors_nlp() for its word vectors
+vectors_nlp_lock = threading.Lock()     # Request threads that need the vectors at once load the model only once
+
+# Version of the extraction rules; bump it whenever extract_from_doc produces different output for the same Doc
+EXTRACTOR_VERSION = 2
+
+# Default number of paragraphs handed to nlp.pipe at a time in batched mode
+DEFAULT_BATCH_SIZE = 64
+
+# Whether graphs are built from canonicalized extractions (see canonicalize_extractions); KG_CANONICALIZE=0 turns it off
+CANONICALIZE = os.environ.get('KG_CANONICALIZE', '1') != '0'
+
+# PageRank parameters of the node importance scores (see compute_importance); the iteration stops once the scores
+# change by less than the tolerance on average
+IMPORTANCE_DAMPING = 0.85
+IMPORTANCE_TOLERANCE = 1e-5
+IMPORTANCE_MAX_ITERATIONS = 100
+
+# Whether publish_graph also updates the node vectors of similarity search (see node_vectors.py); KG_NODE_VECTORS=0 turns it off
+NODE_VECTORS = os.environ.get('KG_NODE_VECTORS', '1') != '0'
+
+# Function to select the pipeline profile; the model is reloaded on the next get_nlp() call
+def configure_pipeline(profile):
+    global nlp, vectors_nlp, PIPELINE_PROFILE
+    if profile not in PIPELINE_PROFILES:
+        raise ValueError(f"Unknown pipeline profile '{profile}', expected one of {sorted(PIPELINE_PROFILES)}")
+    PIPELINE_PROFILE = profile
+    nlp = None
+    vectors_nlp = None
+
+# Function to check that a spaCy model package is installed, raising OSError if not; spacy.info exits the interpreter
+# for a missing model instead of raising
+def require_model(model):
+    import spacy.util
+    if not spacy.util.is_package(model):
+        raise OSError(f"spaCy model '{model}' is not installed")
+
+# Function to load the spaCy model of the current profile on first use
+def get_nlp():
+    global nlp
+    if nlp is None:
+        import spacy    # Importing spaCy only when a model is actually needed keeps importing this module cheap
+        profile = PIPELINE_PROFILES[PIPELINE_PROFILE]
+        require_model(profile['model'])
+        exclude = []
+        if profile['components'] is not None:
+            # Exclude the components extraction never uses so they are not even loaded into memory
+            components = spacy.info(profile['model']).get('components', [])
+            exclude = [name for name in components if name not in profile['components']]
+        nlp = spacy.load(profile['model'], exclude=exclude)
+    return nlp
+
+# Function to get the word vectors of the current profile's model: the extraction model if it is already loaded,
+# otherwise the model without any pipeline component, as embedding names only needs its tokenizer and vectors
+def get_vectors_nlp():
+    global vectors_nlp
+    if nlp is not None:
+        return nlp
+    if vectors_nlp is None:
+        with vectors_nlp_lock:
+            if vectors_nlp is None:
+                import spacy
+                model = PIPELINE_PROFILES[PIPELINE_PROFILE]['model']
+                require_model(model)
+                vectors_nlp = spacy.load(model, exclude=spacy.info(model).get('components', []))
+    return vectors_nlp
+
+# Function to describe the model and pipeline that produce the extractions, used to key the parse cache
+def pipeline_version():
+    profile = PIPELINE_PROFILES[PIPELINE_PROFILE]
+    if nlp is not None:
+        model_version = nlp.meta.get('version', '')
+    else:
+        import spacy
+        require_model(profile['model'])
+        model_version = spacy.info(profile['model']).get('version', '')     # Read from meta.json, without loading the model
+    components = ','.join(profile['components'] or ['all'])
+    return f"{profile['model']}-{model_version}:{components}:extractor-{EXTRACTOR_VERSION}"
+
+# Function to extract named entities from an already processed document
+def extract_entities(doc):
     # Extracting entities and their labels from the processed text
     entities = [(ent.text, ent.label_) for ent in doc.ents] #sentense splitting tokanization- named entities in the document 
     return entities #list of entities and labels
 
-# Function to extract relationships between entities from the processed document# Function to extract relationships between entities from the processed document
+# Function to extract relationships between entities from the processed document
 def extract_relationships(doc):
     relations = []
     for token in doc:       # Iterate through each token in the document
@@ -26,54 +130,1204 @@ def extract_relationships(doc):
             relations.append((token.head.head, token.head, token))
     return relations    #list of relationships
 
+# Function to get the lemmas normalize_name needs: {name: lemma} for the names whose last word is a noun in another
+# form than its lemma ("logic blocks" -> "block"), given (name, last token of the name) pairs
+def head_lemmas(names):
+    lemmas = {}
+    for name, token in names:
+        if token.pos_ == 'NOUN' and token.lemma_ and token.lemma_.lower() != token.text.lower() \
+                and clean_name(name).split(' ')[-1] == token.text:
+            lemmas.setdefault(name, token.lemma_)
+    return lemmas
 
-# Function to build a knowledge graph from the given data
-def build_knowledge_graph(data):
-    G = nx.Graph()      # Initialize an empty graph using NetworkX
-    
-    for paragraph in data:      # Iterate through each paragraph in the data
-        doc = nlp(paragraph)    # Process the paragraph using the spaCy model
-        entities = extract_entities(paragraph)      # Extract entities from the paragraph
-        relations = extract_relationships(doc)      # Extract relationships from the processed paragraph
-        
-        # Iterate through each entity and its label
-        for entity, label in entities:      
+# Function to run the whole extraction stage on one parsed paragraph; returns (entities, triples, lemmas).
+# The paragraph is parsed exactly once by the caller; entities, relationships and lemmas all read that same Doc.
+@metrics.timed()
+def extract_from_doc(doc):
+    entities = extract_entities(doc)
+    relationships = extract_relationships(doc)
+    # Relationships as plain (subject, relation, object) strings, so the result no longer depends on the Doc
+    triples = [(subj.text, verb.lemma_, obj.text) for subj, verb, obj in relationships]
+    lemmas = head_lemmas([(ent.text, ent[-1]) for ent in doc.ents] +
+                         [(token.text, token) for subj, _, obj in relationships for token in (subj, obj)])
+    return entities, triples, lemmas
+
+# Wikipedia citation markers left on words by the scraper ("Intel.[45", "designs.[38][39"), and the punctuation
+# stripped from both ends of node names
+CITATION_MARKER = re.compile(r'\.?\[[\d\[\]]*$')
+NAME_STRIP_CHARS = ' \t\n.,;:!?()[]{}"\'`-'
+# Plural acronyms ("FPGAs", "LUTs"), which the lemmatizer leaves alone
+PLURAL_ACRONYM = re.compile(r'[A-Z][A-Z0-9]+s')
+
+# Function to clean a node name: citation markers and surrounding punctuation removed
+def clean_name(name):
+    return CITATION_MARKER.sub('', name).strip(NAME_STRIP_CHARS)
+
+# Function to normalize a node name: cleaned, with its last word replaced by its lemma if extract_from_doc found one
+# (see head_lemmas: "logic blocks" -> "logic block", while "news" or "series" stay) and plural acronyms made singular
+# ("FPGAs" -> "FPGA"). The lemma keeps the case of the word ("Chips" -> "Chip").
+def normalize_name(name, lemma=None):
+    words = clean_name(name).split(' ')
+    word = words[-1]
+    if lemma:
+        if word.lower().startswith(lemma.lower()):
+            words[-1] = word[:len(lemma)]
+        else:
+            words[-1] = lemma[:1].upper() + lemma[1:] if word[:1].isupper() else lemma
+    elif PLURAL_ACRONYM.fullmatch(word):
+        words[-1] = word[:-1]
+    return ' '.join(words)
+
+# Index of the nodes of a graph by normalized name (normalize_name(node).lower()), so canonicalize_extractions finds
+# the existing node of a name without normalizing every node of the graph. node_keys(G) builds it on first use and
+# keeps it next to the graph; add_extraction_to_graph and remove_source keep it up to date, and a graph changed
+# some other way is indexed again once its number of nodes no longer matches.
+class NodeKeys:
+    def __init__(self, G):
+        self.nodes = {}     # normalized name -> {node: None} of the nodes with that name, first added first
+        self.count = 0
+        for node in G:
+            self.add(node)
+
+    def add(self, node):
+        self.nodes.setdefault(normalize_name(node).lower(), {})[node] = None
+        self.count += 1
+
+    def remove(self, node):
+        key = normalize_name(node).lower()
+        self.nodes[key].pop(node)
+        if not self.nodes[key]:
+            del self.nodes[key]
+        self.count -= 1
+
+    # Function to get the node with a normalized name, the first one added if several have it; None if there is none
+    def get(self, key):
+        return next(iter(self.nodes.get(key, ())), None)
+
+_node_keys = weakref.WeakKeyDictionary()        # graph -> NodeKeys
+
+def node_keys(G):
+    keys = _node_keys.get(G)
+    if keys is None or keys.count != G.number_of_nodes():
+        keys = _node_keys[G] = NodeKeys(G)
+    return keys
+
+# Disjoint sets over hashable items, to merge the aliases of a node
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        parent = self.parent.setdefault(item, item)
+        while parent != item:
+            grandparent = self.parent[parent]
+            self.parent[item] = grandparent     # Path halving
+            item, parent = parent, grandparent
+        return item
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[root_b] = root_a
+
+# Function to get spaCy's English stop words; nodes named by one of them ("is", "are", "which") are dropped
+def stop_words():
+    from spacy.lang.en.stop_words import STOP_WORDS     # Imported lazily, like the model
+    return STOP_WORDS
+
+# Function to canonicalize a batch of extractions [(entities, triples, lemmas), ...] before they are merged into a graph:
+#   - names are cleaned and normalized (normalize_name, with the lemmas of extract_from_doc) and compared ignoring
+#     case, so "FPGA", "FPGAs", "fpga" and "FPGAs.[12" are one node, and so are "chip" and "chips"
+#   - aliases are merged with a union-find: names equal after normalization, an acronym and the name it abbreviates
+#     ("FPGA" and "field-programmable gate array"), and the given alias pairs
+#   - each merged node is named after the existing graph node (found through node_keys), if the graph has one, and
+#     otherwise after its most frequent form in the batch (forms NER labelled as entities first)
+#   - nodes named by stop words or without any letter or digit are dropped, with their relationships
+# Returns the canonicalized extractions, in the same order, with empty lemmas.
+@metrics.timed()
+def canonicalize_extractions(extractions, graph=None, aliases=()):
+    extractions = list(extractions)
+    lemmas = {name: lemma for _, _, extraction_lemmas in extractions for name, lemma in extraction_lemmas.items()}
+    forms = {}      # surface name -> normalized form
+    form_stats = {}     # normalized form -> [times NER labelled it, times it occurred, first occurrence]
+
+    def note(name, labelled):
+        form = forms.get(name)
+        if form is None:
+            form = forms[name] = normalize_name(name, lemmas.get(name))
+        stats = form_stats.setdefault(form, [0, 0, len(form_stats)])
+        stats[0] += labelled
+        stats[1] += 1
+
+    for entities, triples, _ in extractions:
+        for name, label in entities:
+            note(name, label is not None)
+        for subj, _, obj in triples:
+            note(subj, False)
+            note(obj, False)
+
+    groups = UnionFind()
+    for form in form_stats:
+        groups.union(form.lower(), form.lower())
+    keys = {form.lower() for form in form_stats}
+    for form in form_stats:
+        words = [word for word in re.split(r'[\s-]+', form.lower()) if word]
+        acronym = ''.join(word[0] for word in words)
+        if len(words) >= 3 and acronym in keys and acronym.upper() in form_stats:
+            groups.union(acronym, form.lower())
+    for a, b in aliases:
+        groups.union(normalize_name(a).lower(), normalize_name(b).lower())
+
+    # Name of each group: an existing graph node of the group, or its best form
+    existing = {}
+    if graph is not None:
+        graph_keys = node_keys(graph)
+        for key in list(groups.parent):
+            node = graph_keys.get(key)
+            if node is not None:
+                existing.setdefault(groups.find(key), node)
+    best = {}
+    for form, (labelled, count, first) in form_stats.items():
+        root = groups.find(form.lower())
+        if root not in best or (labelled, count, -first) > best[root][1]:
+            best[root] = (form, (labelled, count, -first))
+    excluded = stop_words()
+    names = {}
+    for root, (form, _) in best.items():
+        name = existing.get(root, form)
+        keep = name.lower() not in excluded and any(char.isalnum() for char in name)
+        names[root] = name if keep else None
+
+    canonical = {name: names[groups.find(form.lower())] for name, form in forms.items()}
+    results = []
+    for entities, triples, _ in extractions:
+        new_entities, seen = [], set()
+        for name, label in entities:
+            name = canonical[name]
+            if name is not None and name not in seen:
+                seen.add(name)
+                new_entities.append((name, label))
+        new_triples = [(canonical[subj], relation, canonical[obj]) for subj, relation, obj in triples
+                       if canonical[subj] is not None and canonical[obj] is not None and canonical[subj] != canonical[obj]]
+        results.append((new_entities, new_triples, {}))
+    return results
+
+# Function to canonicalize an existing graph (e.g. one built before canonicalization), keeping its provenance
+def canonicalize_graph(G, aliases=()):
+    sources = graph_sources(G)
+    if sources:
+        sources = sorted(sources)
+        extractions = [(*source_contribution(G, source), {}) for source in sources]
+    else:
+        sources = [None]
+        extractions = [([(node, data.get('label')) for node, data in G.nodes(data=True)],
+                        [(u, data.get('relation'), v) for u, v, data in G.edges(data=True)], {})]
+    H = nx.Graph(**G.graph)
+    for source, (entities, triples, _) in zip(sources, canonicalize_extractions(extractions, aliases=aliases)):
+        add_extraction_to_graph(H, entities, triples, source=source)
+    return H
+
+# Function to add the extracted entities and relationships of one paragraph to the graph.
+# With a source, every node and edge also records which sources contributed it ('sources' attribute,
+# mapping source -> label / relation), so the contribution of one source can later be replaced on its own.
+def add_extraction_to_graph(G, entities, triples, source=None):
+    keys = _node_keys.get(G)
+    if keys is not None:        # Index the nodes this adds to the graph (see node_keys)
+        for node in dict.fromkeys([entity for entity, _ in entities] + [node for subj, _, obj in triples for node in (subj, obj)]):
+            if node not in G:
+                keys.add(node)
+    # Iterate through each entity and its label
+    for entity, label in entities:
+        if label is None:
+            G.add_node(entity)      # Entity only known as the endpoint of a relationship, keep any existing label
+        else:
             G.add_node(entity, label=label)     # Add the entity as a node in the graph with its label
-        
-        # Iterate through each relationship
-        for subj, verb, obj in relations:
-             # Add an edge between the subject and object nodes with the relationship as an attribute
-            G.add_edge(subj.text, obj.text, relation=verb.lemma_)
-    
+        if source is not None:
+            sources = G.nodes[entity].setdefault('sources', {})
+            if label is not None or source not in sources:
+                sources[source] = label
+
+    # Iterate through each relationship
+    for subj, relation, obj in triples:
+        # Add an edge between the subject and object nodes with the relationship as an attribute
+        G.add_edge(subj, obj, relation=relation)
+        if source is not None:
+            G.edges[subj, obj].setdefault('sources', {})[source] = relation
+            for node in (subj, obj):
+                G.nodes[node].setdefault('sources', {}).setdefault(source, None)
+
+# Function to remove everything a source contributed to the graph.
+# Nodes and edges that other sources also contributed stay, with the label / relation of the latest remaining source.
+# Given the nodes and node pairs the source contributed (see graph_provenance), only those are looked at instead of
+# every node and edge of the graph.
+def remove_source(G, source, nodes=None, pairs=None):
+    edges = G.edges(data=True) if pairs is None else [(u, v, G.edges[u, v]) for u, v in pairs if G.has_edge(u, v)]
+    for u, v, data in list(edges):
+        sources = data.get('sources')
+        if sources and source in sources:
+            del sources[source]
+            if sources:
+                data['relation'] = list(sources.values())[-1]
+            else:
+                G.remove_edge(u, v)
+    node_data = G.nodes(data=True) if nodes is None else [(node, G.nodes[node]) for node in nodes if node in G]
+    keys = _node_keys.get(G)
+    for node, data in list(node_data):
+        sources = data.get('sources')
+        if sources and source in sources:
+            del sources[source]
+            if not sources:
+                G.remove_node(node)
+                if keys is not None:
+                    keys.remove(node)
+                continue
+            labels = [label for label in sources.values() if label is not None]
+            if labels:
+                data['label'] = labels[-1]
+            else:
+                data.pop('label', None)
+
+# Function to copy a graph, including the provenance dicts, so that updating the copy leaves the original untouched.
+# With nodes, only the attributes and adjacency of those nodes and the edges between them are copied, and the rest
+# is shared with G, so the copy takes time proportional to the part of the graph an update touches. The copy may then
+# only change those nodes and edges, and remove a node only if its neighbours are among nodes too.
+def copy_graph(G, nodes=None):
+    if nodes is None:
+        H = G.copy()
+        for _, data in H.nodes(data=True):
+            if 'sources' in data:
+                data['sources'] = dict(data['sources'])
+        for _, _, data in H.edges(data=True):
+            if 'sources' in data:
+                data['sources'] = dict(data['sources'])
+        return H
+    H = G.__class__()
+    H.graph.update(G.graph)
+    # NetworkX keeps the attributes and adjacency of each node in one dict per node: the copy starts with the same ones
+    H._node = dict(G._node)
+    H._adj = dict(G._adj)
+    owned = {node for node in nodes if node in G._node}
+    for node in owned:
+        data = H._node[node] = dict(G._node[node])
+        if 'sources' in data:
+            data['sources'] = dict(data['sources'])
+        H._adj[node] = dict(G._adj[node])
+    for node in owned:
+        for neighbor, data in H._adj[node].items():
+            if neighbor in owned and data is G._adj[node][neighbor]:        # Not copied yet from the other end
+                data = dict(data)
+                if 'sources' in data:
+                    data['sources'] = dict(data['sources'])
+                H._adj[node][neighbor] = H._adj[neighbor][node] = data
+    return H
+
+# Function to get what a single source contributed to the graph, as (entities, triples)
+def source_contribution(G, source):
+    entities = [(node, data['sources'][source]) for node, data in G.nodes(data=True) if source in data.get('sources', {})]
+    triples = [(u, data['sources'][source], v) for u, v, data in G.edges(data=True) if source in data.get('sources', {})]
+    return entities, triples
+
+# Function to get the set of sources that contributed to the graph (every source records at least one node)
+def graph_sources(G):
+    return {source for _, data in G.nodes(data=True) for source in data.get('sources', {})}
+
+# Function to map every source to what it contributed to the graph, as (set of nodes, set of node pairs)
+def graph_provenance(G):
+    provenance = {}
+    for node, data in G.nodes(data=True):
+        for source in data.get('sources', {}):
+            provenance.setdefault(source, (set(), set()))[0].add(node)
+    for u, v, data in G.edges(data=True):
+        for source in data.get('sources', {}):
+            provenance.setdefault(source, (set(), set()))[1].add((u, v))
+    return provenance
+
+# Function to score the importance of every node with PageRank, stored as the node attribute 'importance' and scaled
+# so the scores average 1. The power iteration starts from the scores the nodes already have (new nodes from 1), so
+# after an update of a graph that was scored before it converges in a few iterations instead of starting over.
+# Returns the number of iterations.
+@metrics.timed()
+def compute_importance(G, damping=IMPORTANCE_DAMPING, tolerance=IMPORTANCE_TOLERANCE, max_iterations=IMPORTANCE_MAX_ITERATIONS):
+    n = G.number_of_nodes()
+    if not n:
+        return 0
+    index = {node: i for i, node in enumerate(G)}
+    ends = np.array([(index[u], index[v]) for u, v in G.edges()], dtype=np.int64).reshape(-1, 2)
+    # Every edge links both ways, a self-loop once, as in networkx.pagerank on an undirected graph
+    not_loop = ends[:, 0] != ends[:, 1]
+    src = np.concatenate([ends[:, 0], ends[not_loop, 1]])
+    dst = np.concatenate([ends[:, 1], ends[not_loop, 0]])
+    out_degree = np.bincount(src, minlength=n).astype(np.float64)
+    dangling = out_degree == 0
+    scores = np.array([data.get('importance', 1.0) for _, data in G.nodes(data=True)], dtype=np.float64)
+    scores /= scores.sum()
+    iterations = 0
+    while iterations < max_iterations:
+        iterations += 1
+        shares = np.divide(scores, out_degree, out=np.zeros(n), where=~dangling)
+        updated = np.bincount(dst, weights=shares[src], minlength=n) * damping
+        updated += (1 - damping + damping * scores[dangling].sum()) / n
+        change = np.abs(updated - scores).sum()        # Mean change of the scores scaled to average 1
+        scores = updated
+        if change < tolerance:
+            break
+    for (_, data), score in zip(G.nodes(data=True), (scores * n).tolist()):
+        data['importance'] = round(score, 6)
+    return iterations
+
+# Function to get the id of a paragraph in the relation store: "<source>#<index>", or just the index without a source
+def paragraph_id(source, index):
+    return index if source is None else f"{source}#{index}"
+
+# Every distinct (subject, relation, object) triple extracted, stored once with the number of times it occurred and
+# the ids of the paragraphs it occurred in (see paragraph_id). The graph keeps one relation per node pair, so a second
+# relation between the same two nodes replaces the first there; the relation store keeps both. Triples are indexed by
+# subject, object and relation (compared ignoring case), so find() is a lookup rather than a scan of all edges.
+class RelationStore:
+    def __init__(self, seq=0):
+        self.triples = {}       # (subject, relation, object) -> {'count': occurrences, 'paragraphs': [paragraph ids]}
+        self.nodes = {}     # node -> {'label': label or None, 'paragraphs': [paragraph ids]}
+        # Indexes from subject, object and lowercased relation to the triples, as insertion-ordered dicts
+        self.by_subject, self.by_object, self.by_relation = {}, {}, {}
+        self.seq = seq      # Update sequence number of the graph the store belongs to
+
+    def __len__(self):
+        return len(self.triples)
+
+    def add_node(self, node, label=None, paragraph=None):
+        info = self.nodes.setdefault(node, {'label': None, 'paragraphs': []})
+        if label is not None:
+            info['label'] = label
+        if paragraph is not None and paragraph not in info['paragraphs']:
+            info['paragraphs'].append(paragraph)
+
+    # Record occurrences of a triple; a triple already in the store only has its count and paragraphs updated
+    def add(self, subj, relation, obj, paragraph=None, count=1):
+        key = (subj, relation, obj)
+        info = self.triples.get(key)
+        if info is None:
+            info = self.triples[key] = {'count': 0, 'paragraphs': []}
+            self.by_subject.setdefault(subj, {})[key] = None
+            self.by_object.setdefault(obj, {})[key] = None
+            self.by_relation.setdefault(str(relation).lower(), {})[key] = None
+            self.add_node(subj)
+            self.add_node(obj)
+        info['count'] += count
+        if paragraph is not None:
+            info['paragraphs'].append(paragraph)
+
+    # Record the extracted entities and relationships of one paragraph
+    def add_extraction(self, entities, triples, paragraph=None):
+        for entity, label in entities:
+            self.add_node(entity, label, paragraph)
+        for subj, relation, obj in triples:
+            self.add(subj, relation, obj, paragraph)
+            self.add_node(subj, paragraph=paragraph)
+            self.add_node(obj, paragraph=paragraph)
+
+    def _remove(self, key):
+        del self.triples[key]
+        subj, relation, obj = key
+        for index, value in ((self.by_subject, subj), (self.by_object, obj), (self.by_relation, str(relation).lower())):
+            del index[value][key]
+            if not index[value]:
+                del index[value]
+
+    # Function to forget the paragraphs of a source (paragraph ids "<source>#..."): triples and nodes that only
+    # occurred there are removed, the others lose those occurrences
+    def remove_source(self, source):
+        prefix = f"{source}#"
+        for key, info in list(self.triples.items()):
+            removed = [p for p in info['paragraphs'] if isinstance(p, str) and p.startswith(prefix)]
+            if removed:
+                info['paragraphs'] = [p for p in info['paragraphs'] if p not in removed]
+                info['count'] -= len(removed)
+                if info['count'] <= 0:
+                    self._remove(key)
+        for node, info in list(self.nodes.items()):
+            if any(isinstance(p, str) and p.startswith(prefix) for p in info['paragraphs']):
+                info['paragraphs'] = [p for p in info['paragraphs'] if not (isinstance(p, str) and p.startswith(prefix))]
+                if not info['paragraphs'] and node not in self.by_subject and node not in self.by_object:
+                    del self.nodes[node]
+
+    # Function to find the triples with the given subject, relation and / or object, in the order they were first
+    # seen, as (subject, relation, object, count, paragraphs)
+    def find(self, subject=None, relation=None, obj=None):
+        selections = []
+        if subject is not None:
+            selections.append(self.by_subject.get(subject, {}))
+        if obj is not None:
+            selections.append(self.by_object.get(obj, {}))
+        if relation is not None:
+            selections.append(self.by_relation.get(str(relation).lower(), {}))
+        if not selections:
+            keys = self.triples
+        else:
+            selections.sort(key=len)        # Walk the smallest selection, check the others
+            keys = [key for key in selections[0] if all(key in selection for selection in selections[1:])]
+        return [(*key, self.triples[key]['count'], self.triples[key]['paragraphs']) for key in keys]
+
+    # Function to find the triples a node takes part in, as subject or as object
+    def find_node(self, node):
+        return self.find(subject=node) + [triple for triple in self.find(obj=node) if triple[0] != node]
+
+    # Function to get the store as a directed multigraph with one edge per triple, keyed by relation
+    def to_multigraph(self):
+        G = nx.MultiDiGraph(seq=self.seq)
+        for node, info in self.nodes.items():
+            G.add_node(node, **({'label': info['label']} if info['label'] is not None else {}))
+        for (subj, relation, obj), info in self.triples.items():
+            G.add_edge(subj, obj, key=relation, relation=relation, count=info['count'], paragraphs=info['paragraphs'])
+        return G
+
+    # Function to get the store in the node / edge schema of save_graph_to_json, with a count and the paragraph ids
+    # on each edge (one edge per triple)
+    def node_link_data(self):
+        return {
+            'nodes': [{'id': node, 'label': info['label'] if info['label'] is not None else 'No label',
+                       'paragraphs': info['paragraphs']} for node, info in self.nodes.items()],
+            'edges': [{'source': subj, 'target': obj, 'relation': relation, 'count': info['count'],
+                       'paragraphs': info['paragraphs']} for (subj, relation, obj), info in self.triples.items()],
+            'seq': self.seq,
+        }
+
+    # Function to load a store from node / edge data; a plain graph file (no counts or paragraphs) counts each edge once
+    @classmethod
+    def from_node_link_data(cls, data):
+        store = cls(seq=data.get('seq', 0))
+        for node in data['nodes']:
+            label = node.get('label', 'No label')
+            store.nodes[node['id']] = {'label': label if label != 'No label' else None,
+                                       'paragraphs': list(node.get('paragraphs', []))}
+        for edge in data['edges']:
+            store.add(edge['source'], edge['relation'], edge['target'], count=edge.get('count', 1))
+            store.triples[(edge['source'], edge['relation'], edge['target'])]['paragraphs'].extend(edge.get('paragraphs', []))
+        return store
+
+# Function to parse the paragraphs, one at a time or batched through nlp.pipe. Both paths are lazy: the model is
+# only loaded once the first doc is asked for, so a run with nothing to parse never loads it.
+def parse_paragraphs(data, batch_size=None, n_process=1):
+    if batch_size is None and n_process == 1:
+        for paragraph in data:
+            yield get_nlp()(paragraph)      # Process each paragraph on its own using the spaCy model
+        return
+    # Batched mode: stream the paragraphs through nlp.pipe, optionally across several worker processes.
+    # nlp.pipe yields the docs in input order, so the graph is the same as in the serial path.
+    yield from get_nlp().pipe(data, batch_size=batch_size or DEFAULT_BATCH_SIZE, n_process=n_process)
+
+# On-disk cache of extraction results, keyed by a hash of the paragraph text and the pipeline version.
+# Paragraphs that are found in the cache skip spaCy entirely; the least recently used entries are evicted
+# once the cache holds more than max_entries paragraphs.
+class ParseCache:
+    def __init__(self, path='parse_cache.sqlite', max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS parses (key TEXT PRIMARY KEY, result TEXT, last_used INTEGER)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS parses_last_used ON parses (last_used)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self._clock = self._conn.execute('SELECT COALESCE(MAX(last_used), 0) FROM parses').fetchone()[0]
+
+    # Make sure the stored entries belong to the current model and pipeline, dropping them otherwise
+    def _check_version(self):
+        version = pipeline_version()
+        if version != self._version:
+            row = self._conn.execute("SELECT value FROM meta WHERE name = 'pipeline_version'").fetchone()
+            if row is not None and row[0] != version:
+                self._clear()
+            with self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('pipeline_version', ?)", (version,))
+            self._version = version
+        return version
+
+    @staticmethod
+    def _key(version, paragraph):
+        return hashlib.sha256(f"{version}\0{paragraph}".encode('utf-8')).hexdigest()
+
+    # Look up several paragraphs at once; returns {paragraph: (entities, triples, lemmas)} for the ones that are cached
+    def get_many(self, paragraphs):
+        with self._lock:
+            version = self._check_version()
+            keys = {self._key(version, paragraph): paragraph for paragraph in paragraphs}
+            found = {}
+            key_list = list(keys)
+            for i in range(0, len(key_list), 500):      # Stay below SQLite's limit on query parameters
+                chunk = key_list[i:i + 500]
+                rows = self._conn.execute(f"SELECT key, result FROM parses WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                for key, result in rows:
+                    entities, triples, lemmas = json.loads(result)
+                    found[keys[key]] = ([tuple(e) for e in entities], [tuple(t) for t in triples], lemmas)
+            if found:
+                self._clock += 1
+                with self._conn:
+                    self._conn.executemany('UPDATE parses SET last_used = ? WHERE key = ?',
+                                           [(self._clock, self._key(version, paragraph)) for paragraph in found])
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            return found
+
+    # Store the extraction results of several paragraphs, then evict the least recently used entries over the cap
+    def put_many(self, results):
+        with self._lock:
+            version = self._check_version()
+            self._clock += 1
+            with self._conn:
+                self._conn.executemany('INSERT OR REPLACE INTO parses VALUES (?, ?, ?)',
+                                       [(self._key(version, paragraph), json.dumps(result), self._clock)
+                                        for paragraph, result in results.items()])
+                overflow = self._conn.execute('SELECT COUNT(*) FROM parses').fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    self._conn.execute('DELETE FROM parses WHERE key IN '
+                                       '(SELECT key FROM parses ORDER BY last_used LIMIT ?)', (overflow,))
+
+    def _clear(self):
+        with self._conn:
+            self._conn.execute('DELETE FROM parses')
+
+    # Drop every cached paragraph, e.g. after the model files were updated in place
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            self._version = None
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM parses').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries, 'max_entries': self.max_entries}
+
+    def close(self):
+        self._conn.close()
+
+
+# Function to extract the entities and relationships of every paragraph, in input order.
+# With a cache, only the paragraphs that are not cached yet go through spaCy.
+def extract_paragraphs(data, batch_size=None, n_process=1, cache=None):
+    if cache is None:
+        for doc in parse_paragraphs(data, batch_size=batch_size, n_process=n_process):     # Each paragraph is parsed once
+            metrics.increment('paragraphs_parsed')
+            yield extract_from_doc(doc)
+        return
+
+    data = list(data)
+    results = cache.get_many(data)
+    missing = [paragraph for paragraph in dict.fromkeys(data) if paragraph not in results]
+    metrics.increment('paragraphs_cached', len(data) - len(missing))
+    docs = zip(missing, parse_paragraphs(missing, batch_size=batch_size, n_process=n_process))
+    parsed = {}
+    for paragraph in data:
+        # Missing paragraphs are parsed in order of first appearance, so results can be yielded as they come
+        if paragraph not in results:
+            for missing_paragraph, doc in docs:
+                metrics.increment('paragraphs_parsed')
+                parsed[missing_paragraph] = results[missing_paragraph] = extract_from_doc(doc)
+                if missing_paragraph == paragraph:
+                    break
+        yield results[paragraph]
+    if parsed:
+        cache.put_many(parsed)
+
+# Function to build a knowledge graph from the given data.
+# Pass an existing graph to merge into it, and a source to record provenance on the nodes and edges.
+# progress, if given, is called with the number of paragraphs processed so far after each paragraph.
+# With canonicalize (default: CANONICALIZE), all extractions are canonicalized as one batch before they are merged.
+# Every triple is also recorded in relations, if a RelationStore is given.
+@metrics.timed()
+def build_knowledge_graph(data, batch_size=None, n_process=1, cache=None, graph=None, source=None, progress=None,
+                          canonicalize=None, relations=None):
+    G = nx.Graph() if graph is None else graph      # Initialize an empty graph using NetworkX
+    canonicalize = CANONICALIZE if canonicalize is None else canonicalize
+
+    extractions = extract_paragraphs(data, batch_size=batch_size, n_process=n_process, cache=cache)
+    if canonicalize:
+        extracted = []
+        for processed, extraction in enumerate(extractions, 1):
+            extracted.append(extraction)
+            if progress:
+                progress(processed)
+        for index, (entities, triples, _) in enumerate(canonicalize_extractions(extracted, graph=G)):
+            add_extraction_to_graph(G, entities, triples, source=source)
+            if relations is not None:
+                relations.add_extraction(entities, triples, paragraph_id(source, index))
+        return G
+
+    for processed, (entities, triples, _) in enumerate(extractions, 1):
+        add_extraction_to_graph(G, entities, triples, source=source)
+        if relations is not None:
+            relations.add_extraction(entities, triples, paragraph_id(source, processed - 1))
+        if progress:
+            progress(processed)
+
     return G        #this is a constructed graph
 
 # Function to read data from a CSV file
+@metrics.timed()
 def read_data_from_csv(file_path):
     df = pd.read_csv(file_path)     #reading csv
     paragraphs = df['paragraphs'].dropna().tolist()     # Extract the 'paragraphs' column and convert it to a list, dropping any NA values
     return paragraphs
 
+# Function to merge the paragraphs of a source into an existing graph, replacing what that source contributed before
+def ingest_paragraphs(G, paragraphs, source, batch_size=None, n_process=1, cache=None, relations=None):
+    remove_source(G, source)
+    if relations is not None:
+        relations.remove_source(source)
+    return build_knowledge_graph(paragraphs, batch_size=batch_size, n_process=n_process, cache=cache, graph=G, source=source,
+                                 relations=relations)
+
+# Function to merge a CSV written by WebScraping_Small-2.py into an existing graph; the source defaults to the file name
+def ingest_csv(G, file_path, source=None, batch_size=None, n_process=1, cache=None, relations=None):
+    source = source or os.path.basename(file_path)
+    return ingest_paragraphs(G, read_data_from_csv(file_path), source, batch_size=batch_size, n_process=n_process, cache=cache,
+                             relations=relations)
+
+# Function to write a file atomically: the data goes to a temporary file next to it, which then replaces the file
+# in one step, so readers (and memory-mapped snapshots) see either the old or the new file, never a half-written one
+@contextlib.contextmanager
+def atomic_write(filename, mode='w'):
+    tmp_path = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)     # Writing failed; the old file is left as it was
+
 # Function to save the knowledge graph to a JSON file
+@metrics.timed()
 def save_graph_to_json(graph, filename='graph.json'):
     # Convert graph nodes and edges to a dictionary format
     data = {
         'nodes': [{'id': node, 'label': data.get('label', 'No label')} for node, data in graph.nodes(data=True)],
         'edges': [{'source': u, 'target': v, 'relation': data.get('relation', 'No relation')} for u, v, data in graph.edges(data=True)]
     }
-    # Open the specified file in write mode
-    with open(filename, 'w') as f:
+    # Keep the importance scores, the provenance and the update sequence number of incrementally maintained graphs
+    for node, (_, attrs) in zip(data['nodes'], graph.nodes(data=True)):
+        if 'importance' in attrs:
+            node['importance'] = attrs['importance']
+        if 'sources' in attrs:
+            node['sources'] = attrs['sources']
+    for edge, (_, _, attrs) in zip(data['edges'], graph.edges(data=True)):
+        if 'sources' in attrs:
+            edge['sources'] = attrs['sources']
+    if 'seq' in graph.graph:
+        data['seq'] = graph.graph['seq']
+    # Open a temporary file in write mode; it replaces the specified file once complete
+    with atomic_write(filename, 'w') as f:
         # Dump the dictionary to the file as a JSON object
         json.dump(data, f, indent=2)
 
+# Function to load a graph saved by save_graph_to_json, including its importance scores and provenance
+@metrics.timed()
+def read_graph_from_json(filename):
+    with open(filename) as f:
+        data = json.load(f)
+    G = nx.Graph(seq=data.get('seq', 0))
+    for node in data['nodes']:
+        attrs = {'label': node['label']} if node.get('label', 'No label') != 'No label' else {}
+        if 'importance' in node:
+            attrs['importance'] = node['importance']
+        if 'sources' in node:
+            attrs['sources'] = node['sources']
+        G.add_node(node['id'], **attrs)
+    for edge in data['edges']:
+        attrs = {'relation': edge['relation']}
+        if 'sources' in edge:
+            attrs['sources'] = edge['sources']
+        G.add_edge(edge['source'], edge['target'], **attrs)
+    return G
+
+# Function to get the path of the relation store kept next to a graph file
+def relations_path(filename):
+    return os.path.splitext(filename)[0] + '.relations.json'
+
+# Function to save a relation store to a JSON file
+def save_relations_to_json(relations, filename):
+    with atomic_write(filename, 'w') as f:
+        json.dump(relations.node_link_data(), f)
+
+# Function to load a relation store saved by save_relations_to_json
+def read_relations_from_json(filename):
+    with open(filename) as f:
+        return RelationStore.from_node_link_data(json.load(f))
+
+# Function to load the relation store of a graph file. A graph saved before it had one seeds it with its edges,
+# each counted once, read from G if the graph is already loaded; without a graph file the store is empty.
+def load_relations(filename, G=None):
+    if os.path.exists(relations_path(filename)):
+        return read_relations_from_json(relations_path(filename))
+    if G is None:
+        if not os.path.exists(filename):
+            return RelationStore()
+        G = read_graph(filename)
+    return RelationStore.from_node_link_data({
+        'nodes': [{'id': node, 'label': data.get('label', 'No label')} for node, data in G.nodes(data=True)],
+        'edges': [{'source': u, 'target': v, 'relation': data.get('relation')} for u, v, data in G.edges(data=True)],
+        'seq': G.graph.get('seq', 0)})
+
+# Function to name the word vectors of a model, so node vectors are only compared with vectors of the same model;
+# None if the model has no word vectors (en_core_web_sm)
+def vectors_model(nlp):
+    if not nlp.vocab.vectors.shape[0]:
+        return None
+    return f"{nlp.meta.get('lang')}_{nlp.meta.get('name')}-{nlp.meta.get('version')}"
+
+# Function to compute the unit vector of each text (node names or a query): the mean of the word vectors of its
+# tokens, trying the lowercase form of a token without one. Texts with no known word get a zero vector.
+def embed_texts(texts, nlp=None):
+    nlp = nlp or get_vectors_nlp()
+    table = nlp.vocab.vectors
+    embedded = np.zeros((len(texts), table.shape[1]), dtype=np.float32)
+    for i, doc in enumerate(nlp.tokenizer.pipe(texts, batch_size=1000)):
+        tokens = [token for token in doc if not token.is_punct and not token.is_space]
+        if not tokens:
+            continue
+        rows = table.find(keys=[token.orth for token in tokens])
+        missing = np.flatnonzero(rows < 0)
+        if len(missing):
+            rows[missing] = table.find(keys=[tokens[j].lower for j in missing])
+        rows = rows[rows >= 0]
+        if len(rows):
+            embedded[i] = np.asarray(table.data[rows]).mean(axis=0)
+    return node_vectors.normalize_rows(embedded)
+
+# Function to get the path of the node vector file kept next to a graph file, e.g. knowledge_graph.kgvec
+def vectors_path(filename):
+    return os.path.splitext(filename)[0] + node_vectors.VECTORS_SUFFIX
+
+# Function to bring the node vectors kept next to a graph file up to date with the graph. Only the nodes that are
+# new since the saved vectors are embedded; vectors of another model are recomputed. Returns the NodeVectors, or
+# None if the model has no word vectors.
+@metrics.timed()
+def update_node_vectors(G, filename, nlp=None):
+    nlp = nlp or get_vectors_nlp()
+    model = vectors_model(nlp)
+    if model is None:
+        return None
+    previous = None
+    if os.path.exists(vectors_path(filename)):
+        try:
+            previous = node_vectors.NodeVectors.load(vectors_path(filename))
+        except (OSError, ValueError):
+            previous = None     # Unreadable file, computed again
+    if previous is None or previous.model != model:
+        previous = node_vectors.NodeVectors([], np.zeros((0, nlp.vocab.vectors.shape[1]), dtype=np.float32), model=model)
+    vectors = previous.updated(G.nodes(), lambda names: embed_texts(names, nlp), seq=G.graph.get('seq', 0))
+    vectors.save(vectors_path(filename))
+    return vectors
+
+# Compact binary snapshot format (*.kgsnap), an alternative to the JSON file for large graphs.
+# Layout: SNAPSHOT_MAGIC, the length of a JSON header (8 bytes, little-endian), the header, then 8-byte aligned arrays.
+# Node ids are stored once, sorted, as one UTF-8 blob with an offset array, and found through a sorted hash table.
+# Labels, relations and sources are interned in string tables in the header and referenced by int32 codes (-1 = none).
+# Node importance scores are a float32 array (NaN = not scored); snapshots written before they existed have none.
+# Edges are stored in their original order (edge_src, edge_dst, edge_rel) and as a CSR adjacency
+# (indptr, indices, adj_edge), so neighbours are found without building Python dicts per edge.
+SNAPSHOT_MAGIC = b'KGSNAP1\n'
+SNAPSHOT_SUFFIX = '.kgsnap'
+
+# Function to intern a value into a string table, returning its code (-1 for None)
+def _intern(table, value):
+    if value is None:
+        return -1
+    return table.setdefault(value, len(table))
+
+# Function to build a CSR offsets array from per-row counts
+def _offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+# Function to hash an encoded node id for the snapshot's node lookup table
+def _node_hash(encoded):
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), 'little')
+
+# Function to get the file offset at which the arrays of a snapshot start
+def _snapshot_data_start(header_len):
+    return -(-(len(SNAPSHOT_MAGIC) + 8 + header_len) // 8) * 8
+
+# Function to write the knowledge graph as a binary snapshot to a binary file object
+def write_graph_snapshot(graph, f):
+    nodes = list(graph.nodes(data=True))
+    encoded = [str(node).encode('utf-8') for node, _ in nodes]
+    order = sorted(range(len(nodes)), key=encoded.__getitem__)      # Sorted position -> insertion position
+    position = np.empty(len(nodes), dtype=np.int32)      # Insertion position -> sorted position
+    position[order] = np.arange(len(nodes), dtype=np.int32)
+    index = {node: int(position[i]) for i, (node, _) in enumerate(nodes)}
+
+    # Sorted 64-bit hashes of the node ids, so a node is found with one searchsorted instead of a string binary search
+    node_hash = np.array([_node_hash(encoded[i]) for i in order], dtype=np.uint64)
+    hash_order = np.argsort(node_hash, kind='stable')
+
+    labels, relations, sources = {}, {}, {}
+    node_label = np.array([_intern(labels, nodes[i][1].get('label')) for i in order], dtype=np.int32)
+    node_importance = np.array([nodes[i][1].get('importance', np.nan) for i in order], dtype=np.float32)
+    node_sources = [nodes[i][1].get('sources', {}) for i in order]
+    node_src = [_intern(sources, s) for node_s in node_sources for s in node_s]
+    node_src_label = [_intern(labels, label) for node_s in node_sources for label in node_s.values()]
+
+    edges = list(graph.edges(data=True))
+    edge_src = np.array([index[u] for u, _, _ in edges], dtype=np.int32)
+    edge_dst = np.array([index[v] for _, v, _ in edges], dtype=np.int32)
+    edge_rel = np.array([_intern(relations, data.get('relation')) for _, _, data in edges], dtype=np.int32)
+    edge_sources = [data.get('sources', {}) for _, _, data in edges]
+    edge_src_codes = [_intern(sources, s) for edge_s in edge_sources for s in edge_s]
+    edge_src_rel = [_intern(relations, relation) for edge_s in edge_sources for relation in edge_s.values()]
+
+    # Each edge appears in the adjacency of both endpoints (self-loops once), sorted by node with a stable sort
+    edge_ids = np.arange(len(edges), dtype=np.int32)
+    not_loop = edge_src != edge_dst
+    heads = np.concatenate([edge_src, edge_dst[not_loop]])
+    tails = np.concatenate([edge_dst, edge_src[not_loop]])
+    adj_edges = np.concatenate([edge_ids, edge_ids[not_loop]])
+    adj_order = np.argsort(heads, kind='stable')
+
+    arrays = {
+        'node_offsets': _offsets([len(encoded[i]) for i in order]),
+        'node_bytes': np.frombuffer(b''.join(encoded[i] for i in order), dtype=np.uint8),
+        'node_label': node_label,
+        'node_importance': node_importance,
+        'node_order': position,
+        'node_hash': node_hash[hash_order],
+        'node_hash_index': hash_order.astype(np.int32),
+        'edge_src': edge_src,
+        'edge_dst': edge_dst,
+        'edge_rel': edge_rel,
+        'indptr': _offsets(np.bincount(heads, minlength=len(nodes))),
+        'indices': tails[adj_order].astype(np.int32),
+        'adj_edge': adj_edges[adj_order].astype(np.int32),
+        'node_src_ptr': _offsets([len(s) for s in node_sources]),
+        'node_src': np.array(node_src, dtype=np.int32),
+        'node_src_label': np.array(node_src_label, dtype=np.int32),
+        'edge_src_ptr': _offsets([len(s) for s in edge_sources]),
+        'edge_src_codes': np.array(edge_src_codes, dtype=np.int32),
+        'edge_src_rel': np.array(edge_src_rel, dtype=np.int32),
+    }
+    header = {'nodes': len(nodes), 'edges': len(edges), 'graph': graph.graph,
+              'labels': list(labels), 'relations': list(relations), 'sources': list(sources), 'arrays': {}}
+    # Array offsets are relative to the start of the data, the first 8-byte boundary after the header
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = [offset, array.dtype.str, len(array)]
+        offset += -(-array.nbytes // 8) * 8
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _snapshot_data_start(len(header_bytes))
+
+    f.write(SNAPSHOT_MAGIC)
+    f.write(len(header_bytes).to_bytes(8, 'little'))
+    f.write(header_bytes)
+    f.write(b'\0' * (data_start - len(SNAPSHOT_MAGIC) - 8 - len(header_bytes)))
+    for name, array in arrays.items():
+        f.write(array.tobytes())
+        f.write(b'\0' * (-array.nbytes % 8))
+
+# Function to save the knowledge graph as a binary snapshot
+@metrics.timed()
+def save_graph_to_snapshot(graph, filename='graph.kgsnap'):
+    with atomic_write(filename, 'wb') as f:     # Never overwrite a file that servers may have memory-mapped
+        write_graph_snapshot(graph, f)
+
+# Function to serialize the knowledge graph into an in-memory binary snapshot
+def graph_snapshot_bytes(graph):
+    buffer = io.BytesIO()
+    write_graph_snapshot(graph, buffer)
+    return buffer.getvalue()
+
+# Read-only view of a binary snapshot, opened from a file name or from the bytes of graph_snapshot_bytes().
+# A file is memory-mapped and the arrays are views on the mapping, so opening a snapshot costs almost nothing
+# and only the pages that queries touch are read from disk.
+class GraphSnapshot:
+    def __init__(self, source):
+        if isinstance(source, str):
+            self.filename = source
+            with open(source, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.filename = None
+            self._mmap = source
+        if self._mmap[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError(f"'{self.filename}' is not a knowledge graph snapshot")
+        header_start = len(SNAPSHOT_MAGIC) + 8
+        header_len = int.from_bytes(self._mmap[len(SNAPSHOT_MAGIC):header_start], 'little')
+        header = json.loads(self._mmap[header_start:header_start + header_len])
+        self.graph = header['graph']
+        self.labels = header['labels']
+        self.relations = header['relations']
+        self.sources = header['sources']
+        self._num_nodes = header['nodes']
+        self._num_edges = header['edges']
+        data_start = _snapshot_data_start(header_len)
+        self._bytes_start = data_start + header['arrays']['node_bytes'][0]
+        self.arrays = {name: np.frombuffer(self._mmap, dtype=dtype, count=length, offset=data_start + offset)
+                       for name, (offset, dtype, length) in header['arrays'].items()}
+
+    def number_of_nodes(self):
+        return self._num_nodes
+
+    def number_of_edges(self):
+        return self._num_edges
+
+    # Function to get the id of the node at a sorted position
+    def node_name(self, i):
+        offsets = self.arrays['node_offsets']
+        return self._mmap[self._bytes_start + int(offsets[i]):self._bytes_start + int(offsets[i + 1])].decode('utf-8')
+
+    # Function to find the sorted position of a node id (None if the node does not exist)
+    def node_index(self, node):
+        name = str(node)
+        node_hash = self.arrays['node_hash']
+        target = np.uint64(_node_hash(name.encode('utf-8')))
+        i = int(np.searchsorted(node_hash, target))
+        while i < self._num_nodes and node_hash[i] == target:      # Hash collisions are checked against the id
+            candidate = int(self.arrays['node_hash_index'][i])
+            if self.node_name(candidate) == name:
+                return candidate
+            i += 1
+        return None
+
+    def has_node(self, node):
+        return self.node_index(node) is not None
+
+    def _string(self, table, code):
+        return table[code] if code >= 0 else None
+
+    # Function to get a node's label (None if it has none, KeyError if the node does not exist)
+    def node_label(self, node):
+        i = self.node_index(node)
+        if i is None:
+            raise KeyError(node)
+        return self._string(self.labels, int(self.arrays['node_label'][i]))
+
+    # Function to get a node's importance score (0 if it has none, KeyError if the node does not exist)
+    def node_importance(self, node):
+        i = self.node_index(node)
+        if i is None:
+            raise KeyError(node)
+        if 'node_importance' not in self.arrays or np.isnan(self.arrays['node_importance'][i]):
+            return 0.0
+        return float(self.arrays['node_importance'][i])
+
+    # Function to iterate over the edges in decreasing order of the summed importance of their two nodes, edges of
+    # equal importance (all of them without scores) in their original order, as (u, v, relation)
+    def ranked_edges(self):
+        if 'node_importance' not in self.arrays:
+            yield from self.edges()
+            return
+        importance = np.nan_to_num(self.arrays['node_importance'])
+        src, dst, rel = self.arrays['edge_src'], self.arrays['edge_dst'], self.arrays['edge_rel']
+        order = np.argsort(-(importance[src].astype(np.float64) + importance[dst]), kind='stable')
+        names = {}
+        for u, v, r in zip(src[order].tolist(), dst[order].tolist(), rel[order].tolist()):
+            if u not in names:
+                names[u] = self.node_name(u)
+            if v not in names:
+                names[v] = self.node_name(v)
+            yield names[u], names[v], self._string(self.relations, r)
+
+    # Function to get the neighbours of a node with the relation of the connecting edge, as (neighbour, relation)
+    def neighbors(self, node):
+        i = self.node_index(node)
+        if i is None:
+            raise KeyError(node)
+        start, end = int(self.arrays['indptr'][i]), int(self.arrays['indptr'][i + 1])
+        relations = self.arrays['edge_rel'][self.arrays['adj_edge'][start:end]].tolist()
+        return [(self.node_name(j), self._string(self.relations, r))
+                for j, r in zip(self.arrays['indices'][start:end].tolist(), relations)]
+
+    # Function to iterate over the nodes in their original order, as (node, label)
+    def nodes(self):
+        node_label = self.arrays['node_label']
+        for i in self.arrays['node_order'].tolist():
+            yield self.node_name(i), self._string(self.labels, int(node_label[i]))
+
+    # Function to iterate over the edges in their original order, as (u, v, relation)
+    def edges(self):
+        names = {}
+        for u, v, r in zip(self.arrays['edge_src'].tolist(), self.arrays['edge_dst'].tolist(), self.arrays['edge_rel'].tolist()):
+            if u not in names:
+                names[u] = self.node_name(u)
+            if v not in names:
+                names[v] = self.node_name(v)
+            yield names[u], names[v], self._string(self.relations, r)
+
+    # Function to build a NetworkX graph with the same nodes, edges, attributes and provenance
+    def to_networkx(self, missing_label=None):
+        names = [self.node_name(i) for i in range(self._num_nodes)]
+        node_label = self.arrays['node_label'].tolist()
+        src_ptr, src, src_label = (self.arrays[name].tolist() for name in ('node_src_ptr', 'node_src', 'node_src_label'))
+        importance = self.arrays['node_importance'].tolist() if 'node_importance' in self.arrays else None
+        G = nx.Graph(**self.graph)
+        for i in self.arrays['node_order'].tolist():
+            attrs = {}
+            label = self._string(self.labels, node_label[i]) or missing_label
+            if label is not None:
+                attrs['label'] = label
+            if importance is not None and not math.isnan(importance[i]):
+                attrs['importance'] = round(importance[i], 6)
+            if src_ptr[i] < src_ptr[i + 1]:
+                attrs['sources'] = {self.sources[s]: self._string(self.labels, l)
+                                    for s, l in zip(src[src_ptr[i]:src_ptr[i + 1]], src_label[src_ptr[i]:src_ptr[i + 1]])}
+            G.add_node(names[i], **attrs)
+        src_ptr, src, src_rel = (self.arrays[name].tolist() for name in ('edge_src_ptr', 'edge_src_codes', 'edge_src_rel'))
+        edge_src, edge_dst, edge_rel = (self.arrays[name].tolist() for name in ('edge_src', 'edge_dst', 'edge_rel'))
+        for e in range(self._num_edges):
+            attrs = {}
+            if edge_rel[e] >= 0:
+                attrs['relation'] = self.relations[edge_rel[e]]
+            if src_ptr[e] < src_ptr[e + 1]:
+                attrs['sources'] = {self.sources[s]: self._string(self.relations, r)
+                                    for s, r in zip(src[src_ptr[e]:src_ptr[e + 1]], src_rel[src_ptr[e]:src_ptr[e + 1]])}
+            G.add_edge(names[edge_src[e]], names[edge_dst[e]], **attrs)
+        return G
+
+    def close(self):
+        self.arrays = {}        # Drop the views first, the mapping cannot be closed while they exist
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+
+# Function to save the graph in the format given by the file name: a binary snapshot for *.kgsnap, JSON otherwise
+def save_graph(graph, filename):
+    if filename.endswith(SNAPSHOT_SUFFIX):
+        save_graph_to_snapshot(graph, filename)
+    else:
+        save_graph_to_json(graph, filename)
+
+# Function to load a graph saved by save_graph, in either format
+def read_graph(filename):
+    if not filename.endswith(SNAPSHOT_SUFFIX):
+        return read_graph_from_json(filename)
+    snapshot = GraphSnapshot(filename)
+    try:
+        return snapshot.to_networkx()
+    finally:
+        snapshot.close()
+
+# Path of the update journal kept next to a graph file, e.g. knowledge_graph.updates.jsonl
+def graph_updates_path(filename):
+    return os.path.splitext(filename)[0] + '.updates.jsonl'
+
+# Function to read the sequence number of the last record in a graph's update journal (0 if there is none)
+def last_graph_update_seq(filename):
+    try:
+        with open(graph_updates_path(filename), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            for start in (max(size - 65536, 0), 0):     # Look at the tail first, the whole journal if a record is longer
+                f.seek(start)
+                for line in reversed(f.read().splitlines()):
+                    try:
+                        return json.loads(line)['seq']
+                    except (ValueError, KeyError):
+                        continue        # Partially written line, or the cut-off start of a long record
+    except OSError:
+        pass
+    return 0
+
+# Function to publish a new version of the graph: the graph file (JSON or snapshot) is rewritten, then the change is recorded in the
+# update journal, which running query servers replay instead of reloading the whole file.
+# With a source, only that source's new contribution is journaled; without one the whole graph was rebuilt and
+# the journal restarts with a reset record.
+# The node importance scores are refreshed first (compute_importance). The relation store of the graph, if given, is
+# saved next to it (relations_path) before the graph file, and so are the node vectors (vectors_path) unless
+# NODE_VECTORS is off.
+@metrics.timed()
+def publish_graph(G, filename='knowledge_graph.json', source=None, relations=None):
+    # Sequence numbers keep growing across rebuilds and restarts, so servers can tell new records from replayed ones
+    G.graph['seq'] = max(G.graph.get('seq', 0), last_graph_update_seq(filename)) + 1
+    compute_importance(G)
+    if relations is not None:
+        relations.seq = G.graph['seq']
+        save_relations_to_json(relations, relations_path(filename))
+    if NODE_VECTORS:
+        try:
+            update_node_vectors(G, filename)
+        except OSError:
+            # No model to embed the new nodes with (e.g. every paragraph came from the parse cache): publish the graph
+            # without vectors rather than leave vectors of an older version next to it
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(vectors_path(filename))
+    save_graph(G, filename)     # Written first, so a server that reads the file never misses a journaled update
+    if source is None:
+        # Replace the journal as a new file, so servers following the old one notice the restart
+        with atomic_write(graph_updates_path(filename), 'w') as f:
+            f.write(json.dumps({'seq': G.graph['seq'], 'reset': True}) + '\n')
+    else:
+        entities, triples = source_contribution(G, source)
+        with open(graph_updates_path(filename), 'a') as f:
+            f.write(json.dumps({'seq': G.graph['seq'], 'source': source, 'entities': entities, 'triples': triples}) + '\n')
+
+# Function to apply one journaled update to a graph; returns False for a reset, which needs the graph file reloaded.
+# previous, the (nodes, node pairs) the source contributed so far (see graph_provenance), saves a scan of the graph.
+def apply_graph_update(G, update, previous=None):
+    if update.get('reset'):
+        return False
+    remove_source(G, update['source'], *(previous or ()))
+    add_extraction_to_graph(G, update['entities'], update['triples'], source=update['source'])
+    G.graph['seq'] = update['seq']
+    return True
+
+# Function to get what a journaled update contributes to the graph, as (set of nodes, set of node pairs)
+def update_contribution(update):
+    pairs = {(subj, obj) for subj, _, obj in update['triples']}
+    return {entity for entity, _ in update['entities']} | {node for pair in pairs for node in pair}, pairs
+
+# Function to apply journaled updates (no reset) to a copy of G that shares everything they do not touch with G
+# (see copy_graph), so G stays as it was. provenance (see graph_provenance) tells what each source contributed to G.
+# Returns (the updated copy, the nodes and the node pairs that may have changed, the provenance of the copy); each pair
+# is listed once, as (subject, object) if a record has a triple between the two nodes.
+def apply_graph_updates(G, updates, provenance):
+    provenance = dict(provenance)
+    latest = {}     # source -> its contribution after the updates
+    nodes, pairs = set(), {}        # pairs: frozenset({u, v}) -> (u, v)
+    for update in updates:
+        latest[update['source']] = update_contribution(update)
+        for contribution in (provenance.get(update['source'], ((), ())), latest[update['source']]):
+            nodes.update(contribution[0])
+            pairs.update((frozenset(pair), pair) for pair in contribution[1])
+    # A node left without sources is removed with all its edges, which changes the adjacency of its neighbours too
+    kept = {node for contribution in latest.values() for node in contribution[0]}
+    for node in list(nodes - kept):
+        node_sources = G.nodes[node].get('sources') if node in G else None
+        if node_sources and latest.keys() >= node_sources.keys():
+            for neighbor in G[node]:
+                nodes.add(neighbor)
+                pairs.setdefault(frozenset((node, neighbor)), (node, neighbor))
+    H = copy_graph(G, nodes)
+    for update in updates:
+        apply_graph_update(H, update, provenance.get(update['source']))
+        provenance[update['source']] = update_contribution(update)
+    return H, nodes, list(pairs.values()), provenance
+
 # Main execution block
 if __name__ == "__main__":
     csv_file = input("Enter the CSV file path: ")
+    n_process = int(input("Enter the number of worker processes (default 1): ") or 1)
     paragraphs = read_data_from_csv(csv_file)
-    G = build_knowledge_graph(paragraphs)       # Build the knowledge graph from the data
+    # Build the knowledge graph from the data, batched through nlp.pipe when several workers are requested
+    relations = RelationStore()
+    G = build_knowledge_graph(paragraphs, batch_size=DEFAULT_BATCH_SIZE if n_process > 1 else None, n_process=n_process,
+                              relations=relations)
     
     print("Nodes:", G.nodes(data=True))
     print("Edges:", G.edges(data=True))
 
-    # Save the graph to a JSON file
+    # Score the nodes and save the graph to a JSON file
+    compute_importance(G)
     save_graph_to_json(G, filename='knowledge_graph.json')
+    save_relations_to_json(relations, relations_path('knowledge_graph.json'))
     print("Knowledge Graph saved to 'knowledge_graph.json'.")
+    print(f"{len(relations)} distinct relationships saved to '{relations_path('knowledge_graph.json')}'.")
+    if NODE_VECTORS:
+        vectors = update_node_vectors(G, 'knowledge_graph.json')
+        if vectors is not None:
+            print(f"Vectors of {len(vectors)} nodes saved to '{vectors_path('knowledge_graph.json')}'.")
@@ -1,10 +1,118 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
+import os
+import sys
+
+# KnowledgeGraphConstruction and the modules it uses (metrics, node_vectors) live at the top of the repository,
+# one directory up, and are shared with the query server rather than copied here
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 import KnowledgeGraphConstruction as kgc 
+import metrics
 #import build_knowledge_graph, save_graph_to_json, read_data_from_csv
-import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import networkx as nx
 
 app = Flask(__name__)
 
+# Time every request as the stage "<METHOD> <route>", e.g. "POST /ingest"
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    if metrics.ENABLED and 'request_started' in g and request.url_rule is not None:
+        metrics.registry.observe(f"{request.method} {request.url_rule.rule}", time.perf_counter() - g.request_started)
+    return response
+
+GRAPH_FILE = 'knowledge_graph.json'
+
+# The graph the backend maintains; loaded from GRAPH_FILE on the first ingest and updated in place afterwards
+graph = None
+graph_lock = threading.Lock()
+# Every distinct relationship of the graph, with counts and paragraph ids, kept next to it (kgc.relations_path)
+relations = None
+
+# On-disk cache of parsed paragraphs, so re-running a build on a mostly unchanged CSV skips spaCy for known paragraphs
+parse_cache = kgc.ParseCache(os.environ.get('KG_PARSE_CACHE', 'parse_cache.sqlite'),
+                             max_entries=int(os.environ.get('KG_PARSE_CACHE_SIZE', 100000)))
+
+# Background graph builds ("job-queue mode" of /generate-graph): job id -> job record, oldest first
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+active_jobs = {}        # (file path, batch_size, n_process) -> id of its queued or running job
+MAX_FINISHED_JOBS = 100     # Finished jobs kept for their status and result
+job_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('KG_JOB_WORKERS', 1)))
+
+# Function to build the graph from a CSV file and publish it as the new knowledge graph.
+# progress(processed, total) is called as the paragraphs go through spaCy.
+def generate(file_path, batch_size=None, n_process=1, progress=None):
+    # Read data from CSV, build graph, and save to JSON
+    global graph, relations
+    paragraphs = kgc.read_data_from_csv(file_path)
+    total = len(paragraphs)
+    if progress:
+        progress(0, total)
+    new_relations = kgc.RelationStore()
+    new_graph = kgc.build_knowledge_graph(paragraphs, batch_size=batch_size, n_process=n_process, cache=parse_cache,
+                                          source=os.path.basename(file_path), relations=new_relations,
+                                          progress=(lambda processed: progress(processed, total)) if progress else None)
+    with graph_lock:
+        kgc.publish_graph(new_graph, filename=GRAPH_FILE, relations=new_relations)
+        graph, relations = new_graph, new_relations
+    return {'nodes': new_graph.number_of_nodes(), 'edges': new_graph.number_of_edges(), 'relations': len(new_relations)}
+
+# Function run by the job workers: builds the graph of a job and records its progress and outcome
+def run_job(job_id):
+    with jobs_lock:
+        job = jobs[job_id]
+        job.update(status='running', started=time.time())
+
+    def progress(processed, total):
+        job['processed'], job['total'] = processed, total
+
+    # The job is finished whatever happens, so a later submission of the same file starts a new one
+    outcome = {'status': 'failed', 'error': 'Interrupted'}
+    try:
+        result = generate(job['file_path'], batch_size=job['batch_size'], n_process=job['n_process'], progress=progress)
+        outcome = {'status': 'done', 'result': result}
+    except KeyboardInterrupt:
+        raise
+    except BaseException as e:      # Including SystemExit, which some spaCy calls raise instead of an error
+        outcome = {'status': 'failed', 'error': str(e) or type(e).__name__}
+    finally:
+        metrics.increment(f"jobs_{outcome['status']}")
+        with jobs_lock:
+            job.update(outcome, finished=time.time())
+            active_jobs.pop(job['key'], None)
+            finished = [old_id for old_id, old_job in jobs.items() if old_job['status'] in ('done', 'failed')]
+            for old_id in finished[:-MAX_FINISHED_JOBS]:
+                del jobs[old_id]
+
+# Function to queue a build; a submission for a file that is already queued or running returns that job instead
+def submit_job(file_path, batch_size=None, n_process=1):
+    key = (os.path.abspath(file_path), batch_size, n_process)
+    with jobs_lock:
+        if key in active_jobs:
+            return jobs[active_jobs[key]], True
+        job_id = uuid.uuid4().hex
+        jobs[job_id] = {'id': job_id, 'key': key, 'file_path': file_path, 'batch_size': batch_size, 'n_process': n_process,
+                        'status': 'queued', 'processed': 0, 'total': None, 'submitted': time.time(),
+                        'started': None, 'finished': None, 'result': None, 'error': None}
+        active_jobs[key] = job_id
+    job_executor.submit(run_job, job_id)
+    return jobs[job_id], False
+
+# Function to describe a job in API responses
+def job_status(job):
+    status = {name: value for name, value in job.items() if name not in ('key', 'result')}
+    status['progress'] = job['processed'] / job['total'] if job['total'] else (1.0 if job['status'] == 'done' else 0.0)
+    return status
+
 @app.route('/generate-graph', methods=['POST'])
 def generate_graph():
     # Get file path from request
@@ -15,12 +123,92 @@ def generate_graph():
     if not os.path.isfile(file_path):
         return jsonify({'error': 'File does not exist'}), 400
 
-    # Read data from CSV, build graph, and save to JSON
-    paragraphs = kgc.read_data_from_csv(file_path)
-    graph = kgc.build_knowledge_graph(paragraphs)
-    kgc.save_graph_to_json(graph, filename='knowledge_graph.json')
+    # Optional batched build: paragraphs are streamed through nlp.pipe, n_process > 1 parses on several cores
+    batch_size = request.json.get('batch_size')
+    n_process = request.json.get('n_process', 1)
+
+    # Job-queue mode: return a job id right away and build in the background; poll /jobs/<id> for progress
+    if request.json.get('async'):
+        job, duplicate = submit_job(file_path, batch_size=batch_size, n_process=n_process)
+        return jsonify({'job_id': job['id'], 'status': job['status'], 'duplicate': duplicate,
+                        'status_url': f"/jobs/{job['id']}", 'result_url': f"/jobs/{job['id']}/result"}), 202
 
+    generate(file_path, batch_size=batch_size, n_process=n_process)
     return jsonify({'message': 'Knowledge graph generated successfully'}), 200
 
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    with jobs_lock:
+        return jsonify([job_status(job) for job in jobs.values()]), 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Unknown job'}), 404
+        return jsonify(job_status(job)), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Unknown job'}), 404
+        if job['status'] == 'failed':
+            return jsonify({'status': 'failed', 'error': job['error']}), 500
+        if job['status'] != 'done':
+            return jsonify(job_status(job)), 202      # Not finished yet
+        return jsonify({'status': 'done', 'message': 'Knowledge graph generated successfully', **job['result']}), 200
+
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    # Merge a CSV (e.g. one written by WebScraping_Small-2.scrape_website) into the existing graph.
+    # Re-ingesting the same source replaces what it contributed before and leaves the other sources untouched.
+    file_path = request.json.get('file_path')
+    if not file_path:
+        return jsonify({'error': 'File path is required'}), 400
+
+    if not os.path.isfile(file_path):
+        return jsonify({'error': 'File does not exist'}), 400
+
+    source = request.json.get('source') or os.path.basename(file_path)
+    paragraphs = kgc.read_data_from_csv(file_path)
+    extractions = list(kgc.extract_paragraphs(paragraphs, batch_size=request.json.get('batch_size'),
+                                              n_process=request.json.get('n_process', 1), cache=parse_cache))
+
+    global graph, relations
+    with graph_lock:
+        if graph is None:
+            graph = kgc.read_graph_from_json(GRAPH_FILE) if os.path.isfile(GRAPH_FILE) else nx.Graph()
+        if relations is None:
+            relations = kgc.load_relations(GRAPH_FILE)
+        kgc.remove_source(graph, source)
+        relations.remove_source(source)
+        if kgc.CANONICALIZE:
+            extractions = kgc.canonicalize_extractions(extractions, graph=graph)
+        for index, (entities, triples, _) in enumerate(extractions):
+            kgc.add_extraction_to_graph(graph, entities, triples, source=source)
+            relations.add_extraction(entities, triples, kgc.paragraph_id(source, index))
+        kgc.publish_graph(graph, filename=GRAPH_FILE, source=source, relations=relations)
+        nodes, edges = graph.number_of_nodes(), graph.number_of_edges()
+
+    return jsonify({'message': f"Source '{source}' merged into the knowledge graph", 'nodes': nodes, 'edges': edges,
+                    'relations': len(relations)}), 200
+
+# Per-stage timings (p50/p99 over the latest calls) and counters of the builds; ?format=prometheus for the text format
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if request.args.get('format') == 'prometheus':
+        return Response(metrics.registry.prometheus(), mimetype='text/plain; version=0.0.4')
+    return jsonify(metrics.registry.snapshot()), 200
+
+@app.route('/parse-cache', methods=['GET', 'DELETE'])
+def parse_cache_stats():
+    # DELETE drops every cached paragraph, e.g. after the spaCy model was updated in place
+    if request.method == 'DELETE':
+        parse_cache.invalidate()
+    return jsonify(parse_cache.stats()), 200
+
 if __name__ == "__main__":
     app.run(debug=True)
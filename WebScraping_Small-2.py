@@ -1,41 +1,389 @@
 import requests     #To make HTTP requests
+from requests.adapters import HTTPAdapter       #To size the connection pool of a shared session
 from bs4 import BeautifulSoup       #To parse HTML content
 import time     #To handle delays
 import logging      #To log messages
 import re       #To handle regular expressions
+import random       #To add jitter to retry delays
+import os       #To check for CSV files written by earlier runs
+import sqlite3      #To store the HTTP cache on disk
+import threading        #To limit concurrent requests per host
+from concurrent.futures import ThreadPoolExecutor       #To scrape several URLs concurrently
+from urllib.parse import urlparse       #To find the host of a URL
+from html.parser import HTMLParser      #To extract page data in a single streaming pass
 import pandas as pd     #o create and manipulate DataFrames for saving data to CSV
+import metrics      #Per-stage timings and counters
+
+try:
+    import lxml.html        #Optional: C HTML parser for the 'lxml' extraction backend
+except ImportError:
+    lxml = None
 
 # Set up basic logging configuration to log messages to the console
 logging.basicConfig(filename='./KG.log', level=logging.INFO)
 
-# Function to fetch a webpage with retries and delay
-def fetch_webpage(url, retries=3, delay=2):
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
+
+# Status codes that will not change by retrying (e.g. the repeated 403s in KG.log), so the fetch fails immediately
+PERMANENT_ERRORS = {400, 401, 403, 404, 405, 410, 451}
+
+# Function to create a session whose connections (and TLS handshakes) are reused across requests and threads
+def create_session(pool_size=10):
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# Limits the requests sent to each host: at most max_concurrent at a time, and at most rate requests per second
+class HostLimiter:
+    def __init__(self, max_concurrent=2, rate=1.0):
+        self.max_concurrent = max_concurrent
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._slots = {}        # host -> semaphore
+        self._next_start = {}       # host -> earliest time the next request may start
+
+    # Wait for a free slot and for the rate limit of the URL's host; call release() with the same URL afterwards
+    def acquire(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            slot = self._slots.setdefault(host, threading.BoundedSemaphore(self.max_concurrent))
+        slot.acquire()
+        # The start is only claimed once the request really goes: a thread that wakes late from its sleep moves the
+        # next start back instead of sending sooner than the interval after it
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                start = self._next_start.get(host, now)
+                if now >= start:
+                    self._next_start[host] = now + self.interval
+                    return
+            time.sleep(start - now)
+
+    def release(self, url):
+        self._slots[urlparse(url).netloc].release()
+
+# Persistent HTTP cache of fetched pages: body, ETag and Last-Modified per URL.
+# Entries younger than ttl seconds are served without a request; older ones are revalidated with
+# If-None-Match / If-Modified-Since, so an unchanged page costs one 304 response. The least recently used
+# entries are evicted once the cache holds more than max_entries pages or max_bytes of page bodies.
+class HTTPCache:
+    def __init__(self, path='http_cache.sqlite', ttl=3600, max_entries=1000, max_bytes=256 * 2**20):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.fresh_hits = 0     # served from the cache without a request
+        self.revalidated = 0        # 304 Not Modified
+        self.downloads = 0      # full 200 responses
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, body TEXT, etag TEXT, '
+                               'last_modified TEXT, fetched_at REAL, last_used INTEGER)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used)')
+        self._clock = self._conn.execute('SELECT COALESCE(MAX(last_used), 0) FROM pages').fetchone()[0]
+
+    # Look up a URL; returns {'body', 'etag', 'last_modified', 'fresh'} or None
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute('SELECT body, etag, last_modified, fetched_at FROM pages WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            self._clock += 1
+            with self._conn:
+                self._conn.execute('UPDATE pages SET last_used = ? WHERE url = ?', (self._clock, url))
+        body, etag, last_modified, fetched_at = row
+        return {'body': body, 'etag': etag, 'last_modified': last_modified, 'fresh': time.time() - fetched_at < self.ttl}
+
+    # Store a downloaded page, then evict the least recently used pages over the caps
+    def put(self, url, body, etag=None, last_modified=None):
+        with self._lock:
+            self._clock += 1
+            with self._conn:
+                self._conn.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                                   (url, body, etag, last_modified, time.time(), self._clock))
+                entries, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM pages').fetchone()
+                rows = self._conn.execute('SELECT url, LENGTH(body) FROM pages ORDER BY last_used')
+                evict = []
+                for old_url, length in rows:
+                    if entries <= self.max_entries and size <= self.max_bytes or old_url == url:
+                        break
+                    evict.append((old_url,))
+                    entries -= 1
+                    size -= length
+                self._conn.executemany('DELETE FROM pages WHERE url = ?', evict)
+
+    # Restart the TTL of a page after the server answered 304 Not Modified
+    def refresh(self, url):
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE pages SET fetched_at = ? WHERE url = ?', (time.time(), url))
+
+    # Drop every cached page, or only the given URL
+    def invalidate(self, url=None):
+        with self._lock, self._conn:
+            if url is None:
+                self._conn.execute('DELETE FROM pages')
+            else:
+                self._conn.execute('DELETE FROM pages WHERE url = ?', (url,))
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM pages').fetchone()
+        return {'fresh_hits': self.fresh_hits, 'revalidated': self.revalidated, 'downloads': self.downloads,
+                'entries': entries, 'bytes': size, 'max_entries': self.max_entries, 'max_bytes': self.max_bytes}
+
+    def close(self):
+        self._conn.close()
+
+# Function to send a GET request with retries; returns the response (2xx or 304) or None.
+# Retries wait with exponential backoff and full jitter (a random delay up to delay * 2**attempt, capped at max_delay);
+# permanent errors such as 403 or 404 are not retried. Pass a shared session and a HostLimiter when fetching concurrently.
+def get_with_retries(url, retries=3, delay=2, session=None, limiter=None, max_delay=60, headers=None):
+    session = session or requests
     for attempt in range(retries):
+        if limiter:
+            limiter.acquire(url)
         try:
-            response = requests.get(url, headers=headers) # Send GET request to the URL
+            metrics.increment('http_requests')
+            response = session.get(url, headers={**HEADERS, **(headers or {})}, timeout=30) # Send GET request to the URL
             response.raise_for_status()  # Raise an error for bad status codes
-            return response.text # Return the HTML content of the webpage
+            return response
         except requests.exceptions.RequestException as e:
             logging.error(f"Error fetching the webpage (Attempt {attempt + 1}/{retries}): {e}")
-            time.sleep(delay)  # Wait for a specified delay before retrying
+            metrics.increment('http_errors')
+            status = e.response.status_code if e.response is not None else None
+            if status in PERMANENT_ERRORS:
+                logging.error(f"Not retrying {url}: HTTP {status} is a permanent error")
+                return None
+        finally:
+            if limiter:
+                limiter.release(url)
+        if attempt + 1 < retries:
+            time.sleep(random.uniform(0, min(max_delay, delay * 2 ** attempt)))  # Wait before retrying
     return None
 
+# Function to fetch a webpage through an HTTPCache; returns (content, changed).
+# changed is False when the cached copy was still fresh or the server answered 304 Not Modified.
+@metrics.timed()
+def fetch_webpage_if_changed(url, cache, **kwargs):
+    entry = cache.get(url)
+    if entry and entry['fresh']:
+        cache.fresh_hits += 1
+        metrics.increment('http_cache_fresh_hits')
+        return entry['body'], False
+    headers = {}
+    if entry and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry['last_modified']:
+        headers['If-Modified-Since'] = entry['last_modified']
+    response = get_with_retries(url, headers=headers, **kwargs)
+    if response is None:
+        return None, False
+    if response.status_code == 304 and entry:
+        cache.revalidated += 1
+        metrics.increment('http_cache_revalidated')
+        cache.refresh(url)
+        return entry['body'], False
+    cache.downloads += 1
+    metrics.increment('http_cache_downloads')
+    cache.put(url, response.text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return response.text, True
+
+# Function to fetch a webpage with retries and delay, optionally through an HTTPCache
+@metrics.timed()
+def fetch_webpage(url, retries=3, delay=2, session=None, limiter=None, max_delay=60, cache=None):
+    kwargs = dict(retries=retries, delay=delay, session=session, limiter=limiter, max_delay=max_delay)
+    if cache is not None:
+        return fetch_webpage_if_changed(url, cache, **kwargs)[0]
+    response = get_with_retries(url, **kwargs)
+    return response.text if response is not None else None # Return the HTML content of the webpage
+
 # Function to parse HTML content using BeautifulSoup
+@metrics.timed()
 def parse_html(content):
     return BeautifulSoup(content, 'html.parser')
 
-# Function to extract data (title, headings, paragraphs) from the parsed HTML
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+# Function to extract data (title, headings, paragraphs) from the parsed HTML, walking the tree once
+@metrics.timed()
 def extract_data(soup):
-    data = {'title': [soup.title.string if soup.title else 'No title found']}
-    data['headings'] = [heading.text.strip() for heading in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])]
-    data['paragraphs'] = [paragraph.text.strip() for paragraph in soup.find_all('p')]
+    data = {'title': [soup.title.string if soup.title else 'No title found'], 'headings': [], 'paragraphs': []}
+    for element in soup.find_all(HEADING_TAGS + ('p',)):
+        data['paragraphs' if element.name == 'p' else 'headings'].append(element.text.strip())
+    return data
+
+# Elements whose text BeautifulSoup leaves out of .text, and elements it closes as soon as they open
+HIDDEN_TEXT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta', 'param',
+             'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'}
+
+# Streaming (SAX-style) extractor on the standard library HTMLParser, the tokenizer BeautifulSoup's 'html.parser'
+# uses. It collects the title, headings and paragraphs in one pass without building a tree, and follows
+# BeautifulSoup's nesting rules (an end tag closes the most recent open element of that name and everything
+# opened inside it), so it produces the same data as extract_data(parse_html(content)).
+class PageExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = None       # children of the first <title> once it opened: strings and child elements (lists)
+        self.headings = []
+        self.paragraphs = []
+        self._stack = []        # open elements as (tag, text chunks or None, children list if inside the title or None)
+        self._collecting = []       # text chunk lists of the open heading and paragraph elements, in stack order
+        self._hidden = 0        # number of open HIDDEN_TEXT_TAGS elements
+        self._text_open = False     # whether the last child added inside the title is text that more data extends
+
+    # Add a child (a string, or the children list of an element) to the innermost open element inside the title
+    def _add_to_title(self, child, text=False):
+        children = self._stack[-1][2] if self._stack else None
+        if children is None:
+            return
+        if text and self._text_open:
+            children[-1] += child       # BeautifulSoup joins consecutive data into one string
+        else:
+            children.append(child)
+        self._text_open = text
+
+    def handle_starttag(self, tag, attrs):
+        node = None
+        if self._stack and self._stack[-1][2] is not None or tag == 'title' and self.title is None:
+            node = []
+            self._add_to_title(node)
+        if tag in VOID_TAGS:
+            return
+        chunks = None
+        if tag == 'p':
+            chunks = []
+            self.paragraphs.append(chunks)
+        elif tag in HEADING_TAGS:
+            chunks = []
+            self.headings.append(chunks)
+        elif tag == 'title' and self.title is None:
+            self.title = node
+        if chunks is not None:
+            self._collecting.append(chunks)
+        if tag in HIDDEN_TEXT_TAGS:
+            self._hidden += 1
+        self._stack.append((tag, chunks, node))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self._text_open = False
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i][0] == tag:
+                break
+        else:
+            return      # Nothing to close, like BeautifulSoup
+        for name, chunks, _ in reversed(self._stack[i:]):
+            if chunks is not None:
+                self._collecting.pop()      # Closed elements are always the most recently opened ones
+            if name in HIDDEN_TEXT_TAGS:
+                self._hidden -= 1
+        del self._stack[i:]
+
+    def handle_data(self, data):
+        self._add_to_title(data, text=True)
+        if not self._hidden:
+            for chunks in self._collecting:
+                chunks.append(data)
+
+    # Comments, processing instructions and declarations are left out of .text, but can be a title's string
+    def handle_comment(self, data):
+        self._add_to_title(data)
+
+    def handle_pi(self, data):
+        self._add_to_title(data)
+
+    def handle_decl(self, data):
+        self._add_to_title(data[len('DOCTYPE '):] if data.startswith('DOCTYPE ') else data)
+
+    # <![CDATA[...]]> sections are text, like BeautifulSoup's CData strings
+    def unknown_decl(self, data):
+        if not data.upper().startswith('CDATA['):
+            self._add_to_title(data)
+            return
+        self._add_to_title(data[len('CDATA['):])
+        if not self._hidden:
+            for chunks in self._collecting:
+                chunks.append(data[len('CDATA['):])
+
+    def data(self):
+        if self.title is None:
+            title = 'No title found'
+        else:   # Like Tag.string: the only child's string, looking through elements with a single child; else None
+            children = self.title
+            while len(children) == 1 and isinstance(children[0], list):
+                children = children[0]
+            title = children[0] if len(children) == 1 else None
+        return {'title': [title],
+                'headings': [''.join(chunks).strip() for chunks in self.headings],
+                'paragraphs': [''.join(chunks).strip() for chunks in self.paragraphs]}
+
+# Function to collect the text of an lxml element the way BeautifulSoup's .text does (no comments or hidden text)
+def lxml_text(element, chunks=None):
+    chunks = [] if chunks is None else chunks
+    if element.text:
+        chunks.append(element.text)
+    for child in element:
+        if isinstance(child.tag, str) and child.tag not in HIDDEN_TEXT_TAGS:
+            lxml_text(child, chunks)
+        if child.tail:
+            chunks.append(child.tail)
+    return chunks
+
+# Function to extract the page data with lxml. libxml2 repairs malformed markup differently from html.parser
+# (e.g. it closes an open <p> when a block element starts), so the data matches the other backends on well-formed pages.
+def extract_data_lxml(content):
+    root = lxml.html.fromstring(content.encode('utf-8'), parser=lxml.html.HTMLParser(encoding='utf-8'))
+    data = {'title': ['No title found'], 'headings': [], 'paragraphs': []}
+    title_found = False
+    for element in root.iter('title', 'p', *HEADING_TAGS):
+        if element.tag == 'title':
+            if not title_found:
+                title_found = True
+                data['title'] = [(element.text or None) if len(element) == 0 else None]
+        else:
+            data['paragraphs' if element.tag == 'p' else 'headings'].append(''.join(lxml_text(element)).strip())
     return data
 
+# Backend used to extract the page data: 'stream' (PageExtractor), 'lxml' (fastest), or 'bs4' (BeautifulSoup with
+# html.parser, the original extractor). `python benchmark.py --html` compares them.
+HTML_BACKEND = os.environ.get('KG_HTML_BACKEND', 'stream')
+HTML_BACKENDS = ('stream', 'lxml', 'bs4')
+
+# Function to extract the title, headings and paragraphs of an HTML page with the selected backend
+@metrics.timed()
+def extract_page(content, backend=None):
+    backend = backend or HTML_BACKEND
+    if backend == 'stream':
+        extractor = PageExtractor()
+        extractor.feed(content)
+        extractor.close()
+        return extractor.data()
+    if backend == 'lxml':
+        if lxml is None:
+            raise ImportError("The 'lxml' HTML backend needs the lxml package")
+        return extract_data_lxml(content)
+    if backend == 'bs4':
+        return extract_data(parse_html(content))
+    raise ValueError(f"Unknown HTML backend '{backend}', expected one of {HTML_BACKENDS}")
+
+# Function to create a valid CSV filename for a URL
+def csv_filename(url):
+    return re.sub(r'\W+', '_', url) + ".csv"
+
 # Function to save extracted data to a CSV file
+@metrics.timed()
 def save_to_csv(url, data):
     #create a valid filename
-    filename = re.sub(r'\W+', '_', url) + ".csv"
+    filename = csv_filename(url)
     
     # Add URL to the data
     data['url'] = [url]
@@ -47,22 +395,59 @@ def save_to_csv(url, data):
     df.to_csv(filename, index=False, encoding='utf-8')
     return filename
 
+# Function to scrape a website, returning (csv_file, changed).
+# With an HTTPCache, a page that has not changed since the last run skips parsing and keeps its existing CSV file;
+# changed tells graph building whether the source needs to be (re-)ingested, so it is True whenever the CSV file
+# was written.
+def scrape_page(url, session=None, limiter=None, cache=None):
+    if cache is not None:
+        content, changed = fetch_webpage_if_changed(url, cache, session=session, limiter=limiter)
+    else:
+        content = fetch_webpage(url, session=session, limiter=limiter)    # Fetch the webpage content
+        changed = content is not None
+    if not content:
+        return None, False      # Return None if fetching the webpage fails
+    if not changed and os.path.exists(csv_filename(url)):
+        return csv_filename(url), False
+    data = extract_page(content)       # Extract the title, headings and paragraphs in one pass
+    csv_file = save_to_csv(url, data)   # Save extracted data to a CSV file
+    return csv_file, True       # A rewritten CSV file (e.g. one deleted since the last run) must be ingested again
+
 # Main function to scrape a website
-def scrape_website(url):
-    content = fetch_webpage(url)    # Fetch the webpage content
-    if content:
-        soup = parse_html(content)
-        data = extract_data(soup)
-        csv_file = save_to_csv(url, data)   # Save extracted data to a CSV file
-        return csv_file     # Return the name of the CSV file
-    return None     # Return None if fetching the webpage fails
+def scrape_website(url, session=None, limiter=None, cache=None):
+    return scrape_page(url, session=session, limiter=limiter, cache=cache)[0]     # Return the name of the CSV file
+
+# Function to scrape several websites concurrently with a shared connection pool.
+# Each host gets at most per_host_concurrency requests at a time and per_host_rate requests per second.
+# Returns {url: (csv_file or None, changed)} in the order of the given URLs.
+def scrape_websites(urls, max_workers=8, per_host_concurrency=2, per_host_rate=1.0, cache=None):
+    session = create_session(pool_size=max_workers)
+    limiter = HostLimiter(max_concurrent=per_host_concurrency, rate=per_host_rate)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {url: executor.submit(scrape_page, url, session, limiter, cache) for url in dict.fromkeys(urls)}
+        results = {}
+        for url, future in futures.items():
+            try:
+                results[url] = future.result()
+            except Exception as e:
+                logging.error(f"Failed to scrape {url}: {e}")
+                results[url] = (None, False)
+    session.close()
+    return results
 
 # Main entry point of the script
 if __name__ == "__main__":
-    url = input("Enter the URL to scrape: ")        # Prompt the user to enter a URL
-    csv_file = scrape_website(url)      # Scrape the website and save data to a CSV file
-    print(csv_file)
-    if csv_file:
-        logging.info(f"Data saved to {csv_file}")
+    urls = input("Enter the URL(s) to scrape, separated by spaces: ").split()        # Prompt the user to enter URLs
+    cache = HTTPCache()
+    if len(urls) == 1:
+        results = {urls[0]: scrape_page(urls[0], cache=cache)}      # Scrape the website and save data to a CSV file
     else:
-        logging.info("Failed to scrape the website.")
+        results = scrape_websites(urls, cache=cache)     # Scrape the websites concurrently
+    for url, (csv_file, changed) in results.items():
+        print(csv_file if changed or not csv_file else f"{csv_file} (unchanged)")
+        if csv_file:
+            logging.info(f"Data saved to {csv_file}" if changed else f"{url} has not changed since the last run: {csv_file}")
+        else:
+            logging.info(f"Failed to scrape the website: {url}")
+    logging.info(f"HTTP cache: {cache.stats()}")
+    cache.close()
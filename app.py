@@ -1,54 +1,549 @@
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context, g
 from flask_cors import CORS, cross_origin
 import networkx as nx
-from networkx.readwrite import json_graph
 import json
+import gzip
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import KnowledgeGraphConstruction as kgc
+import metrics
+from graph_index import GraphSearchIndex
+from graph_paths import GraphTraversal
+from graph_store import NetworkXGraphStore, open_graph_store
+from node_vectors import DEFAULT_PROBES, NodeVectors
+
+# Graph to serve: a JSON file or a binary snapshot (*.kgsnap) written by KnowledgeGraphConstruction.save_graph
+GRAPH_FILE = os.environ.get('KG_GRAPH_FILE', 'knowledge_graph.json')
+# Graph backend: 'networkx' (updated in place) or 'array' (compact read-only arrays, see graph_store.py)
+GRAPH_STORE = os.environ.get('KG_GRAPH_STORE', 'networkx')
+
+# Limits of the multi-hop queries ("how is X related to Y", "within k hops of X"), so one query on a hub node
+# cannot stall the server: nodes a query may visit, seconds it may take, hops and paths it may ask for
+TRAVERSAL_MAX_VISITED = int(os.environ.get('KG_TRAVERSAL_MAX_VISITED', 20000))
+TRAVERSAL_TIME_LIMIT = float(os.environ.get('KG_TRAVERSAL_TIME_LIMIT', 0.5))
+MAX_HOPS = 3
+PATHS_PER_QUERY = 3
+MAX_LISTED_NODES = 100      # Nodes named in a neighbourhood answer; the rest are only counted
+MAX_LISTED_EDGES = 100      # Relationships named in a relation or "relations of" answer; the rest are only counted
+
+# Matches in one page of a search answer ("Found matches: ..."), most important nodes first; a request can ask for
+# another page size with "limit", and for the next page with the "cursor" of the previous answer
+QUERY_PAGE_SIZE = int(os.environ.get('KG_QUERY_PAGE_SIZE', 20))
+MAX_QUERY_PAGE_SIZE = 200
+
+# Query forms for multi-hop questions (queries are lowercased first)
+RELATED_QUERIES = [re.compile(r'^how (?:is|are) (.+?) (?:related|connected) to (.+?)\??$'),
+                   re.compile(r'^how (?:is|are) (.+?) and (.+?) (?:related|connected)\??$')]
+WITHIN_HOPS_QUERY = re.compile(r'^(?:everything |nodes )?within (\d+) hops? of (.+?)\??$')
+# Query form for the relationships with a given relation, e.g. "edges with relation found"
+RELATION_QUERY = re.compile(r'^(?:all )?(?:edges|relationships|triples) with (?:the )?relation (.+?)\??$')
+# Query form for the nodes most similar to a node or phrase, e.g. "similar to stratix", "top 20 nodes like fpgas"
+SIMILAR_QUERY = re.compile(r'^(?:top (\d+) )?(?:nodes? (?:similar to|like)|similar to) (.+?)\??$')
+SIMILAR_RESULTS = 10        # Nodes in a similarity answer unless the query asks for its top n
+MAX_SIMILAR_RESULTS = 100
+# Inverted file lists a similarity query scores on large graphs (see node_vectors.py); more is slower and more exact
+VECTOR_PROBES = int(os.environ.get('KG_VECTOR_PROBES', DEFAULT_PROBES))
+
+# Log level of the server: DEBUG also logs every query and answer, OFF switches logging off
+LOG_LEVEL = os.environ.get('KG_LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger('kg.app')
+logger.setLevel(logging.CRITICAL + 1 if LOG_LEVEL == 'OFF' else LOG_LEVEL)
+
+# Answers kept by the /query result cache (0 disables it)
+QUERY_CACHE_SIZE = int(os.environ.get('KG_QUERY_CACHE_SIZE', 1024))
+
+# Journaled updates are applied to the served graph incrementally; the node importance scores and the ranking of
+# search results are only recomputed once the edges changed since they were last ranked reach this fraction
+RERANK_FRACTION = float(os.environ.get('KG_RERANK_FRACTION', 0.05))
 
 # Initialize a Flask application
 app = Flask(__name__)
 # Enable Cross-Origin Resource Sharing (CORS) for the app
 CORS(app)
 
-# Load the graph from the JSON file
-try:
-    with open('knowledge_graph.json') as f:
-        graph_data = json.load(f)
-        print("JSON file loaded successfully.")
-except Exception as e:
-    print(f"Failed to load JSON file: {e}")
+# Time every request as the stage "<METHOD> <route>", e.g. "POST /query"
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    if metrics.ENABLED and 'request_started' in g and request.url_rule is not None:
+        metrics.registry.observe(f"{request.method} {request.url_rule.rule}", time.perf_counter() - g.request_started)
+    return response
 
 # Convert JSON data to NetworkX graph
+@metrics.timed()
 def load_graph_from_json(data):
-    G = nx.Graph()      # Create an empty graph
+    G = nx.Graph(seq=data.get('seq', 0))      # Create an empty graph
     try:
-        # Add nodes with labels to the graph
+        # Add nodes with labels, importance scores (and their provenance, if the graph is built incrementally) to the graph
         for node in data['nodes']:
-            G.add_node(node['id'], label=node['label'])
+            G.add_node(node['id'], label=node['label'], **{key: node[key] for key in ('importance', 'sources') if key in node})
         # Add edges with relationships to the graph
         for edge in data['edges']:
-            G.add_edge(edge['source'], edge['target'], relation=edge['relation'])
-        print("Graph loaded from JSON successfully.")
+            G.add_edge(edge['source'], edge['target'], relation=edge['relation'],
+                       **({'sources': edge['sources']} if 'sources' in edge else {}))
+        logger.info("Graph loaded from JSON successfully.")
     except Exception as e:
-        print(f"Error loading graph from JSON: {e}")
+        logger.error("Error loading graph from JSON: %s", e)
+    return G
+
+# Load the graph file, memory-mapping it if it is a binary snapshot
+@metrics.timed()
+def load_graph(filename):
+    if filename.endswith(kgc.SNAPSHOT_SUFFIX):
+        snapshot = kgc.GraphSnapshot(filename)
+        try:
+            G = snapshot.to_networkx(missing_label='No label')      # Same labels as the JSON file would give
+        finally:
+            snapshot.close()
+        logger.info("Graph loaded from snapshot successfully.")
+    else:
+        with open(filename) as f:
+            graph_data = json.load(f)
+            logger.info("JSON file loaded successfully.")
+        G = load_graph_from_json(graph_data)
+    # Graph files saved before nodes had importance scores are scored now, so matches still come ranked
+    if any('importance' not in data for _, data in G.nodes(data=True)):
+        kgc.compute_importance(G)
     return G
 
-# Load the graph from the JSON data
-G = load_graph_from_json(graph_data)
+# Function to describe a file by (inode, modification time, size), or None if it does not exist
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+# Everything a request needs about one version of the graph. A state is never modified once requests can see it:
+# changes build a new state in the background, which then replaces the current one with a single reference swap,
+# so requests need no lock and always see one consistent version from start to finish.
+class GraphState:
+    def __init__(self, store, version, file_signature, updates_position, relations=None, relations_signature=None,
+                 vectors=None, vectors_signature=None, search_index=None):
+        self.store = store
+        self.relations = relations      # kgc.RelationStore of the graph (see load_relations), None if it failed to load
+        self.relations_signature = relations_signature
+        self.vectors = vectors      # NodeVectors of the graph (memory-mapped), None if the graph file has none
+        self.vectors_signature = vectors_signature
+        # Search index over node names and relations
+        self.search_index = search_index if search_index is not None else GraphSearchIndex(store)
+        self.traversal = GraphTraversal(store, max_visited=TRAVERSAL_MAX_VISITED, time_limit=TRAVERSAL_TIME_LIMIT)
+        self.version = version      # Cached responses are only reused for the same version
+        self.file_signature = file_signature        # Graph file the state was loaded from
+        self.updates_position = updates_position        # (inode, offset) in the update journal already applied
+        self.data = None        # Serialized graph for /api/data, filled on first use
+        self.provenance = None      # What each source contributed (kgc.graph_provenance), kept by refresh_graph
+        self.unranked_changes = 0       # Edges changed since the importance scores and the search ranking were computed
+
+    # Find the node a (lowercased) query names: the node itself if it exists, otherwise the one differing only in case
+    def resolve_node(self, name):
+        return name if self.store.has_node(name) else self.search_index.node_named(name)
+
+    # Find one page of the edges whose node names or relation contain the term, formatted for the answer, most
+    # important nodes first; returns (matches, total number of matches)
+    def search_edges(self, term, limit, offset=0):
+        edges, total = self.search_index.search_page(term, limit, offset)
+        return [f"{u} -- {v}: {relation if relation is not None else 'unknown'}" for u, v, relation in edges], total
+
+    # Name of the graph version for cursors: the graph update and the graph file's (inode, modification time, size),
+    # which are the same in every server process. The file tells apart graphs whose update number never changes,
+    # such as files not written by kgc.publish_graph.
+    def graph_key(self):
+        signature = '.'.join(map(str, self.file_signature)) if self.file_signature else 'none'
+        return f"{self.store.attributes().get('seq', 0)}-{signature}"
+
+    # Cursor of the page of an answer starting at offset, only followed on the graph version it was made for
+    def cursor(self, offset):
+        return f"{self.graph_key()}:{offset}"
+
+updates_path = kgc.graph_updates_path(GRAPH_FILE)
+relations_file = kgc.relations_path(GRAPH_FILE)
+vectors_file = kgc.vectors_path(GRAPH_FILE)
+
+# Load the relation store kept next to the graph file; returns (store or None, file signature). A graph file
+# without one gets a store seeded from its edges (kgc.load_relations), taken from G if given, and the signature of
+# the graph file instead. The store of the given state is reused if the file has not changed.
+def load_relations(state=None, G=None):
+    signature = file_signature(relations_file) or file_signature(GRAPH_FILE)
+    if state is not None and signature == state.relations_signature:
+        return state.relations, signature
+    if signature is None:
+        return None, None
+    try:
+        return kgc.load_relations(GRAPH_FILE, G), signature
+    except Exception as e:
+        logger.error("Failed to load relation store: %s", e)
+        return None, signature
+
+# Load the node vectors kept next to the graph file; returns (NodeVectors or None, file signature).
+# The vectors of the given state are reused if the file has not changed.
+def load_vectors(state=None):
+    signature = file_signature(vectors_file)
+    if state is not None and signature == state.vectors_signature:
+        return state.vectors, signature
+    if signature is None:
+        return None, None
+    try:
+        return NodeVectors.load(vectors_file), signature
+    except Exception as e:
+        logger.error("Failed to load node vectors: %s", e)
+        return None, signature
+
+# Function to get the current end of the update journal as (inode, size)
+def journal_position():
+    signature = file_signature(updates_path)
+    return (signature[0], signature[2]) if signature else (None, 0)
+
+# Load the graph from the graph file into a new state
+def load_state(version):
+    # Taken before the graph file is read, so an update published meanwhile is replayed rather than missed
+    updates_position = journal_position()
+    signature = file_signature(GRAPH_FILE)
+    try:
+        store = open_graph_store(GRAPH_FILE, GRAPH_STORE, load_networkx=load_graph)
+    except Exception as e:
+        logger.error("Failed to load graph file: %s", e)
+        store = NetworkXGraphStore(nx.Graph())
+    G = store.graph if isinstance(store, NetworkXGraphStore) else None
+    return GraphState(store, version, signature, updates_position, *load_relations(G=G), *load_vectors())
+
+# Function to read the complete journal records written after a position; returns (new position, records)
+def read_journal(position):
+    try:
+        with open(updates_path, 'rb') as f:
+            inode = os.fstat(f.fileno()).st_ino     # The file actually read, in case it was replaced meanwhile
+            last_inode, offset = position
+            if inode != last_inode or os.fstat(f.fileno()).st_size < offset:
+                offset = 0      # The journal was restarted by a full rebuild
+            f.seek(offset)
+            chunk = f.read()
+    except OSError:
+        return position, []
+    chunk = chunk[:chunk.rfind(b'\n') + 1]      # Leave a line that is still being written for the next check
+    records = []
+    for line in chunk.splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return (inode, offset + len(chunk)), records
+
+# The state requests are served from; replaced as a whole by refresh_graph()
+current_state = load_state(0)
+reload_lock = threading.Lock()      # Serializes refreshes; never taken on the request path
+# Distinguishes the ETags of different server processes, whose version counters both start at 0
+etag_prefix = f"{int(time.time() * 1000):x}"
 
-# Route to get the graph data as JSON
+# Bring the served graph up to date with the graph file and its update journal (see kgc.publish_graph).
+# The new version is built next to the current one and swapped in when it is complete; requests keep using the
+# old state until then. With the NetworkX store, journaled updates are applied incrementally, so new data shows up
+# without reloading the file: the new graph and search index share everything the updates do not touch with the
+# current ones (kgc.apply_graph_updates, GraphSearchIndex.clone), and only the nodes and node pairs the updates touch
+# are re-indexed. New edges rank last in search results, and new nodes have no importance score, until RERANK_FRACTION of
+# the edges changed; then, after the updated state is swapped in, the graph is copied, scored (starting from the
+# previous scores) and indexed again, and that state replaces it.
+# A full rebuild (a reset record), a graph file changed without a journal record, or the read-only array store load
+# the graph file again, which for a memory-mapped snapshot is almost free.
+@metrics.timed()
+def refresh_graph():
+    global current_state
+    with reload_lock:
+        state = current_state
+        signature = file_signature(GRAPH_FILE)
+        position, records = read_journal(state.updates_position)
+        updates = [update for update in records if update['seq'] > state.store.attributes().get('seq', 0)]
+        if updates and not any(update.get('reset') for update in updates) and isinstance(state.store, NetworkXGraphStore):
+            # What each source contributed is collected once per loaded graph, then kept up to date from the records
+            provenance = state.provenance if state.provenance is not None else kgc.graph_provenance(state.store.graph)
+            G, nodes, changed, provenance = kgc.apply_graph_updates(state.store.graph, updates, provenance)
+            search_index = state.search_index.clone()
+            for u, v in changed:
+                search_index.sync_edge(G, u, v)
+            for node in nodes:
+                search_index.sync_node(G, node)
+            new_state = GraphState(NetworkXGraphStore(G), state.version + 1, signature, position, *load_relations(state, G),
+                                   *load_vectors(state), search_index=search_index)
+            new_state.provenance, new_state.unranked_changes = provenance, state.unranked_changes + len(changed)
+            if new_state.unranked_changes >= RERANK_FRACTION * len(search_index):       # One index entry per edge
+                current_state = new_state       # Serve the new data while the scores and the ranking are recomputed
+                G = kgc.copy_graph(G)       # The scores change on every node, so nothing can be shared
+                kgc.compute_importance(G)       # Starts from the scores of the previous version, so few iterations
+                new_state = GraphState(NetworkXGraphStore(G), new_state.version + 1, signature, position,
+                                       new_state.relations, new_state.relations_signature, new_state.vectors,
+                                       new_state.vectors_signature)
+                new_state.provenance = provenance
+        elif updates or signature != state.file_signature:
+            new_state = load_state(state.version + 1)       # The graph file already contains every journaled update
+        else:
+            state.updates_position = position       # Only records the loaded graph already contains
+            return
+        current_state = new_state
+        logger.info("Graph refreshed to update %s.", new_state.store.attributes().get('seq', 0))
+
+# Set when a request notices that the graph file or its journal changed, to wake the watcher early
+graph_changed = threading.Event()
+
+# Function run by the background watcher: checks for a new graph every interval seconds, or when woken
+def watch_graph(interval):
+    while True:
+        graph_changed.wait(interval)
+        graph_changed.clear()
+        try:
+            refresh_graph()
+        except Exception as e:
+            logger.exception("Error refreshing the graph: %s", e)
+
+# Cheap check on the request path: wakes the watcher if the graph file or its journal changed. It never waits for
+# the new graph; the request is served from the current state.
+def notice_graph_changes(state):
+    if file_signature(GRAPH_FILE) != state.file_signature or journal_position() != state.updates_position:
+        graph_changed.set()
+
+# Seconds between checks for a new graph; 0 disables the watcher (call refresh_graph() to reload)
+WATCH_INTERVAL = float(os.environ.get('KG_WATCH_INTERVAL', 1.0))
+if WATCH_INTERVAL > 0:
+    threading.Thread(target=watch_graph, args=(WATCH_INTERVAL,), daemon=True, name='graph-watcher').start()
+
+# Get the serialized graph of a state, serializing it only once per version
+def get_data_snapshot(state):
+    snapshot = state.data
+    if snapshot is None:
+        # Convert the graph to a JSON-serializable format
+        graph_data = state.store.node_link_data()
+        snapshot = {'data': graph_data, 'edges_key': 'edges' if 'edges' in graph_data else 'links',
+                    'body': json.dumps(graph_data).encode('utf-8'), 'gzip': None}
+        state.data = snapshot
+    return snapshot
+
+# Build a JSON response with an ETag for the graph version, gzip-compressed if the client accepts it
+def graph_data_response(body, etag, compressed=None):
+    response = make_response()
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(compressed if compressed is not None else gzip.compress(body))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response.set_data(body)
+    response.headers['Content-Type'] = 'application/json'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    response.set_etag(etag)
+    return response.make_conditional(request)       # 304 Not Modified if the client already has this version
+
+# Route to get the graph data as JSON.
+# With ?page=N (and optionally page_size), nodes and edges are returned in pages so large graphs can be loaded progressively.
 @app.route('/api/data', methods=['GET'])
 def get_data():
+    state = current_state
+    notice_graph_changes(state)
     try:
-        # Convert the NetworkX graph to a JSON-serializable format
-        graph_data = json_graph.node_link_data(G)
-        response = make_response(json.dumps(graph_data))
-        response.headers['Content-Type'] = 'application/json'
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response
+        snapshot = get_data_snapshot(state)
+        etag = f"{etag_prefix}-{state.version}"
+        page = request.args.get('page', type=int)
+        if page is None:
+            if 'gzip' in request.headers.get('Accept-Encoding', '') and snapshot['gzip'] is None:
+                snapshot['gzip'] = gzip.compress(snapshot['body'])
+            return graph_data_response(snapshot['body'], etag, snapshot['gzip'])
+
+        page_size = max(request.args.get('page_size', default=1000, type=int), 1)
+        graph_data, edges_key = snapshot['data'], snapshot['edges_key']
+        start = max(page, 0) * page_size
+        page_data = {
+            'page': page,
+            'page_size': page_size,
+            'total_nodes': len(graph_data['nodes']),
+            'total_edges': len(graph_data[edges_key]),
+            'nodes': graph_data['nodes'][start:start + page_size],
+            edges_key: graph_data[edges_key][start:start + page_size],
+        }
+        page_data['has_more'] = start + page_size < max(page_data['total_nodes'], page_data['total_edges'])
+        return graph_data_response(json.dumps(page_data).encode('utf-8'), f"{etag}-{page}-{page_size}")
     except Exception as e:
-        print(f"Error in /api/data route: {e}")
+        logger.exception("Error in /api/data route: %s", e)
         return jsonify({"error": "Failed to get data"}), 200
 
+# Route to stream the graph data as NDJSON: a header line, then one line per node and one line per edge
+@app.route('/api/data/stream', methods=['GET'])
+def stream_data():
+    state = current_state
+    notice_graph_changes(state)
+    snapshot = get_data_snapshot(state)
+    graph_data, edges_key = snapshot['data'], snapshot['edges_key']
+
+    def generate():
+        yield json.dumps({'directed': graph_data['directed'], 'multigraph': graph_data['multigraph'], 'graph': graph_data['graph'],
+                          'total_nodes': len(graph_data['nodes']), 'total_edges': len(graph_data[edges_key])}) + '\n'
+        for node in graph_data['nodes']:
+            yield json.dumps({'node': node}) + '\n'
+        for edge in graph_data[edges_key]:
+            yield json.dumps({'edge': edge}) + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    response.set_etag(f"{etag_prefix}-{state.version}-stream")
+    return response.make_conditional(request)
+
+# Format a path as "A --relation-- B --relation-- C"
+def format_path(traversal, path):
+    parts = [path[0]]
+    for u, v in zip(path, path[1:]):
+        relation = traversal.relation(u, v)
+        parts.append(f"--{relation if relation is not None else 'unknown'}-- {v}")
+    return ' '.join(parts)
+
+# Answer "how is X related to Y" with the shortest relation paths between the two nodes; returns (answer, complete)
+def answer_paths(state, first, second):
+    source, target = state.resolve_node(first), state.resolve_node(second)
+    missing = [name for name, node in ((first, source), (second, target)) if node is None]
+    if missing:
+        return f"No node named {' or '.join(repr(name) for name in missing)}.", True
+    paths, complete = state.traversal.k_shortest_paths(source, target, k=PATHS_PER_QUERY)
+    limited = '' if complete else ' (search stopped at the traversal limit)'
+    if not paths:
+        return f"No path found between '{source}' and '{target}'{limited}.", complete
+    return f"'{source}' is related to '{target}' by: {'; '.join(format_path(state.traversal, path) for path in paths)}{limited}.", complete
+
+# Answer "within k hops of X" with the nodes around X, grouped by distance; returns (answer, complete)
+def answer_neighbourhood(state, name, hops):
+    node = state.resolve_node(name)
+    if node is None:
+        return f"No node named '{name}'.", True
+    hops = min(max(hops, 1), MAX_HOPS)
+    found, complete = state.traversal.neighbourhood(node, hops)
+    limited = '' if complete else ' (search stopped at the traversal limit)'
+    groups = {}
+    for neighbor, (distance, parent, relation) in itertools.islice(found.items(), MAX_LISTED_NODES + 1):
+        if distance:
+            via = f"{relation if relation is not None else 'unknown'}" + (f" via {parent}" if distance > 1 else '')
+            groups.setdefault(distance, []).append(f"{neighbor} ({via})")
+    if not groups:
+        return f"Node '{node}' has no neighbours{limited}.", complete
+    answer = f"Within {hops} hop{'s' if hops > 1 else ''} of '{node}': " + \
+        '; '.join(f"{distance} hop{'s' if distance > 1 else ''}: {', '.join(names)}" for distance, names in groups.items()) + \
+        (f" and {len(found) - 1 - MAX_LISTED_NODES} more" if len(found) - 1 > MAX_LISTED_NODES else '') + f"{limited}."
+    return answer, complete
+
+# Answer "edges with relation R" with every relationship that has the relation (any case). Uses the index of the
+# relation store, with how often each triple occurred; the edges are scanned instead if it failed to load.
+def answer_relation(state, relation):
+    if state.relations is not None:
+        triples = [(subj, obj, rel, count) for subj, rel, obj, count, _ in state.relations.find(relation=relation)]
+    else:
+        triples = [(u, v, rel, 1) for u, v, rel in state.store.edges() if str(rel).lower() == relation]
+    if not triples:
+        return f"No relationships with relation '{relation}'."
+    listed = [f"{subj} -- {obj}: {rel}" + (f" ({count} times)" if count > 1 else '')
+              for subj, obj, rel, count in triples[:MAX_LISTED_EDGES]]
+    more = f" and {len(triples) - MAX_LISTED_EDGES} more" if len(triples) > MAX_LISTED_EDGES else ''
+    return f"Relationships with relation '{relation}': {', '.join(listed)}{more}."
+
+# Answer a search with one page of the matching edges, from position offset on, and the cursor of the next page
+def answer_matches(state, term, offset, limit):
+    matches, total = state.search_edges(term, limit, offset)
+    if not total:
+        return {"answer": "No matches found for the query."}
+    if not matches:
+        return {"answer": f"No more matches: all {total} were listed.", "total": total}
+    response = {"answer": f"Found matches: {', '.join(matches)}.", "total": total}
+    if total > len(matches):
+        response["answer"] += f" Showing {offset + 1}-{offset + len(matches)} of {total}."
+    if offset + len(matches) < total:
+        response["next_cursor"] = state.cursor(offset + len(matches))
+    return response
+
+# Answer "similar to X" with the k nodes whose vectors are closest to X's: the vector of the node X names, otherwise
+# the vector of the text X, which needs the word vectors of the spaCy model the node vectors were computed with
+def answer_similar(state, text, k):
+    if state.vectors is None or not len(state.vectors):
+        return "Similarity search is not available: the graph has no node vectors."
+    node = state.resolve_node(text)
+    vector = state.vectors.vector(node) if node is not None else None
+    if vector is None:
+        try:
+            nlp = kgc.get_vectors_nlp()
+        except OSError as e:
+            return f"No node vector for '{text}', and it cannot be computed: {e}."
+        if kgc.vectors_model(nlp) != state.vectors.model:
+            return f"No node vector for '{text}', and the loaded model's word vectors differ from the graph's."
+        vector = kgc.embed_texts([text], nlp)[0]
+        if not vector.any():
+            return f"No similar nodes: none of the words of '{text}' has a vector."
+    matches = state.vectors.search(vector, k, probes=VECTOR_PROBES, exclude=(node,) if node is not None else ())[0]
+    if not matches:
+        return f"No nodes similar to '{text}'."
+    return f"Nodes similar to '{text}': {', '.join(f'{name} ({score:.2f})' for name, score in matches)}."
+
+# Bounded LRU cache of /query answers, keyed by the normalized query. Entries belong to one graph version: the first
+# lookup for a newer version drops them all, so an answer never outlives a reload or update of the graph.
+class QueryCache:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version, query):
+        with self._lock:
+            if self.version is None or version > self.version:
+                if self._entries:
+                    self._entries.clear()
+                    self.invalidations += 1
+                self.version = version
+            answer = self._entries.get(query) if version == self.version else None      # Requests on an older version miss
+            if answer is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(query)
+            self.hits += 1
+            return answer
+
+    def put(self, version, query, answer):
+        with self._lock:
+            if version != self.version or self.max_entries <= 0:
+                return
+            self._entries[query] = answer
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'invalidations': self.invalidations, 'graph_version': self.version}
+
+query_cache = QueryCache(QUERY_CACHE_SIZE)
+
+# Route to get the hit rate and size of the /query result cache; DELETE empties it
+@app.route('/query-cache', methods=['GET', 'DELETE'])
+def query_cache_stats():
+    if request.method == 'DELETE':
+        query_cache.clear()
+    return jsonify(query_cache.stats()), 200
+
+# Per-stage timings (p50/p99 over the latest calls) and counters of the server; ?format=prometheus for the text format
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if request.args.get('format') == 'prometheus':
+        return Response(metrics.registry.prometheus(), mimetype='text/plain; version=0.0.4')
+    return jsonify(metrics.registry.snapshot()), 200
+
 # Route to query the graph
 @app.route('/query', methods=['OPTIONS', 'POST', 'GET'])
 @cross_origin()
@@ -61,88 +556,110 @@ def query_graph():
         return response
 
     if request.method == 'POST':
+        state = current_state       # One consistent graph version for the whole request
+        store = state.store
+        notice_graph_changes(state)
         try:
             # Get the query data from the POST request
             query_data = request.json
-            query = query_data.get('query', '').strip().lower()
-            print(f"Received query: {query}")
+            query = ' '.join(query_data.get('query', '').lower().split())       # Normalized: lowercase, single spaces
+            logger.debug("Received query: %s", query)
+            limit = min(max(int(query_data.get('limit') or QUERY_PAGE_SIZE), 1), MAX_QUERY_PAGE_SIZE)
+            offset = 0
+            if query_data.get('cursor'):
+                graph_key, _, position = str(query_data['cursor']).rpartition(':')
+                if graph_key != state.graph_key() or not position.isdigit():
+                    return jsonify({"error": "The cursor is not valid for the current graph; repeat the query without it."})
+                offset = int(position)
+            cache_key = f"{query}\x00{offset}:{limit}"      # Every page of every page size is its own answer
 
+            cached = query_cache.get(state.version, cache_key)
+            if cached is not None:
+                logger.debug("Cached response: %s", cached)
+                metrics.increment('queries_cached')
+                return jsonify(cached)
+            metrics.increment('queries_answered')
+
+            cacheable = True        # Answers cut short by a traversal limit are not cached
             if not query:
                 response = {"answer": "No query provided. Please provide a query."}
             else:
                 # Query for specific node information
                 if query.startswith("info about") or query.startswith("information about"):
                     node = query.split("about")[-1].strip()
-                    print("In loop startwith node")
-                    if G.has_node(node):
-                        node_data = G.nodes[node]
+                    logger.debug("In loop startwith node")
+                    if store.has_node(node):
+                        label = store.node_label(node)
                         response = {
-                            "answer": f"Node '{node}' has label '{node_data.get('label', 'unknown')}'."
+                            "answer": f"Node '{node}' has label '{label if label is not None else 'unknown'}'."
                         }
                     else:
-                        matches = []
-                    
-                        for u, v, data in G.edges(data=True):
-                            if node in u.lower() or node in v.lower() or node in data.get('relation', '').lower():
-                                matches.append(f"{u} -- {v}: {data.get('relation', 'unknown')}")
-                        print(matches)
-                        if matches:
-                            response = {
-                                "answer": f"Found matches: {', '.join(matches)}."
-                            }
-                        else:
-                            response = {
-                                "answer": "No matches found for the query."
-                            }
-                        
+                        response = answer_matches(state, node, offset, limit)
+                        logger.debug("Matches: %s", response)
+
                 # Query for edges related to a specific node
                 elif query.startswith("relationships of") or query.startswith("relations of"):
                     node = query.split("of")[-1].strip()
-                    print("In loop startwith edge")
-                    if G.has_node(node):
-                        edges = list(G.edges(node, data=True))
+                    logger.debug("In loop startwith edge")
+                    if store.has_node(node):
+                        # Every distinct relationship, including the ones the graph keeps only one of per node pair
+                        triples = state.relations.find_node(node) if state.relations is not None else []
+                        if triples:
+                            edges = [(subj, obj, relation) for subj, relation, obj, _, _ in triples]
+                        else:
+                            edges = [(node, v, relation) for v, relation in store.neighbors(node)]
                         if edges:
-                            relations = [f"{u} -- {v}: {data.get('relation', 'unknown')}" for u, v, data in edges]
+                            relations = [f"{subj} -- {obj}: {relation if relation is not None else 'unknown'}"
+                                         for subj, obj, relation in edges[:MAX_LISTED_EDGES]]
+                            more = f" and {len(edges) - MAX_LISTED_EDGES} more" if len(edges) > MAX_LISTED_EDGES else ''
                             response = {
-                                "answer": f"Node '{node}' has the following relationships: {', '.join(relations)}."
+                                "answer": f"Node '{node}' has the following relationships: {', '.join(relations)}{more}."
                             }
+                        else:
+                            response = {"answer": f"Node '{node}' has no relationships."}
                     else:
-                        matches = []
-                        for u, v, data in G.edges(data=True):
-                            if node in u.lower() or node in v.lower() or node in data.get('relation', '').lower():
-                                matches.append(f"{u} -- {v}: {data.get('relation', 'unknown')}")
+                        response = answer_matches(state, node, offset, limit)
 
-                        if matches:
-                            response = {
-                                "answer": f"Found matches: {', '.join(matches)}."
-                            }
-                        else:
-                            response = {
-                                "answer": "No matches found for the query."
-                            }
+                # Query for the relation paths between two nodes, e.g. "how is altera related to intel"
+                elif any(pattern.match(query) for pattern in RELATED_QUERIES):
+                    first, second = next(pattern.match(query) for pattern in RELATED_QUERIES if pattern.match(query)).groups()
+                    logger.debug("In loop path")
+                    answer, cacheable = answer_paths(state, first.strip(), second.strip())
+                    response = {"answer": answer}
+
+                # Query for the relationships with a relation, e.g. "edges with relation found"
+                elif RELATION_QUERY.match(query):
+                    relation = RELATION_QUERY.match(query).group(1).strip()
+                    logger.debug("In loop relation")
+                    response = {"answer": answer_relation(state, relation)}
+
+                # Query for the neighbourhood of a node, e.g. "everything within 2 hops of stratix"
+                elif WITHIN_HOPS_QUERY.match(query):
+                    hops, node = WITHIN_HOPS_QUERY.match(query).groups()
+                    logger.debug("In loop hops")
+                    answer, cacheable = answer_neighbourhood(state, node.strip(), int(hops))
+                    response = {"answer": answer}
+
+                # Query for the nodes most similar to a node or phrase, e.g. "similar to stratix"
+                elif SIMILAR_QUERY.match(query):
+                    top, text = SIMILAR_QUERY.match(query).groups()
+                    logger.debug("In loop similar")
+                    k = max(min(int(top), MAX_SIMILAR_RESULTS), 1) if top else SIMILAR_RESULTS
+                    response = {"answer": answer_similar(state, text.strip(), k)}
 
                 # General query to find any mentions of a keyword
                 else:
-                    matches = []
-                    print("In loop keyword")
-                    for u, v, data in G.edges(data=True):
-                        if query in u.lower() or query in v.lower() or query in data.get('relation', '').lower():
-                            matches.append(f"{u} -- {v}: {data.get('relation', 'unknown')}")
-
-                    if matches:
-                        response = {
-                            "answer": f"Found matches: {', '.join(matches)}."
-                        }
-                    else:
-                        response = {
-                            "answer": "No matches found for the query."
-                        }
+                    logger.debug("In loop keyword")
+                    response = answer_matches(state, query, offset, limit)
 
-            print(f"Response: {response}")
+            logger.debug("Response: %s", response)
+            if cacheable:
+                query_cache.put(state.version, cache_key, response)
             return jsonify(response)
 
         except Exception as e:
-            print(f"Error in /query route: {e}")
+            logger.exception("Error in /query route: %s", e)
+            metrics.increment('query_errors')
             response = {"error": str(e)}
             return jsonify(response), 200
 
@@ -166,7 +683,7 @@ def download_response():
         response.headers["Content-Type"] = "text/plain"
         return response
     except Exception as e:
-        print(f"Error in /download route: {e}")
+        logger.exception("Error in /download route: %s", e)
         return jsonify({"error": str(e)}), 500
 
 # Run the Flask application
@@ -0,0 +1,721 @@
+import argparse     # To parse the command line arguments
+import html     # To escape the text of the synthetic pages
+import http.server      # To serve the synthetic pages of the suite locally
+import importlib        # To import WebScraping_Small-2.py, whose name is not a valid module name
+import itertools        # To sample the relations of the synthetic graph
+import json     # To read the measurements reported by the profile subprocesses
+import os       # To measure file sizes
+import tempfile     # To write the benchmark graph files
+import tracemalloc      # To measure the memory of the NetworkX graph
+import random       # To generate synthetic graphs
+import resource     # To report the peak RSS of the suite
+import subprocess       # To measure each pipeline profile in a fresh interpreter
+import sys      # To start the profile subprocesses with the same interpreter
+import threading        # To run the local page server of the suite
+import time     # To measure elapsed time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import KnowledgeGraphConstruction as kgc
+import metrics
+from graph_index import GraphSearchIndex
+from graph_paths import GraphTraversal
+from graph_store import NetworkXGraphStore, ArrayGraphStore
+from node_vectors import NodeVectors, normalize_rows
+
+scraper = importlib.import_module('WebScraping_Small-2')
+
+# CSV files produced by WebScraping_Small-2.py that ship with the repository
+BUNDLED_CSVS = ['https_en_wikipedia_org_wiki_Field_programmable_gate_array.csv', 'old.csv']
+
+
+# Function to load the paragraphs of the bundled Wikipedia CSVs
+def load_bundled_paragraphs(csv_files=None, repeat=1):
+    paragraphs = []
+    for csv_file in csv_files or BUNDLED_CSVS:
+        paragraphs.extend(kgc.read_data_from_csv(csv_file))
+    return paragraphs * repeat      # Repeat the corpus to get a multi-thousand paragraph workload
+
+
+# Function to measure graph construction throughput (paragraphs/sec) against the worker count
+def bench_build_throughput(paragraphs, workers=(1, 2, 4), batch_size=kgc.DEFAULT_BATCH_SIZE):
+    results = []
+
+    start = time.perf_counter()
+    serial_graph = kgc.build_knowledge_graph(paragraphs)
+    elapsed = time.perf_counter() - start
+    results.append(('serial', 1, len(paragraphs) / elapsed))
+
+    for n_process in workers:
+        start = time.perf_counter()
+        G = kgc.build_knowledge_graph(paragraphs, batch_size=batch_size, n_process=n_process)
+        elapsed = time.perf_counter() - start
+        # The batched path must produce the same graph as the serial one
+        same = dict(G.nodes(data=True)) == dict(serial_graph.nodes(data=True)) and \
+            {frozenset((u, v)): d for u, v, d in G.edges(data=True)} == \
+            {frozenset((u, v)): d for u, v, d in serial_graph.edges(data=True)}
+        if not same:
+            print(f"WARNING: batched graph with n_process={n_process} differs from the serial graph")
+        results.append(('batched', n_process, len(paragraphs) / elapsed))
+
+    print(f"Graph construction on {len(paragraphs)} paragraphs (batch_size={batch_size})")
+    print(f"{'mode':<10}{'workers':>8}{'paragraphs/sec':>18}")
+    for mode, n_process, rate in results:
+        print(f"{mode:<10}{n_process:>8}{rate:>18.1f}")
+    return results
+
+
+# Script run in a fresh interpreter per profile, so import time and RSS are not skewed by earlier runs
+PROFILE_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import networkx as nx
+import pandas as pd
+import KnowledgeGraphConstruction as kgc
+from graph_index import GraphSearchIndex
+from graph_paths import GraphTraversal
+from graph_store import NetworkXGraphStore, ArrayGraphStore
+import_time = time.perf_counter() - start
+import_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+kgc.configure_pipeline(sys.argv[1])
+import spacy
+model = kgc.PIPELINE_PROFILES[sys.argv[1]]['model']
+if not spacy.util.is_package(model):
+    print(json.dumps({'import_s': import_time, 'missing': model, 'rss_mb': import_rss}))
+    sys.exit(0)
+start = time.perf_counter()
+nlp = kgc.get_nlp()
+load_time = time.perf_counter() - start
+paragraphs = json.loads(sys.stdin.read())
+start = time.perf_counter()
+for paragraph in paragraphs:
+    kgc.extract_from_doc(nlp(paragraph))
+latency = (time.perf_counter() - start) / len(paragraphs)
+print(json.dumps({'import_s': import_time, 'load_s': load_time, 'pipes': nlp.pipe_names,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 'latency_ms': latency * 1000}))
+"""
+
+# Function to report import time, model load time, peak RSS and per-paragraph latency for each pipeline profile
+def bench_pipeline_profiles(paragraphs, profiles=tuple(kgc.PIPELINE_PROFILES)):
+    results = {}
+    for profile in profiles:
+        proc = subprocess.run([sys.executable, '-c', PROFILE_SCRIPT, profile], input=json.dumps(paragraphs),
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"Profile '{profile}' failed: {proc.stderr.strip().splitlines()[-1:]}")
+            continue
+        results[profile] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    print(f"spaCy pipeline profiles on {len(paragraphs)} paragraphs")
+    print(f"{'profile':<8}{'import s':>10}{'load s':>10}{'RSS MB':>10}{'ms/paragraph':>14}  pipes")
+    for profile, r in results.items():
+        if 'missing' in r:      # Only the import is measured: RSS is that of the process before any model
+            print(f"{profile:<8}{r['import_s']:>10.2f}{'-':>10}{r['rss_mb']:>10.0f}{'-':>14}  model {r['missing']} is not installed")
+            continue
+        print(f"{profile:<8}{r['import_s']:>10.2f}{r['load_s']:>10.2f}{r['rss_mb']:>10.0f}{r['latency_ms']:>14.2f}  {','.join(r['pipes'])}")
+    return results
+
+
+# Function to generate a synthetic knowledge graph with FPGA-flavoured node names and relation lemmas
+def synthetic_graph(n_edges, n_nodes=None, seed=0):
+    rng = random.Random(seed)
+    n_nodes = n_nodes or max(n_edges // 5, 10)
+    words = ['fpga', 'altera', 'intel', 'stratix', 'cyclone', 'arria', 'xilinx', 'logic', 'block', 'memory',
+             'chip', 'device', 'gate', 'array', 'clock', 'signal', 'design', 'vendor', 'board', 'core']
+    relations = ['be', 'of', 'in', 'with', 'found', 'acquire', 'use', 'for', 'on', 'by', 'make', 'have']
+    nodes = [f"{rng.choice(words).title()} {rng.choice(words)} {i}" for i in range(n_nodes)]
+    G = nx.Graph()
+    for node in nodes:
+        G.add_node(node, label=rng.choice(['ORG', 'PRODUCT', 'DATE', 'GPE']))
+    edges = 0
+    while edges < n_edges:      # G.number_of_edges() walks all nodes, so count the new edges here
+        u, v = rng.choice(nodes), rng.choice(nodes)
+        if not G.has_edge(u, v):
+            G.add_edge(u, v, relation=rng.choice(relations))
+            edges += 1
+    return G
+
+
+# The linear scan app.query_graph used before the search index
+def scan_edges(G, term):
+    return [(u, v, data.get('relation')) for u, v, data in G.edges(data=True)
+            if term in u.lower() or term in v.lower() or term in data.get('relation', '').lower()]
+
+
+# Function to compare the search index with the linear edge scan on a synthetic graph
+def bench_search_index(n_edges=1000000, terms=('stratix', 'acquire', 'xilinx 4', 'zzz', 'in', 'memory 12345')):
+    G = synthetic_graph(n_edges)
+    start = time.perf_counter()
+    index = GraphSearchIndex(NetworkXGraphStore(G))
+    build_time = time.perf_counter() - start
+
+    print(f"Search on a synthetic graph with {G.number_of_nodes()} nodes and {G.number_of_edges()} edges "
+          f"(index built in {build_time:.2f}s)")
+    print(f"{'term':<16}{'matches':>10}{'scan ms':>12}{'index ms':>12}{'same':>6}")
+    for term in terms:
+        start = time.perf_counter()
+        scanned = scan_edges(G, term)
+        scan_time = time.perf_counter() - start
+        start = time.perf_counter()
+        found = index.search(term)
+        index_time = time.perf_counter() - start
+        print(f"{term:<16}{len(found):>10}{scan_time * 1000:>12.1f}{index_time * 1000:>12.1f}{str(found == scanned):>6}")
+
+
+# Function to time a call, returning (seconds, result)
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+# Function to compare file size and save/load time of the JSON file and the binary snapshot
+def bench_snapshot(graphs):
+    print(f"{'graph':<26}{'format':<10}{'size KB':>10}{'save s':>9}{'open s':>9}{'to nx s':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, G in graphs.items():
+            json_file, snapshot_file = os.path.join(tmp, 'graph.json'), os.path.join(tmp, 'graph' + kgc.SNAPSHOT_SUFFIX)
+            save_time, _ = timed(kgc.save_graph_to_json, G, json_file)
+            load_time, _ = timed(kgc.read_graph_from_json, json_file)
+            print(f"{name:<26}{'json':<10}{os.path.getsize(json_file) / 1024:>10.0f}{save_time:>9.3f}{'-':>9}{load_time:>9.3f}")
+            save_time, _ = timed(kgc.save_graph_to_snapshot, G, snapshot_file)
+            open_time, snapshot = timed(kgc.GraphSnapshot, snapshot_file)
+            load_time, _ = timed(snapshot.to_networkx)
+            snapshot.close()
+            print(f"{name:<26}{'snapshot':<10}{os.path.getsize(snapshot_file) / 1024:>10.0f}{save_time:>9.3f}{open_time:>9.4f}{load_time:>9.3f}")
+
+
+# Function to compare memory and lookup latency of the NetworkX and the array graph store
+def bench_graph_store(n_edges=1000000, lookups=2000):
+    G = synthetic_graph(n_edges)
+    rng = random.Random(1)
+    probe = rng.sample(list(G.nodes()), min(lookups, G.number_of_nodes()))
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_file = os.path.join(tmp, 'graph' + kgc.SNAPSHOT_SUFFIX)
+        kgc.save_graph_to_snapshot(G, snapshot_file)
+        del G
+
+        tracemalloc.start()
+        snapshot = kgc.GraphSnapshot(snapshot_file)
+        nx_store = NetworkXGraphStore(snapshot.to_networkx())
+        snapshot.close()
+        nx_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        array_store = ArrayGraphStore.open(snapshot_file)
+        array_memory = sum(array.nbytes for array in array_store.snapshot.arrays.values())
+
+        print(f"Graph stores on a synthetic graph with {nx_store.number_of_nodes()} nodes and {nx_store.number_of_edges()} edges")
+        print(f"{'store':<10}{'memory MB':>11}{'has_node us':>13}{'neighbors us':>14}{'edge scan s':>13}")
+        for name, store, memory in (('networkx', nx_store, nx_memory), ('array', array_store, array_memory)):
+            has_node_time, _ = timed(lambda: [store.has_node(node) for node in probe])
+            neighbors_time, _ = timed(lambda: [store.neighbors(node) for node in probe])
+            scan_time, _ = timed(lambda: sum(1 for _ in store.edges()))
+            print(f"{name:<10}{memory / 2**20:>11.1f}{has_node_time / len(probe) * 1e6:>13.2f}"
+                  f"{neighbors_time / len(probe) * 1e6:>14.2f}{scan_time:>13.2f}")
+        array_store.close()
+
+
+# Function to rebuild a Wikipedia-like article page from a scraped CSV: the saved title, headings and paragraphs,
+# with links and citation markers in the text, plus the navigation, infobox, references, scripts and styles
+# that make up most of a real article's markup
+def synthetic_html_page(csv_file, seed=0):
+    rng = random.Random(seed)
+    df = pd.read_csv(csv_file)
+    title = html.escape(str(df['title'].dropna().iloc[0]))
+    headings = [html.escape(str(h)) for h in df['headings'].dropna()]
+    paragraphs = [html.escape(str(p)) for p in df['paragraphs'].dropna()]
+
+    def linked(text):
+        words = text.split(' ')
+        for i in rng.sample(range(len(words)), len(words) // 8):
+            words[i] = f'<a href="/wiki/{words[i]}" title="{words[i]}">{words[i]}</a>'
+        return ' '.join(words) + f'<sup class="reference"><a href="#cite_note-{rng.randint(1, 99)}">[{rng.randint(1, 99)}]</a></sup>'
+
+    parts = [f'<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><title>{title}</title>',
+             '<script>' + 'RLCONF={"wgPageName":"x","wgRelevantArticleId":1};' * 200 + '</script>',
+             '<style>' + '.mw-parser-output .hatnote{font-style:italic}' * 200 + '</style></head><body>',
+             '<div id="mw-navigation"><ul>' + ''.join(f'<li><a href="/wiki/Nav_{i}">Navigation link {i}</a></li>' for i in range(300)) + '</ul></div>',
+             '<div id="content"><table class="infobox">' + ''.join(f'<tr><th>Field {i}</th><td><a href="/wiki/V{i}">Value {i}</a></td></tr>' for i in range(30)) + '</table>']
+    for i, paragraph in enumerate(paragraphs):
+        if headings and i % max(len(paragraphs) // len(headings), 1) == 0:
+            heading = headings.pop(0)
+            parts.append(f'<div class="mw-heading"><h2 id="h{i}">{heading}</h2><span class="mw-editsection">[<a href="?action=edit">edit</a>]</span></div>')
+        parts.append(f'<p>{linked(paragraph)}</p>')
+    parts.extend(f'<h3>{heading}</h3>' for heading in headings)
+    parts.append('<ol class="references">' + ''.join(f'<li id="cite_note-{i}"><span class="reference-text"><cite>Reference {i}. '
+                 f'<a href="https://example.com/{i}">Source</a></cite></span></li>' for i in range(200)) + '</ol>')
+    parts.append('<div class="navbox"><table>' + ''.join(f'<tr><td><a href="/wiki/Related_{i}">Related article {i}</a></td></tr>' for i in range(400)) + '</table></div>')
+    parts.append('</div></body></html>')
+    return ''.join(parts)
+
+
+# Markup the extractors must read like BeautifulSoup: Tag.string of titles with a single child (element, comment,
+# CDATA section), CDATA sections in text, unclosed and stray end tags, hidden text and character references.
+# They are only compared with bs4, not timed.
+HTML_EDGE_CASES = [
+    '<title><b>x</b></title>', '<title><!--c--></title>', '<title><b><i>y</i></b></title>', '<title><b>x</b>y</title>',
+    '<title><![CDATA[t]]></title>', '<title></title>', '<title><br></title>', '<title>a</title><title>b</title>',
+    '<p>a<![CDATA[zz]]>b</p>', '<h1>a<!--c-->b</h1>', '<p>a<script>s</script>b</p>', '<p>a<p>b</p>c</p>',
+    '<div><p>a</div>b</p>', '<h2>a</b>b</h2>', '<title>a &amp; b</title><p>&lt;c&gt;&#33;</p>',
+]
+
+
+# Function to compare the HTML extraction backends of WebScraping_Small-2.py on saved (or synthetic) pages
+def bench_html_backends(pages, repeat=5):
+    backends = [backend for backend in scraper.HTML_BACKENDS if backend != 'lxml' or scraper.lxml is not None]
+    total_kb = sum(len(page) for page in pages.values()) / 1024
+    print(f"HTML extraction on {len(pages)} pages ({total_kb:.0f} KB), best of {repeat}")
+    print(f"{'backend':<10}{'ms/page':>10}{'MB/s':>8}{'speedup':>9}  same as bs4  edge cases")
+    reference = {name: scraper.extract_data(scraper.parse_html(page)) for name, page in pages.items()}
+    edge_reference = [scraper.extract_data(scraper.parse_html(case)) for case in HTML_EDGE_CASES]
+    baseline = None
+    for backend in reversed(backends):      # bs4 first, as the baseline
+        elapsed = min(timed(lambda: [scraper.extract_page(page, backend) for page in pages.values()])[0] for _ in range(repeat))
+        baseline = baseline or elapsed
+        same = all(scraper.extract_page(page, backend) == reference[name] for name, page in pages.items())
+        edge_same = sum(scraper.extract_page(case, backend) == expected for case, expected in zip(HTML_EDGE_CASES, edge_reference))
+        print(f"{backend:<10}{elapsed / len(pages) * 1000:>10.1f}{total_kb / 1024 / elapsed:>8.1f}{baseline / elapsed:>9.1f}"
+              f"  {str(same):<11}  {edge_same}/{len(HTML_EDGE_CASES)}")
+
+
+# Function to compare a graph with its canonicalized version (kgc.canonicalize_graph): node and edge counts, and the
+# latency of keyword search and 2-hop neighbourhood queries, in ms per query (best of repeat)
+def bench_canonicalization(G, terms=('fpga', 'fpgas', 'altera', 'xilinx', 'design', 'logic block', 'memory'), repeat=20):
+    canonical_time, C = timed(kgc.canonicalize_graph, G)
+    print(f"Canonicalization took {canonical_time * 1000:.0f} ms")
+    print(f"{'graph':<14}{'nodes':>8}{'edges':>8}{'search ms':>11}{'matches':>9}{'2-hop ms':>10}{'reached':>9}")
+    for name, graph in (('raw', G), ('canonical', C)):
+        store = NetworkXGraphStore(graph)
+        index, traversal = GraphSearchIndex(store), GraphTraversal(store, max_visited=10 ** 9, time_limit=60)
+        search_time = min(timed(lambda: [index.search(term) for term in terms])[0] for _ in range(repeat))
+        matches = sum(len(index.search(term)) for term in terms)
+        starts = [index.node_named(term) or index.node_named(kgc.normalize_name(term)) for term in terms]
+        starts = [node for node in starts if node is not None]
+        hop_time = min(timed(lambda: [traversal.neighbourhood(node, 2) for node in starts])[0] for _ in range(repeat))
+        reached = sum(len(traversal.neighbourhood(node, 2)[0]) for node in starts)
+        print(f"{name:<14}{graph.number_of_nodes():>8}{graph.number_of_edges():>8}"
+              f"{search_time / len(terms) * 1000:>11.3f}{matches:>9}"
+              f"{hop_time / max(len(starts), 1) * 1000:>10.3f}{reached:>9}")
+
+
+# Vocabulary of the synthetic corpus: sentences about vendors, product families and years, in the shape of the
+# bundled Wikipedia articles, so extraction finds entities and subject-verb-object relationships in them
+SYNTHETIC_VENDORS = ['Altera', 'Intel', 'Xilinx', 'AMD', 'Lattice', 'Microchip', 'Achronix', 'QuickLogic', 'Actel', 'Atmel']
+SYNTHETIC_FAMILIES = ['Stratix', 'Cyclone', 'Arria', 'Virtex', 'Spartan', 'Kintex', 'Zynq', 'ECP', 'PolarFire', 'Speedster']
+SYNTHETIC_NOUNS = ['logic block', 'memory', 'transceiver', 'clock network', 'processor core', 'lookup table', 'interconnect',
+                   'design tool', 'development board', 'programmable device']
+SYNTHETIC_SENTENCES = ['{vendor} acquired {other} in {year}.', '{vendor} introduced the {family} {n} in {year}.',
+                       'The {family} {n} uses a {noun} from {vendor}.', '{vendor} sells the {family} {n} to {other}.',
+                       'The {family} {n} is a {noun} with {count} {noun2}s.', '{other} designed the {noun} of the {family} {n}.']
+
+
+# Function to generate a synthetic corpus of paragraphs; the number of distinct products grows with the corpus
+def synthetic_corpus(n_paragraphs, sentences_per_paragraph=5, seed=0):
+    rng = random.Random(seed)
+    products = max(n_paragraphs // 10, 10)
+    paragraphs = []
+    for _ in range(n_paragraphs):
+        sentences = []
+        for _ in range(sentences_per_paragraph):
+            vendor, other = rng.sample(SYNTHETIC_VENDORS, 2)
+            noun, noun2 = rng.sample(SYNTHETIC_NOUNS, 2)
+            sentences.append(rng.choice(SYNTHETIC_SENTENCES).format(
+                vendor=vendor, other=other, family=rng.choice(SYNTHETIC_FAMILIES), n=rng.randrange(products),
+                year=rng.randint(1984, 2024), noun=noun, noun2=noun2, count=rng.randint(2, 4096)))
+        paragraphs.append(' '.join(sentences))
+    return paragraphs
+
+
+# Function to lay a corpus out as article pages, {path: html}, with a title, headings, citation markers,
+# navigation links and a script, like the pages the scraper fetches
+def synthetic_pages(paragraphs, paragraphs_per_page=50, seed=0):
+    rng = random.Random(seed)
+    pages = {}
+    for start in range(0, len(paragraphs), paragraphs_per_page):
+        number = start // paragraphs_per_page
+        body = ''.join(f'<h2>Section {i}</h2>' * (i % 10 == 0) + f'<p>{html.escape(paragraph)}'
+                       f'<sup class="reference"><a href="#cite_note-{rng.randint(1, 99)}">[{rng.randint(1, 99)}]</a></sup></p>'
+                       for i, paragraph in enumerate(paragraphs[start:start + paragraphs_per_page]))
+        pages[f'/wiki/Synthetic_{number}'] = (
+            f'<!DOCTYPE html><html><head><title>Synthetic article {number}</title>'
+            '<script>' + 'RLCONF={"wgPageName":"x"};' * 50 + '</script></head><body><div id="mw-navigation"><ul>' +
+            ''.join(f'<li><a href="/wiki/Nav_{i}">Link {i}</a></li>' for i in range(100)) +
+            f'</ul></div><div id="content"><h1>Synthetic article {number}</h1>{body}</div></body></html>')
+    return pages
+
+
+# Function to generate a query mix for /query over a graph, as (kind, query); mix gives the weight of each kind
+def synthetic_queries(G, n_queries, mix, seed=0):
+    rng = random.Random(seed)
+    nodes = list(G.nodes())
+    relations = sorted({data.get('relation') for _, _, data in itertools.islice(G.edges(data=True), 10000)} - {None})
+    words = sorted({word for node in nodes[:10000] for word in str(node).lower().split() if not word.isdigit()})
+    forms = {
+        'info': lambda: f"info about {rng.choice(nodes).lower()}",
+        'relations': lambda: f"relations of {rng.choice(nodes).lower()}",
+        'keyword': lambda: f"{rng.choice(words)} {rng.randrange(1000)}",
+        'relation': lambda: f"edges with relation {rng.choice(relations)}",
+        'path': lambda: f"how is {rng.choice(nodes).lower()} related to {rng.choice(nodes).lower()}",
+        'hops': lambda: f"within {rng.randint(1, 2)} hops of {rng.choice(nodes).lower()}",
+    }
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=n_queries)
+    return [(kind, forms[kind]()) for kind in kinds]
+
+
+# Serves the synthetic pages of the suite on the loopback interface, so fetching runs offline
+class SyntheticPageHandler(http.server.BaseHTTPRequestHandler):
+    pages = {}
+
+    def do_GET(self):
+        page = self.pages.get(self.path)
+        body = (page or 'Not found').encode('utf-8')
+        self.send_response(200 if page else 404)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# Function to print a row of the suite table
+def print_stage(row):
+    print(f"{row['stage']:<28}{row['items']:>8} {row['unit']:<11}{row['total_s']:>9.2f}{row['per_s'] or 0:>11.1f}"
+          f"{row['p50_ms'] or 0:>10.2f}{row['p99_ms'] or 0:>10.2f}" +
+          (f"{row['peak_mb']:>10.1f}" if row['peak_mb'] is not None else f"{'-':>10}"))
+
+
+# Function to run one stage of the suite: calls function(item) for every item, timing each call.
+# Returns (row, results); the row has the item count, total seconds, throughput, p50/p99 latency per item (ms)
+# and the peak traced memory (MB) while the stage ran.
+def run_stage(name, function, items, unit, trace_memory):
+    if trace_memory:
+        tracemalloc.reset_peak()
+    latencies, results = [], []
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        results.append(function(item))
+        latencies.append(time.perf_counter() - item_start)
+    total = time.perf_counter() - start
+    row = {'stage': name, 'items': len(latencies), 'unit': unit, 'total_s': total,
+           'per_s': len(latencies) / total if total else None,
+           'p50_ms': metrics.percentile(latencies, 50) * 1000 if latencies else None,
+           'p99_ms': metrics.percentile(latencies, 99) * 1000 if latencies else None,
+           'peak_mb': tracemalloc.get_traced_memory()[1] / 2**20 if trace_memory else None}
+    print_stage(row)
+    return row, results
+
+
+# Function to run the end-to-end suite on synthetic data, fully offline:
+#   fetch_webpage (pages served on the loopback interface) -> parse_html + extract_data, extract_page ->
+#   save_to_csv -> read_data_from_csv -> build_knowledge_graph (skipped if the spaCy model is not installed) ->
+#   save_graph_to_json -> read_graph_from_json -> app.load_graph_from_json -> /query with a query mix.
+# The graph stages run on a synthetic graph of graph_edges edges, so corpus and graph size vary independently.
+# Each stage reports throughput, p50/p99 latency per item and peak traced memory; tracing memory slows the stages
+# down, so pass trace_memory=False for clean timings. The query cache is off unless query_cache is set.
+# Returns the rows and the built-in metrics of the run (see metrics.py), to compare releases.
+def bench_suite(n_paragraphs=2000, graph_edges=100000, n_queries=2000, mix=None, paragraphs_per_page=50,
+                io_repeat=3, trace_memory=True, query_cache=False):
+    mix = mix or {'info': 2, 'relations': 2, 'keyword': 4, 'relation': 1, 'path': 1, 'hops': 1}
+    metrics.registry.reset()
+    if trace_memory:
+        tracemalloc.start()
+    rows = []
+    print(f"Suite: {n_paragraphs} paragraphs, a graph of {graph_edges} edges, {n_queries} queries "
+          f"({', '.join(f'{kind}={weight:g}' for kind, weight in mix.items())})")
+    print(f"{'stage':<28}{'items':>8} {'':<11}{'total s':>9}{'items/s':>11}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}")
+
+    paragraphs = synthetic_corpus(n_paragraphs)
+    SyntheticPageHandler.pages = synthetic_pages(paragraphs, paragraphs_per_page)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SyntheticPageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f"http://127.0.0.1:{server.server_port}{path}" for path in SyntheticPageHandler.pages]
+    session = scraper.create_session()
+    row, pages = run_stage('fetch_webpage', lambda url: scraper.fetch_webpage(url, session=session), urls, 'pages', trace_memory)
+    rows.append(row)
+    server.shutdown()
+    session.close()
+
+    row, _ = run_stage('parse_html + extract_data', lambda page: scraper.extract_data(scraper.parse_html(page)),
+                       pages, 'pages', trace_memory)
+    rows.append(row)
+    row, extracted = run_stage(f'extract_page ({scraper.HTML_BACKEND})', scraper.extract_page, pages, 'pages', trace_memory)
+    rows.append(row)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)       # save_to_csv writes into the working directory
+        try:
+            row, csv_files = run_stage('save_to_csv', lambda item: scraper.save_to_csv(*item),
+                                       list(zip(urls, extracted)), 'pages', trace_memory)
+            rows.append(row)
+            row, page_paragraphs = run_stage('read_data_from_csv', kgc.read_data_from_csv, csv_files, 'files', trace_memory)
+            rows.append(row)
+        finally:
+            os.chdir(cwd)
+
+        corpus = [paragraph for page in page_paragraphs for paragraph in page]
+        import spacy.util
+        model = kgc.PIPELINE_PROFILES[kgc.PIPELINE_PROFILE]['model']
+        if not spacy.util.is_package(model):
+            print(f"{'build_knowledge_graph':<28}skipped, the spaCy model {model} is not installed")
+        else:
+            # One batched build; the latency of each paragraph is the time between two progress callbacks
+            marks = [time.perf_counter()]
+            if trace_memory:
+                tracemalloc.reset_peak()
+            total, _ = timed(kgc.build_knowledge_graph, corpus, batch_size=kgc.DEFAULT_BATCH_SIZE,
+                             progress=lambda processed: marks.append(time.perf_counter()))
+            gaps = [b - a for a, b in zip(marks, marks[1:])]
+            row = {'stage': 'build_knowledge_graph', 'items': len(corpus), 'unit': 'paragraphs', 'total_s': total,
+                   'per_s': len(corpus) / total, 'p50_ms': metrics.percentile(gaps, 50) * 1000 if gaps else None,
+                   'p99_ms': metrics.percentile(gaps, 99) * 1000 if gaps else None,
+                   'peak_mb': tracemalloc.get_traced_memory()[1] / 2**20 if trace_memory else None}
+            print_stage(row)
+            rows.append(row)
+
+        G = synthetic_graph(graph_edges)
+        graph_file = os.path.join(tmp, 'knowledge_graph.json')
+        row, _ = run_stage('save_graph_to_json', lambda _: kgc.save_graph_to_json(G, graph_file), range(io_repeat),
+                           'saves', trace_memory)
+        rows.append(row)
+        del G
+        row, _ = run_stage('read_graph_from_json', lambda _: kgc.read_graph_from_json(graph_file), range(io_repeat),
+                           'loads', trace_memory)
+        rows.append(row)
+
+        # The query server reads its settings when it is imported
+        os.environ.update(KG_GRAPH_FILE=graph_file, KG_WATCH_INTERVAL='0', KG_LOG_LEVEL='WARNING')
+        os.environ['KG_QUERY_CACHE_SIZE'] = os.environ.get('KG_QUERY_CACHE_SIZE', '1024') if query_cache else '0'
+        import app
+        with open(graph_file) as f:
+            graph_data = json.load(f)
+        row, _ = run_stage('app.load_graph_from_json', app.load_graph_from_json, [graph_data] * io_repeat, 'loads', trace_memory)
+        rows.append(row)
+        del graph_data
+        client = app.app.test_client()
+        queries = synthetic_queries(app.current_state.store.graph, n_queries, mix)
+        row, _ = run_stage('/query', lambda query: client.post('/query', json={'query': query[1]}), queries, 'queries', trace_memory)
+        rows.append(row)
+        for kind in mix:
+            kind_queries = [query for query in queries if query[0] == kind]
+            if kind_queries:
+                kind_row, _ = run_stage(f'  /query {kind}', lambda query: client.post('/query', json={'query': query[1]}),
+                                        kind_queries, 'queries', False)
+                rows.append(kind_row)
+
+    if trace_memory:
+        tracemalloc.stop()
+    print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    snapshot = metrics.registry.snapshot()
+    print("Counters: " + ', '.join(f"{name}={value}" for name, value in snapshot['counters'].items()))
+    return {'rows': rows, 'metrics': snapshot}
+
+
+# Function to read the memory of a process from /proc (Linux): (RSS, PSS) in bytes. PSS splits every shared page
+# between the processes sharing it, so the PSS of a server's processes adds up to the memory they really take.
+def process_memory(pid):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in ('Rss', 'Pss'):
+                values[name] = int(rest.split()[0]) * 1024
+    return values['Rss'], values['Pss']
+
+
+# Function to get a process and its child processes (Linux)
+def process_tree(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [pid] + [int(child) for child in f.read().split()]
+
+
+# Function run by a load-test client process: posts queries to the server for duration seconds, one connection
+# per request like a browser without keep-alive; returns the request latencies
+def load_client(port, queries, duration, seed):
+    import http.client
+    rng = random.Random(seed)
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        body = json.dumps({'query': rng.choice(queries)})
+        start = time.perf_counter()
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        connection.request('POST', '/query', body, {'Content-Type': 'application/json'})
+        connection.getresponse().read()
+        connection.close()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+# Function to load-test serve.py: requests/sec, latency and the total RSS / PSS of the server processes against the
+# number of workers, with the graph preloaded and shared by the workers, and loaded by each worker on its own
+def bench_serving(worker_counts=(1, 2, 4), n_edges=200000, duration=10, clients_per_worker=2, store='array'):
+    import multiprocessing
+    G = synthetic_graph(n_edges)
+    queries = [query for _, query in synthetic_queries(G, 1000, {'info': 2, 'relations': 2, 'keyword': 2, 'hops': 1})]
+    with tempfile.TemporaryDirectory() as tmp:
+        graph_file = os.path.join(tmp, 'knowledge_graph.json')
+        kgc.save_graph_to_json(G, graph_file)
+        del G
+        print(f"serve.py with the {store} store on a synthetic graph of {n_edges} edges, {duration}s per run, "
+              f"{clients_per_worker} clients per worker, {os.cpu_count()} CPUs")
+        print(f"{'mode':<10}{'workers':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'RSS MB':>9}{'PSS MB':>9}")
+        for preload in (True, False):
+            for workers in worker_counts:
+                env = dict(os.environ, KG_GRAPH_FILE=graph_file, KG_GRAPH_STORE=store, KG_LOG_LEVEL='WARNING')
+                command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py'),
+                           '--port', '0', '--workers', str(workers), '--watch-interval', '0']
+                server = subprocess.Popen(command + ([] if preload else ['--no-preload']), env=env, cwd=tmp,
+                                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                try:
+                    _, pid, port = server.stdout.readline().split()
+                    with multiprocessing.Pool(workers * clients_per_worker) as pool:
+                        results = pool.starmap(load_client, [(int(port), queries, duration, seed)
+                                                             for seed in range(workers * clients_per_worker)])
+                    latencies = [latency for result in results for latency in result]
+                    memory = [process_memory(process) for process in process_tree(int(pid))]
+                finally:
+                    server.terminate()
+                    server.wait()
+                print(f"{'shared' if preload else 'separate':<10}{workers:>8}{len(latencies) / duration:>9.0f}"
+                      f"{metrics.percentile(latencies, 50) * 1000:>9.2f}{metrics.percentile(latencies, 99) * 1000:>9.2f}"
+                      f"{sum(rss for rss, _ in memory) / 2**20:>9.0f}{sum(pss for _, pss in memory) / 2**20:>9.0f}")
+
+
+# Function to generate unit vectors shaped like word vectors of node names: n_topics directions with every node
+# scattered around one of them, generated in chunks so the only full-size array is the result
+def synthetic_vectors(n_nodes, dimensions=300, n_topics=2000, spread=1.5, seed=0):
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_topics, dimensions), dtype=np.float32)
+    vectors = np.empty((n_nodes, dimensions), dtype=np.float32)
+    for start in range(0, n_nodes, 100000):
+        end = min(start + 100000, n_nodes)
+        vectors[start:end] = topics[rng.integers(0, n_topics, end - start)]
+        vectors[start:end] += spread * rng.standard_normal((end - start, dimensions), dtype=np.float32)
+    return normalize_rows(vectors)
+
+
+# Function to measure similarity search on synthetic node vectors (the spaCy model is not needed): time to build,
+# save and memory-map the index, latency of one query and per query in batches, and recall@k of the inverted file
+# index against the exact search, for several numbers of probed lists
+def bench_node_vectors(n_nodes=1000000, dimensions=300, n_queries=200, k=10, probes=(1, 4, 8, 16, 32), batch=64):
+    vectors = NodeVectors([f"node {i}" for i in range(n_nodes)], synthetic_vectors(n_nodes, dimensions), model='synthetic')
+    rng = np.random.default_rng(1)
+    queries = normalize_rows(np.asarray(vectors.vectors[rng.choice(n_nodes, n_queries, replace=False)])
+                             + 0.5 * rng.standard_normal((n_queries, dimensions), dtype=np.float32) / np.sqrt(dimensions))
+    print(f"Node vectors: {n_nodes} nodes x {dimensions} dimensions ({vectors.vectors.nbytes / 2**20:.0f} MB), "
+          f"{n_queries} queries, top {k}")
+    index_time, _ = timed(vectors.build_index)
+    print(f"Index: {len(vectors.centroids)} lists built in {index_time:.1f} s")
+    with tempfile.TemporaryDirectory() as tmp:
+        vectors_file = os.path.join(tmp, 'graph.kgvec')
+        save_time, _ = timed(vectors.save, vectors_file)
+        del vectors
+        load_time, vectors = timed(NodeVectors.load, vectors_file)
+        print(f"Saved in {save_time:.1f} s ({os.path.getsize(vectors_file) / 2**20:.0f} MB), memory-mapped in {load_time:.2f} s")
+
+        exact = [[name for name, _ in found] for start in range(0, n_queries, batch)
+                 for found in vectors.search(queries[start:start + batch], k, exact=True)]
+        print(f"{'search':<8}{'probes':>7}{'p50 ms':>9}{'p99 ms':>9}{f'batch {batch} ms/q':>16}{'recall':>8}")
+        for probe in (None,) + tuple(probes):
+            exact_search = probe is None
+            single = [timed(vectors.search, query, k, probe or 1, exact_search)[0] for query in queries[:20 if exact_search else None]]
+            batch_time, _ = timed(vectors.search, queries[:batch], k, probe or 1, exact_search)
+            found = [[name for name, _ in matches] for start in range(0, n_queries, batch)
+                     for matches in vectors.search(queries[start:start + batch], k, probe or 1, exact_search)]
+            recall = sum(len(set(a) & set(b)) for a, b in zip(found, exact)) / sum(len(b) for b in exact)
+            print(f"{'exact' if exact_search else 'ivf':<8}{probe or '-':>7}{metrics.percentile(single, 50) * 1000:>9.2f}"
+                  f"{metrics.percentile(single, 99) * 1000:>9.2f}{batch_time / batch * 1000:>16.2f}{recall:>8.3f}")
+
+        names = vectors.names[1000:] + [f"new node {i}" for i in range(1000)]
+        update_time, updated = timed(vectors.updated, names, lambda added: synthetic_vectors(len(added), dimensions, seed=2))
+        save_time, _ = timed(updated.save, vectors_file)
+        print(f"Update replacing 1000 nodes: {update_time:.1f} s, saved in {save_time:.1f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the knowledge graph pipeline")
+    parser.add_argument('--csv', nargs='*', help="CSV files to read paragraphs from (default: the bundled Wikipedia CSVs)")
+    parser.add_argument('--repeat', type=int, default=20, help="How many times to repeat the corpus")
+    parser.add_argument('--workers', type=int, nargs='*', default=[1, 2, 4], help="Worker counts for nlp.pipe")
+    parser.add_argument('--batch-size', type=int, default=kgc.DEFAULT_BATCH_SIZE)
+    parser.add_argument('--profiles', action='store_true', help="Compare the spaCy pipeline profiles instead")
+    parser.add_argument('--search', action='store_true', help="Compare the search index with the edge scan instead")
+    parser.add_argument('--snapshot', action='store_true', help="Compare the JSON file with the binary snapshot instead")
+    parser.add_argument('--store', action='store_true', help="Compare the NetworkX and the array graph store instead")
+    parser.add_argument('--html', nargs='*', help="Compare the HTML extraction backends on these saved pages instead "
+                        "(no files: pages rebuilt from the bundled CSVs)")
+    parser.add_argument('--canonical', nargs='?', const='knowledge_graph.json', help="Compare a graph file (default "
+                        "knowledge_graph.json) with its canonicalized version instead")
+    parser.add_argument('--suite', action='store_true', help="Run the end-to-end suite on synthetic data instead")
+    parser.add_argument('--paragraphs', type=int, default=2000, help="Paragraphs in the synthetic corpus of the suite")
+    parser.add_argument('--graph-edges', type=int, default=100000, help="Edges in the synthetic graph of the suite")
+    parser.add_argument('--queries', type=int, default=2000, help="Queries the suite sends to /query")
+    parser.add_argument('--mix', default='info=2,relations=2,keyword=4,relation=1,path=1,hops=1',
+                        help="Query mix of the suite, as kind=weight pairs")
+    parser.add_argument('--no-memory', action='store_true', help="Do not trace memory in the suite (cleaner timings)")
+    parser.add_argument('--json', help="Save the suite results to this JSON file")
+    parser.add_argument('--serving', type=int, nargs='*', help="Load-test serve.py with these worker counts instead "
+                        "(default 1 2 4); --graph-edges sets the graph size")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds per load-test run")
+    parser.add_argument('--edges', type=int, default=1000000, help="Edges in the synthetic graph")
+    parser.add_argument('--vectors', type=int, nargs='?', const=1000000, help="Measure similarity search on synthetic "
+                        "vectors of this many nodes (default 1000000) instead")
+    parser.add_argument('--dimensions', type=int, default=300, help="Dimensions of the synthetic node vectors")
+    args = parser.parse_args()
+
+    if args.vectors:
+        bench_node_vectors(args.vectors, args.dimensions)
+        raise SystemExit
+
+    if args.serving is not None:
+        bench_serving(args.serving or (1, 2, 4), n_edges=args.graph_edges, duration=args.duration)
+        raise SystemExit
+
+    if args.suite:
+        mix = {kind: float(weight) for kind, weight in (pair.split('=') for pair in args.mix.split(','))}
+        results = bench_suite(args.paragraphs, args.graph_edges, args.queries, mix, trace_memory=not args.no_memory)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+        raise SystemExit
+
+    if args.canonical:
+        bench_canonicalization(kgc.read_graph(args.canonical))
+        raise SystemExit
+
+    if args.html is not None:
+        if args.html:
+            pages = {}
+            for filename in args.html:
+                with open(filename, encoding='utf-8') as f:
+                    pages[filename] = f.read()
+        else:
+            pages = {csv_file: synthetic_html_page(csv_file) for csv_file in BUNDLED_CSVS}
+        bench_html_backends(pages)
+        raise SystemExit
+
+    if args.store:
+        bench_graph_store(args.edges)
+        raise SystemExit
+
+    if args.search:
+        bench_search_index(args.edges)
+        raise SystemExit
+    if args.snapshot:
+        bench_snapshot({'knowledge_graph.json': kgc.read_graph_from_json('knowledge_graph.json'),
+                        f'synthetic {args.edges} edges': synthetic_graph(args.edges)})
+        raise SystemExit
+    paragraphs = load_bundled_paragraphs(args.csv, repeat=args.repeat)
+    if args.profiles:
+        bench_pipeline_profiles(paragraphs)
+    else:
+        try:
+            kgc.require_model(kgc.PIPELINE_PROFILES[kgc.PIPELINE_PROFILE]['model'])
+        except OSError as e:
+            raise SystemExit(f"Graph construction benchmark skipped: {e}")
+        bench_build_throughput(paragraphs, workers=args.workers, batch_size=args.batch_size)
@@ -0,0 +1,158 @@
+import heapq        # To take one page of ranked results without sorting all of them
+
+# Length of the n-grams the index is built on; shorter search terms fall back to scanning the distinct strings
+GRAM_SIZE = 3
+
+
+# Function to split a string into its overlapping n-grams
+def ngrams(text, n=GRAM_SIZE):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+# Search index over the edges of a knowledge graph.
+# Every edge is indexed under the lowercased names of its two nodes and its relation, and every distinct lowercased
+# string under its trigrams. A substring search then only verifies the strings that contain all trigrams of the term,
+# instead of lowercasing and testing three strings per edge. Results come back in the order the edges were indexed.
+# A freshly built index takes the edges by decreasing importance of their nodes (ties in the order of the graph's
+# edges), so a smaller edge id means a higher rank and a page of results is the smallest ids of the match set.
+# Edges added later rank after all of them, until the index is built again.
+# Node names are also kept by their lowercased name, including nodes without edges, to resolve the nodes queries name.
+class GraphSearchIndex:
+    def __init__(self, store=None):
+        self._next_id = 0
+        self._edges = {}        # edge id -> (u, v, relation)
+        self._edge_ids = {}     # frozenset({u, v}) -> edge id
+        self._postings = {}     # lowercased node name or relation -> set of edge ids
+        self._grams = {}        # trigram -> set of lowercased strings containing it
+        self._nodes = {}        # lowercased node name -> {node: None} of the nodes with that name, in index order
+        # In a clone, the keys of _postings and _grams whose sets it copied; the other sets are shared with the original
+        self._copied_postings = self._copied_grams = None
+        if store is not None:
+            self.build(store)
+
+    # Function to (re)build the index from all edges of a graph store (see graph_store.py), most important first,
+    # and all of its nodes: the ends of the edges in that order, then the nodes without edges
+    def build(self, store):
+        self.__init__()
+        for u, v, relation in store.ranked_edges():
+            self.add_edge(u, v, relation)
+            for node in (u, v):
+                self._nodes.setdefault(node.lower(), {})[node] = None
+        for node, _ in store.nodes():
+            self._nodes.setdefault(node.lower(), {})[node] = None
+
+    def __len__(self):
+        return len(self._edges)
+
+    # Function to copy the index for an update of a few edges. The copy shares the posting and trigram sets with this
+    # index and copies one only when it changes it, so cloning takes time proportional to the number of edges and
+    # distinct strings, not to the size of all sets; this index must not change afterwards.
+    def clone(self):
+        copy = GraphSearchIndex()
+        copy._next_id = self._next_id
+        copy._edges, copy._edge_ids = dict(self._edges), dict(self._edge_ids)
+        copy._postings, copy._grams, copy._nodes = dict(self._postings), dict(self._grams), dict(self._nodes)
+        copy._copied_postings, copy._copied_grams = set(), set()
+        return copy
+
+    # Function to get the set of a posting or trigram table to change it, copying it first if it is still shared
+    @staticmethod
+    def _own(table, copied, key):
+        values = table.get(key)
+        if values is None:
+            values = table[key] = set()
+        elif copied is not None and key not in copied:
+            values = table[key] = set(values)
+        if copied is not None:
+            copied.add(key)
+        return values
+
+    def _add_posting(self, text, edge_id):
+        if text not in self._postings:
+            for gram in ngrams(text):
+                self._own(self._grams, self._copied_grams, gram).add(text)
+        self._own(self._postings, self._copied_postings, text).add(edge_id)
+
+    def _remove_posting(self, text, edge_id):
+        postings = self._own(self._postings, self._copied_postings, text)
+        postings.discard(edge_id)
+        if not postings:
+            del self._postings[text]
+            for gram in ngrams(text):
+                strings = self._own(self._grams, self._copied_grams, gram)
+                strings.discard(text)
+                if not strings:
+                    del self._grams[gram]
+
+    # Function to index an edge, replacing the entry of the same node pair if there is one (which keeps its rank)
+    def add_edge(self, u, v, relation):
+        edge_id = self._edge_ids.get(frozenset((u, v)))
+        if edge_id is None:
+            edge_id = self._next_id
+            self._next_id += 1
+        else:
+            self.remove_edge(u, v)
+        self._edges[edge_id] = (u, v, relation)
+        self._edge_ids[frozenset((u, v))] = edge_id
+        for text in {u.lower(), v.lower(), (relation or '').lower()}:
+            self._add_posting(text, edge_id)
+
+    # Function to drop an edge from the index, if it is indexed
+    def remove_edge(self, u, v):
+        edge_id = self._edge_ids.pop(frozenset((u, v)), None)
+        if edge_id is None:
+            return
+        u, v, relation = self._edges.pop(edge_id)
+        for text in {u.lower(), v.lower(), (relation or '').lower()}:
+            self._remove_posting(text, edge_id)
+
+    # Function to bring the entry of a node pair in line with the graph after the graph changed
+    def sync_edge(self, G, u, v):
+        if G.has_edge(u, v):
+            self.add_edge(u, v, G.edges[u, v].get('relation'))
+        else:
+            self.remove_edge(u, v)
+
+    # Function to bring the entry of a node in line with the graph after the graph changed
+    def sync_node(self, G, node):
+        key = node.lower()
+        nodes = dict(self._nodes.get(key, {}))      # Copied, a clone may share it
+        if node in G:
+            nodes.setdefault(node, None)
+        else:
+            nodes.pop(node, None)
+        if nodes:
+            self._nodes[key] = nodes
+        else:
+            self._nodes.pop(key, None)
+
+    # Function to find the node whose lowercased name equals a (lowercased) name, e.g. to resolve a node named in a
+    # query; the first one in index order if several differ only in case, None if the graph has no such node
+    def node_named(self, name):
+        return next(iter(self._nodes.get(name, ())), None)
+
+    # Function to find the distinct indexed strings that contain a (lowercased) term
+    def matching_strings(self, term):
+        if len(term) < GRAM_SIZE:
+            candidates = self._postings     # Too short for trigrams: check every distinct string once
+        else:
+            gram_sets = sorted((self._grams.get(gram, set()) for gram in ngrams(term)), key=len)
+            candidates = set.intersection(*gram_sets) if gram_sets[0] else set()
+        return [text for text in candidates if term in text]
+
+    def _matching_edge_ids(self, term):
+        edge_ids = set()
+        for text in self.matching_strings(term):
+            edge_ids.update(self._postings[text])
+        return edge_ids
+
+    # Function to find the edges whose node names or relation contain a (lowercased) term, as (u, v, relation)
+    def search(self, term):
+        return [self._edges[edge_id] for edge_id in sorted(self._matching_edge_ids(term))]
+
+    # Function to get one page of the search results: up to limit edges from position offset on, in index order.
+    # Returns (edges, total number of matches); only the edges of the page are looked up.
+    def search_page(self, term, limit, offset=0):
+        edge_ids = self._matching_edge_ids(term)
+        page = heapq.nsmallest(offset + limit, edge_ids)[offset:]
+        return [self._edges[edge_id] for edge_id in page], len(edge_ids)
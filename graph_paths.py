@@ -0,0 +1,160 @@
+import collections      # For the LRU cache of hub neighbourhoods
+import threading        # To share the cache between request threads
+import time     # To enforce the time limit of a traversal
+
+
+# Raised when a traversal visits more nodes or takes longer than it may
+class TraversalLimitExceeded(Exception):
+    pass
+
+
+# Visited-node and time budget shared by all searches of one query
+class TraversalBudget:
+    def __init__(self, max_visited, time_limit):
+        self.max_visited = max_visited
+        self.deadline = time.monotonic() + time_limit
+        self.visited = 0
+
+    def visit(self, count=1):
+        self.visited += count
+        if self.visited > self.max_visited:
+            raise TraversalLimitExceeded(f"visited more than {self.max_visited} nodes")
+
+    def check_time(self):
+        if time.monotonic() > self.deadline:
+            raise TraversalLimitExceeded("time limit reached")
+
+
+# Multi-hop queries over a graph store (see graph_store.py): shortest and k-shortest relation paths between two
+# nodes (bidirectional BFS and Yen's algorithm) and k-hop neighbourhoods. Every query runs on a budget of visited
+# nodes and time, so a query through a high-degree node cannot stall the server; the neighbour lists of such hub
+# nodes (degree >= hub_degree) are kept in an LRU cache, as they are the ones queries keep coming back to.
+# The store must not change while a GraphTraversal is in use; app.py creates one per graph version.
+class GraphTraversal:
+    def __init__(self, store, max_visited=20000, time_limit=0.5, hub_degree=50, cache_size=256):
+        self.store = store
+        self.max_visited = max_visited
+        self.time_limit = time_limit
+        self.hub_degree = hub_degree
+        self.cache_size = cache_size
+        self._hubs = collections.OrderedDict()      # hub node -> list of (neighbor, relation)
+        self._lock = threading.Lock()
+        self.hub_hits = 0
+
+    def budget(self):
+        return TraversalBudget(self.max_visited, self.time_limit)
+
+    # Function to get the neighbours of a node as (neighbor, relation), from the hub cache if possible
+    def neighbors(self, node):
+        with self._lock:
+            cached = self._hubs.get(node)
+            if cached is not None:
+                self._hubs.move_to_end(node)
+                self.hub_hits += 1
+                return cached
+        neighbors = self.store.neighbors(node)
+        if len(neighbors) >= self.hub_degree:
+            with self._lock:
+                self._hubs[node] = neighbors
+                while len(self._hubs) > self.cache_size:
+                    self._hubs.popitem(last=False)
+        return neighbors
+
+    # Function to get the relation on the edge between two adjacent nodes
+    def relation(self, u, v):
+        for neighbor, relation in self.neighbors(u):
+            if neighbor == v:
+                return relation
+        return None
+
+    # Function to find a shortest path (list of nodes) between two nodes with a bidirectional breadth-first search,
+    # avoiding the given nodes and edges (frozensets of node pairs); None if there is none
+    def shortest_path(self, source, target, budget=None, excluded_nodes=(), excluded_edges=()):
+        budget = budget or self.budget()
+        if source == target:
+            return [source]
+        # node -> (parent towards the start of that side, depth)
+        sides = [{source: (None, 0)}, {target: (None, 0)}]
+        frontiers = [[source], [target]]
+        budget.visit(2)
+        while frontiers[0] and frontiers[1]:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1        # Expand the smaller frontier
+            seen, other = sides[side], sides[1 - side]
+            next_frontier, meetings = [], []
+            for node in frontiers[side]:
+                budget.check_time()
+                depth = seen[node][1] + 1
+                for neighbor, _ in self.neighbors(node):
+                    if neighbor in seen or neighbor in excluded_nodes or frozenset((node, neighbor)) in excluded_edges:
+                        continue
+                    seen[neighbor] = (node, depth)
+                    budget.visit()
+                    if neighbor in other:
+                        meetings.append(neighbor)
+                    next_frontier.append(neighbor)
+            if meetings:
+                # Finish the whole layer first: the shortest path goes through the meeting closest to the other end
+                meeting = min(meetings, key=lambda node: other[node][1])
+                half = [meeting]
+                while sides[0][half[-1]][0] is not None:
+                    half.append(sides[0][half[-1]][0])
+                path = half[::-1]
+                while sides[1][path[-1]][0] is not None:
+                    path.append(sides[1][path[-1]][0])
+                return path
+            frontiers[side] = next_frontier
+        return None
+
+    # Function to find up to k shortest loopless paths between two nodes (Yen's algorithm), shortest first.
+    # Returns (paths, complete); complete is False if the budget ran out before all k paths were found.
+    def k_shortest_paths(self, source, target, k=3, budget=None):
+        budget = budget or self.budget()
+        try:
+            first = self.shortest_path(source, target, budget)
+        except TraversalLimitExceeded:
+            return [], False
+        if first is None:
+            return [], True
+        paths, candidates = [first], []
+        try:
+            while len(paths) < k:
+                previous = paths[-1]
+                for i in range(len(previous) - 1):
+                    root = previous[:i + 1]
+                    # Leave out the edges the known paths with this root take next, and the root itself
+                    excluded_edges = {frozenset(path[i:i + 2]) for path in paths if path[:i + 1] == root}
+                    spur = self.shortest_path(previous[i], target, budget, excluded_nodes=set(root[:-1]),
+                                              excluded_edges=excluded_edges)
+                    if spur is not None:
+                        candidate = root[:-1] + spur
+                        if candidate not in candidates and candidate not in paths:
+                            candidates.append(candidate)
+                if not candidates:
+                    break
+                candidates.sort(key=len)
+                paths.append(candidates.pop(0))
+        except TraversalLimitExceeded:
+            return paths, False
+        return paths, True
+
+    # Function to collect the nodes within k hops of a node, in breadth-first order, as
+    # {node: (distance, parent, relation)}. Returns (nodes, complete); complete is False if the budget ran out.
+    def neighbourhood(self, node, hops, budget=None):
+        budget = budget or self.budget()
+        found = {node: (0, None, None)}
+        frontier = [node]
+        try:
+            budget.visit()
+            for distance in range(1, hops + 1):
+                next_frontier = []
+                for current in frontier:
+                    budget.check_time()
+                    for neighbor, relation in self.neighbors(current):
+                        if neighbor not in found:
+                            budget.visit()
+                            found[neighbor] = (distance, current, relation)
+                            next_frontier.append(neighbor)
+                frontier = next_frontier
+        except TraversalLimitExceeded:
+            return found, False
+        return found, True
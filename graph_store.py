@@ -0,0 +1,128 @@
+import KnowledgeGraphConstruction as kgc
+
+# Read access to the served graph, as used by app.query_graph. Two interchangeable backends implement it:
+#   NetworkXGraphStore - the NetworkX graph, updated in place by journaled updates
+#   ArrayGraphStore    - immutable integer-id nodes with NumPy CSR adjacency and categorical label/relation codes
+# Both offer has_node, node_label, node_importance (the precomputed score, 0 if the graph has none), neighbors (with
+# the relation), nodes, edges (in the order of the graph file), ranked_edges (most important nodes first),
+# number_of_nodes/number_of_edges, the graph attributes (e.g. the update 'seq') and node_link_data for /api/data.
+
+
+# Function to build the /api/data payload of a graph, the same for both stores: the layout of
+# networkx.readwrite.json_graph.node_link_data with only the labels and relations, not the internal node and edge
+# attributes (importance scores, provenance). Nodes without a label get missing_label, like the JSON file does.
+def node_link_payload(attributes, nodes, edges, missing_label='No label'):
+    return {
+        'directed': False,
+        'multigraph': False,
+        'graph': dict(attributes),
+        'nodes': [{'label': label if label is not None else missing_label, 'id': node} for node, label in nodes],
+        'edges': [{'relation': relation, 'source': u, 'target': v} if relation is not None else {'source': u, 'target': v}
+                  for u, v, relation in edges],
+    }
+
+
+class NetworkXGraphStore:
+    def __init__(self, graph):
+        self.graph = graph
+
+    def has_node(self, node):
+        return self.graph.has_node(node)
+
+    def node_label(self, node):
+        return self.graph.nodes[node].get('label')
+
+    def node_importance(self, node):
+        return self.graph.nodes[node].get('importance', 0.0)
+
+    def neighbors(self, node):
+        return [(neighbor, data.get('relation')) for neighbor, data in self.graph[node].items()]
+
+    def nodes(self):
+        return ((node, data.get('label')) for node, data in self.graph.nodes(data=True))
+
+    def edges(self):
+        return ((u, v, data.get('relation')) for u, v, data in self.graph.edges(data=True))
+
+    # Edges in decreasing order of the summed importance of their nodes, ties in the order of the graph file
+    def ranked_edges(self):
+        importance = self.graph.nodes
+        return sorted(self.edges(), key=lambda edge: -(importance[edge[0]].get('importance', 0.0)
+                                                       + importance[edge[1]].get('importance', 0.0)))
+
+    def number_of_nodes(self):
+        return self.graph.number_of_nodes()
+
+    def number_of_edges(self):
+        return self.graph.number_of_edges()
+
+    def attributes(self):
+        return self.graph.graph
+
+    def node_link_data(self):
+        return node_link_payload(self.graph.graph, self.nodes(), self.edges())
+
+
+class ArrayGraphStore:
+    # Nodes without a label report this one, like the JSON file does
+    def __init__(self, snapshot, missing_label='No label'):
+        self.snapshot = snapshot
+        self.missing_label = missing_label
+
+    # Open a binary snapshot file; it is memory-mapped, so only the pages queries touch are loaded
+    @classmethod
+    def open(cls, filename, missing_label='No label'):
+        return cls(kgc.GraphSnapshot(filename), missing_label)
+
+    # Build the arrays from a NetworkX graph, e.g. one loaded from JSON
+    @classmethod
+    def from_networkx(cls, graph, missing_label='No label'):
+        return cls(kgc.GraphSnapshot(kgc.graph_snapshot_bytes(graph)), missing_label)
+
+    def has_node(self, node):
+        return self.snapshot.has_node(node)
+
+    def node_label(self, node):
+        label = self.snapshot.node_label(node)
+        return label if label is not None else self.missing_label
+
+    def node_importance(self, node):
+        return self.snapshot.node_importance(node)
+
+    def neighbors(self, node):
+        return self.snapshot.neighbors(node)
+
+    def nodes(self):
+        return ((node, label if label is not None else self.missing_label) for node, label in self.snapshot.nodes())
+
+    def edges(self):
+        return self.snapshot.edges()
+
+    def ranked_edges(self):
+        return self.snapshot.ranked_edges()
+
+    def number_of_nodes(self):
+        return self.snapshot.number_of_nodes()
+
+    def number_of_edges(self):
+        return self.snapshot.number_of_edges()
+
+    def attributes(self):
+        return self.snapshot.graph
+
+    def node_link_data(self):
+        return node_link_payload(self.snapshot.graph, self.nodes(), self.edges(), self.missing_label)
+
+    def close(self):
+        self.snapshot.close()
+
+
+# Function to open the graph file with the requested backend ('networkx' or 'array')
+def open_graph_store(filename, backend='networkx', load_networkx=None):
+    if backend == 'array':
+        if filename.endswith(kgc.SNAPSHOT_SUFFIX):
+            return ArrayGraphStore.open(filename)
+        return ArrayGraphStore.from_networkx((load_networkx or kgc.read_graph)(filename))
+    if backend == 'networkx':
+        return NetworkXGraphStore((load_networkx or kgc.read_graph)(filename))
+    raise ValueError(f"Unknown graph store '{backend}', expected 'networkx' or 'array'")
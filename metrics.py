@@ -0,0 +1,134 @@
+import contextlib       # For the timer context manager
+import functools        # To keep the names of timed functions
+import math     # For the nearest-rank percentiles
+import os       # To switch the instrumentation off from the environment
+import threading        # Stages are timed from request and worker threads
+import time     # To measure elapsed time
+
+# Per-stage timings and counters of the pipeline (fetch, parse, extract, build, save, load, query), served at
+# /metrics by app.py and My_Knowledge_Graph/backend.py and reported by benchmark.py --suite.
+# Each stage keeps its call count, total and maximum time, and the latest SAMPLE_WINDOW durations for percentiles.
+# KG_METRICS=0 switches the instrumentation off; timers then cost a single check.
+ENABLED = os.environ.get('KG_METRICS', '1') != '0'
+SAMPLE_WINDOW = 1024
+
+
+# Function to get the q-th percentile (0-100) of a list of numbers, nearest-rank; None for an empty list
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+# Timings of one stage
+class StageStats:
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.window = window
+        self.samples = []       # Ring buffer of the latest durations
+        self._next = 0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < self.window:
+            self.samples.append(seconds)
+        else:
+            self.samples[self._next] = seconds
+            self._next = (self._next + 1) % self.window
+
+    def summary(self):
+        return {'count': self.count, 'total_s': round(self.total, 6),
+                'mean_ms': round(self.total / self.count * 1000, 3) if self.count else None,
+                'p50_ms': round(percentile(self.samples, 50) * 1000, 3) if self.samples else None,
+                'p99_ms': round(percentile(self.samples, 99) * 1000, 3) if self.samples else None,
+                'max_ms': round(self.max * 1000, 3)}
+
+
+# Registry of stage timings and counters, safe to update from several threads
+class Metrics:
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.window = window
+        self.stages = {}
+        self.counters = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats(self.window)
+            stats.observe(seconds)
+
+    def increment(self, counter, amount=1):
+        if ENABLED:
+            with self._lock:
+                self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    # Time the body of a with statement as one call of a stage
+    @contextlib.contextmanager
+    def timer(self, stage):
+        if not ENABLED:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    # Decorator timing every call of a function as a stage (the function name by default)
+    def timed(self, stage=None):
+        def decorate(function):
+            name = stage or function.__name__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not ENABLED:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorate
+
+    def snapshot(self):
+        with self._lock:
+            return {'uptime_s': round(time.time() - self.started, 3),
+                    'stages': {stage: stats.summary() for stage, stats in sorted(self.stages.items())},
+                    'counters': dict(sorted(self.counters.items()))}
+
+    # The snapshot in the Prometheus text format, for scrapers that expect it
+    def prometheus(self):
+        snapshot = self.snapshot()
+        lines = ['# TYPE kg_stage_seconds summary']
+        for stage, stats in snapshot['stages'].items():
+            for quantile, key in (('0.5', 'p50_ms'), ('0.99', 'p99_ms')):
+                if stats[key] is not None:
+                    lines.append(f'kg_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {stats[key] / 1000:.6g}')
+            lines.append(f'kg_stage_seconds_sum{{stage="{stage}"}} {stats["total_s"]}')
+            lines.append(f'kg_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines.append('# TYPE kg_events_total counter')
+        for counter, value in snapshot['counters'].items():
+            lines.append(f'kg_events_total{{event="{counter}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+            self.started = time.time()
+
+
+# The registry the modules of the project report to
+registry = Metrics()
+timer = registry.timer
+timed = registry.timed
+increment = registry.increment
@@ -0,0 +1,205 @@
+import json     # For the header of the vector file
+import math     # To size the inverted file index
+
+import numpy as np
+
+# Node vectors for similarity search: one unit-length float32 row per node, compared by dot product (cosine).
+# Up to IVF_MIN_NODES nodes the search is exact, a matrix product over all rows in chunks of SEARCH_CHUNK_ROWS.
+# Larger sets get an inverted file index: the rows are clustered with spherical k-means into about sqrt(n) lists,
+# stored grouped by list, and a query only scores the rows of the `probes` lists whose centroids are closest to it.
+# The file (*.kgvec) is a header and one aligned matrix, memory-mapped when loaded, so the pages are shared between
+# the processes serving the same graph.
+# Layout: VECTORS_MAGIC, the length of a JSON header (8 bytes, little-endian), the header (node names in row order,
+# model, seq, centroids and list offsets), then the float32 matrix at a 64-byte aligned offset.
+VECTORS_MAGIC = b'KGVEC1\n\x00'
+VECTORS_SUFFIX = '.kgvec'
+IVF_MIN_NODES = 100000
+DEFAULT_PROBES = 8
+SEARCH_CHUNK_ROWS = 65536
+KMEANS_ITERATIONS = 8
+KMEANS_SAMPLE = 65536
+
+
+# Function to scale the rows of a matrix to unit length in place; all-zero rows (nodes without a vector) stay zero
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+# Function to get the indices of the k largest scores, largest first
+def top_k(scores, k):
+    if k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind='stable')]
+
+
+# Function to assign each row to the centroid with the largest dot product, in chunks of rows
+def assign_lists(vectors, centroids, chunk_rows=SEARCH_CHUNK_ROWS):
+    lists = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_rows):
+        lists[start:start + chunk_rows] = np.argmax(vectors[start:start + chunk_rows] @ centroids.T, axis=1)
+    return lists
+
+
+# Function to cluster unit rows with spherical k-means, trained on a sample of at most sample_size rows
+def train_centroids(vectors, n_lists, iterations=KMEANS_ITERATIONS, sample_size=KMEANS_SAMPLE, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(vectors), min(len(vectors), max(sample_size, n_lists)), replace=False))
+    sample = np.asarray(vectors[rows], dtype=np.float32)
+    sample = sample[np.any(sample != 0, axis=1)]        # Rows without a vector carry no direction
+    if not len(sample):
+        raise ValueError("No node has a vector to train the index on")
+    n_lists = min(n_lists, len(sample))
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        lists = assign_lists(sample, centroids)
+        order = np.argsort(lists, kind='stable')
+        members, starts = np.unique(lists[order], return_index=True)
+        centroids[members] = np.add.reduceat(sample[order], starts, axis=0)      # Empty lists keep their centroid
+        normalize_rows(centroids)
+    return centroids
+
+
+# Node vectors of one graph, with their optional inverted file index.
+# names[i] is the node of row i. With an index, the rows of list j are rows offsets[j] to offsets[j + 1].
+class NodeVectors:
+    def __init__(self, names, vectors, centroids=None, offsets=None, model=None, seq=0, trained_size=0):
+        self.names = list(names)
+        self.vectors = vectors
+        self.centroids = centroids
+        self.offsets = offsets
+        self.model = model      # Model the vectors come from; vectors of another model are not comparable
+        self.seq = seq      # Graph update the vectors belong to
+        self.trained_size = trained_size        # Number of rows when the centroids were trained
+        self.rows = {name: row for row, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def dimensions(self):
+        return self.vectors.shape[1]
+
+    # Function to get the vector of a node, None if it has none (not in the set, or a name without a known word)
+    def vector(self, name):
+        row = self.rows.get(name)
+        if row is None or not np.any(self.vectors[row]):
+            return None
+        return np.asarray(self.vectors[row])
+
+    # Function to cluster the rows into about sqrt(n) lists and store them grouped by list
+    def build_index(self, n_lists=None):
+        n_lists = n_lists or max(int(math.sqrt(len(self))), 1)
+        self.centroids = train_centroids(self.vectors, n_lists)
+        self.trained_size = len(self)
+        self._group(assign_lists(self.vectors, self.centroids))
+
+    def _group(self, lists):
+        order = np.argsort(lists, kind='stable')
+        self.vectors = np.ascontiguousarray(self.vectors[order])
+        self.names = [self.names[row] for row in order]
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.offsets = np.searchsorted(lists[order], np.arange(len(self.centroids) + 1)).astype(np.int64)
+
+    # Function to get the vectors of another version of the graph: rows of nodes still in it are kept (with their
+    # list), embed(names) -> matrix computes the rows of the new nodes only. The index is retrained once the set
+    # has grown fourfold since its lists were trained.
+    def updated(self, names, embed, seq=0):
+        names = list(names)
+        kept = sorted(self.rows[name] for name in names if name in self.rows)
+        added = [name for name in names if name not in self.rows]
+        vectors = np.empty((len(kept) + len(added), self.dimensions), dtype=np.float32)
+        if kept:
+            vectors[:len(kept)] = self.vectors[kept]
+        if added:
+            vectors[len(kept):] = normalize_rows(np.asarray(embed(added), dtype=np.float32))
+        result = NodeVectors([self.names[row] for row in kept] + added, vectors, model=self.model, seq=seq)
+        if self.centroids is not None and len(result) < 4 * self.trained_size:
+            lists = np.empty(len(result), dtype=np.int32)
+            if kept:
+                old_lists = np.searchsorted(self.offsets, np.arange(len(self)), side='right') - 1
+                lists[:len(kept)] = old_lists[kept]
+            lists[len(kept):] = assign_lists(vectors[len(kept):], self.centroids)
+            result.centroids, result.trained_size = self.centroids, self.trained_size
+            result._group(lists)
+        elif len(result) >= IVF_MIN_NODES:
+            result.build_index()
+        return result
+
+    # Function to find the k nodes most similar to each query vector; returns one list of (name, score) per row of
+    # queries, best first. Only nodes with a positive score are returned and names in exclude are left out.
+    # exact=True scores every row even when there is an index.
+    def search(self, queries, k=10, probes=DEFAULT_PROBES, exact=False, exclude=()):
+        queries = normalize_rows(np.atleast_2d(np.array(queries, dtype=np.float32)))
+        wanted = k + len(exclude)
+        candidates = [[] for _ in range(len(queries))]      # per query: (rows, scores) arrays
+        if self.centroids is None or exact:
+            chunks = [(start, min(start + SEARCH_CHUNK_ROWS, len(self)), range(len(queries)))
+                      for start in range(0, len(self), SEARCH_CHUNK_ROWS)]
+        else:
+            # The lists each query probes, then the queries of each list, so every list is scored once for all of them
+            coarse = queries @ self.centroids.T
+            probes = min(probes, len(self.centroids))
+            probed = np.argpartition(-coarse, probes - 1, axis=1)[:, :probes]
+            by_list = {}
+            for query, lists in enumerate(probed):
+                for index in lists:
+                    by_list.setdefault(int(index), []).append(query)
+            chunks = [(self.offsets[index], self.offsets[index + 1], members) for index, members in sorted(by_list.items())]
+        for start, end, members in chunks:
+            if start == end:
+                continue
+            scores = queries[list(members)] @ np.asarray(self.vectors[start:end]).T
+            for scored, query in zip(scores, members):
+                best = top_k(scored, wanted)
+                candidates[query].append((best + start, scored[best]))
+        results = []
+        for found in candidates:
+            if not found:
+                results.append([])
+                continue
+            rows, scores = np.concatenate([rows for rows, _ in found]), np.concatenate([scores for _, scores in found])
+            matches = []
+            for position in top_k(scores, wanted):
+                if scores[position] <= 0:
+                    break
+                name = self.names[rows[position]]
+                if name not in exclude:
+                    matches.append((name, float(scores[position])))
+            results.append(matches[:k])
+        return results
+
+    # Function to save the vectors to a *.kgvec file, replacing it atomically like the graph files
+    def save(self, filename):
+        from KnowledgeGraphConstruction import atomic_write     # Not at the top: that module imports this one
+        header = json.dumps({'names': self.names, 'rows': len(self), 'dimensions': self.dimensions,
+                             'model': self.model, 'seq': self.seq, 'trained_size': self.trained_size,
+                             'centroids': self.centroids.tolist() if self.centroids is not None else None,
+                             'offsets': self.offsets.tolist() if self.offsets is not None else None}).encode('utf-8')
+        data_start = -(-(len(VECTORS_MAGIC) + 8 + len(header)) // 64) * 64
+        with atomic_write(filename, 'wb') as f:     # Never overwrite a file that servers may have memory-mapped
+            f.write(VECTORS_MAGIC + len(header).to_bytes(8, 'little') + header)
+            f.write(b'\x00' * (data_start - f.tell()))
+            np.ascontiguousarray(self.vectors, dtype=np.float32).tofile(f)
+
+    # Function to load a *.kgvec file; with mmap the matrix stays in the file and is paged in on use
+    @classmethod
+    def load(cls, filename, mmap=True):
+        with open(filename, 'rb') as f:
+            if f.read(len(VECTORS_MAGIC)) != VECTORS_MAGIC:
+                raise ValueError(f"{filename} is not a node vector file")
+            header_len = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_len))
+        data_start = -(-(len(VECTORS_MAGIC) + 8 + header_len) // 64) * 64
+        shape = (header['rows'], header['dimensions'])
+        if not header['rows']:
+            vectors = np.zeros(shape, dtype=np.float32)
+        elif mmap:
+            vectors = np.memmap(filename, dtype=np.float32, mode='r', offset=data_start, shape=shape)
+        else:
+            vectors = np.fromfile(filename, dtype=np.float32, offset=data_start).reshape(shape)
+        centroids = np.array(header['centroids'], dtype=np.float32) if header['centroids'] is not None else None
+        offsets = np.array(header['offsets'], dtype=np.int64) if header['offsets'] is not None else None
+        return cls(header['names'], vectors, centroids, offsets, header['model'], header['seq'], header['trained_size'])
@@ -0,0 +1,178 @@
+import collections      # To keep the source of each paragraph while spaCy consumes the paragraph stream
+import importlib        # To import WebScraping_Small-2.py, whose name is not a valid module name
+import itertools        # To cut the paragraph stream into batches for the parse cache
+import logging      # To log failed pages
+import os       # To check for an existing graph file
+import queue        # Bounded queues between the pipeline stages
+import threading        # To run the fetch and parse stages next to spaCy
+
+import networkx as nx
+import KnowledgeGraphConstruction as kgc
+
+scraper = importlib.import_module('WebScraping_Small-2')
+
+# Marks the end of the stream in a queue
+DONE = object()
+
+# Streaming scrape-to-graph pipeline:
+#   fetch (thread pool, shared session, per-host limits, optional HTTP cache)
+#     -> parse (single-pass extractor, see WebScraping_Small-2.extract_page; optional CSV side sink)
+#     -> paragraph generator -> batched spaCy extraction -> per-page canonicalization -> graph merge
+# The stages are connected by bounded queues, so fetching overlaps with parsing and extraction, and memory
+# stays flat however many pages are processed: a slow stage makes the stages before it wait.
+# Each page is merged as the source csv_filename(url), the same name ingesting its CSV file would use,
+# replacing what that source contributed to the graph before.
+
+
+# Fetch stage: fetch every URL and queue (url, content, changed); ends with one DONE per parse worker
+def fetch_stage(urls, pages, workers, parse_workers, session, limiter, http_cache, report):
+    urls = iter(dict.fromkeys(urls))
+    urls_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with urls_lock:
+                url = next(urls, None)
+            if url is None:
+                return
+            try:
+                if http_cache is not None:
+                    content, changed = scraper.fetch_webpage_if_changed(url, http_cache, session=session, limiter=limiter)
+                else:
+                    content = scraper.fetch_webpage(url, session=session, limiter=limiter)
+                    changed = content is not None
+            except Exception as e:
+                logging.error(f"Failed to fetch {url}: {e}")
+                content, changed = None, False
+            if not content:
+                report['failed'].append(url)
+                continue
+            pages.put((url, content, changed))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for _ in range(parse_workers):
+        pages.put(DONE)
+
+
+# Parse stage: extract the paragraphs of each page and queue (source, paragraphs); optionally writes the CSV too.
+# An unchanged page is only skipped if its source is in ingested, i.e. the graph already holds what it contributed.
+def parse_stage(pages, documents, csv_sink, skip_unchanged, ingested, report):
+    while True:
+        item = pages.get()
+        if item is DONE:
+            documents.put(DONE)
+            return
+        url, content, changed = item
+        if not changed and skip_unchanged and scraper.csv_filename(url) in ingested:
+            report['unchanged'].append(url)
+            continue
+        try:
+            data = scraper.extract_page(content)
+        except Exception as e:
+            logging.error(f"Failed to parse {url}: {e}")
+            report['failed'].append(url)
+            continue
+        paragraphs = [paragraph for paragraph in data['paragraphs'] if paragraph]     # read_data_from_csv drops empty ones too
+        if csv_sink:
+            scraper.save_to_csv(url, dict(data))
+        report['changed'].append(url)
+        documents.put((scraper.csv_filename(url), paragraphs))
+
+
+# Function to run the pipeline over the given URLs and merge the pages into a graph.
+# Returns (graph, report), where report lists the URLs that were 'changed' (merged), 'unchanged' (skipped) and 'failed'.
+# Every triple is also recorded in relations, if a kgc.RelationStore is given.
+# Unchanged pages (per the HTTP cache) are skipped unless skip_unchanged is False, or the graph has nothing from them
+# (e.g. a new graph file, or a page whose earlier run failed after fetching it).
+def stream_to_graph(urls, graph=None, csv_sink=False, fetch_workers=4, parse_workers=2, queue_size=16,
+                    batch_size=None, n_process=1, parse_cache=None, http_cache=None, skip_unchanged=True,
+                    per_host_concurrency=2, per_host_rate=1.0, relations=None):
+    G = nx.Graph() if graph is None else graph
+    report = {'changed': [], 'unchanged': [], 'failed': [], 'paragraphs': 0}
+    pages, documents = queue.Queue(maxsize=queue_size), queue.Queue(maxsize=queue_size)
+    session = scraper.create_session(pool_size=fetch_workers)
+    limiter = scraper.HostLimiter(max_concurrent=per_host_concurrency, rate=per_host_rate)
+    ingested = kgc.graph_sources(G)     # Taken before the merge starts; the parse workers must not read G while it changes
+
+    threads = [threading.Thread(target=fetch_stage, daemon=True,
+                                args=(urls, pages, fetch_workers, parse_workers, session, limiter, http_cache, report))]
+    threads += [threading.Thread(target=parse_stage, args=(pages, documents, csv_sink, skip_unchanged, ingested, report), daemon=True)
+                for _ in range(parse_workers)]
+    for thread in threads:
+        thread.start()
+
+    # The source of every paragraph handed to spaCy, in order; extraction results come back in the same order
+    sources = collections.deque()
+
+    def paragraph_stream():
+        finished = 0
+        while finished < parse_workers:
+            item = documents.get()
+            if item is DONE:
+                finished += 1
+                continue
+            source, paragraphs = item
+            kgc.remove_source(G, source)        # Replace what an earlier run of this page contributed
+            if relations is not None:
+                relations.remove_source(source)
+            for paragraph in paragraphs:
+                sources.append(source)
+                yield paragraph
+
+    if parse_cache is None:
+        results = kgc.extract_paragraphs(paragraph_stream(), batch_size=batch_size, n_process=n_process)
+    else:
+        # The parse cache looks paragraphs up in bulk, so hand it one batch at a time to keep the stream flowing
+        stream = paragraph_stream()
+        batches = iter(lambda: list(itertools.islice(stream, batch_size or kgc.DEFAULT_BATCH_SIZE)), [])
+        results = (result for batch in batches
+                   for result in kgc.extract_paragraphs(batch, batch_size=batch_size, n_process=n_process, cache=parse_cache))
+
+    # Each page is canonicalized as one batch (see kgc.canonicalize_extractions) before it is merged
+    def merge(source, extractions):
+        if kgc.CANONICALIZE:
+            extractions = kgc.canonicalize_extractions(extractions, graph=G)
+        for index, (entities, triples, _) in enumerate(extractions):
+            kgc.add_extraction_to_graph(G, entities, triples, source=source)
+            if relations is not None:
+                relations.add_extraction(entities, triples, kgc.paragraph_id(source, index))
+        report['paragraphs'] += len(extractions)
+
+    page_source, page = None, []
+    for extraction in results:
+        source = sources.popleft()
+        if source != page_source and page:
+            merge(page_source, page)
+            page = []
+        page_source = source
+        page.append(extraction)
+    if page:
+        merge(page_source, page)
+
+    for thread in threads:
+        thread.join()
+    session.close()
+    return G, report
+
+
+# Main execution block
+if __name__ == "__main__":
+    urls = input("Enter the URL(s) to scrape, separated by spaces: ").split()
+    graph_file = input("Enter the graph file to update (default knowledge_graph.json): ") or 'knowledge_graph.json'
+    csv_sink = (input("Also write the CSV files? [y/N]: ") or 'n').lower().startswith('y')
+    G = kgc.read_graph(graph_file) if os.path.exists(graph_file) else None
+    relations = kgc.load_relations(graph_file)
+    http_cache, parse_cache = scraper.HTTPCache(), kgc.ParseCache()
+    G, report = stream_to_graph(urls, graph=G, csv_sink=csv_sink, batch_size=kgc.DEFAULT_BATCH_SIZE,
+                                parse_cache=parse_cache, http_cache=http_cache, relations=relations)
+    if report['changed']:
+        kgc.publish_graph(G, filename=graph_file, relations=relations)
+    print(f"Merged {len(report['changed'])} changed pages ({report['paragraphs']} paragraphs), "
+          f"skipped {len(report['unchanged'])} unchanged, {len(report['failed'])} failed")
+    print(f"Knowledge Graph saved to '{graph_file}'." if report['changed'] else "The graph is unchanged.")
+    http_cache.close()
+    parse_cache.close()
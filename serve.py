@@ -0,0 +1,177 @@
+import argparse     # To parse the command line arguments
+import gc       # To keep the garbage collector from touching the shared objects
+import logging      # To log worker starts and graph reloads
+import os       # To fork the workers
+import signal       # To stop the workers
+import socket       # The listening socket shared by the workers
+import sys      # To exit the workers
+import time     # To pace the supervisor loop
+
+# Production serving mode for app.py: pre-forked worker processes sharing one read-only graph.
+# The parent loads the graph once, by default into the array store (NumPy arrays and one blob of node names; a .kgsnap
+# graph file and the node vectors are memory-mapped instead of read), builds the search index, moves everything out
+# of the garbage collector's reach (gc.freeze) and then forks the workers, which accept connections on one shared
+# socket. The graph pages stay shared between the processes: the arrays are never written, the pages of memory-mapped
+# files come from the page cache, and frozen objects are not rewritten by collections, so adding a worker adds little
+# memory.
+# When the graph file or its update journal changes, the parent loads the new version and replaces the workers with
+# ones forked from it, so the new version is shared as well. Each worker serves one request at a time, like the sync
+# workers of gunicorn; concurrency comes from the number of workers.
+# With preload=False every worker loads its own graph after the fork, as independent server processes would.
+
+logger = logging.getLogger('kg.serve')
+
+
+# Function run by a worker: serve requests from the shared socket until SIGTERM, then exit.
+# ready is the write end of a pipe; the worker writes one byte to it once it accepts connections.
+def run_worker(listener, ready, preload):
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)       # Ctrl-C reaches the whole group; the parent stops the workers
+    if not preload:
+        os.environ.pop('KG_WATCH_INTERVAL', None)       # Without the parent's graph, each worker watches for changes
+    import app      # Loads the graph now unless the parent already did
+    from werkzeug.serving import make_server
+    server = make_server('', 0, app.app, fd=listener.fileno())
+    server.timeout = 0.5        # Check for SIGTERM twice a second
+    os.write(ready, b'.')
+    os.close(ready)
+    while not stopping:
+        server.handle_request()
+    os._exit(0)
+
+
+# Pre-forking server: supervises the workers, restarts the ones that die and replaces them all on a new graph version
+class PreforkServer:
+    def __init__(self, host='127.0.0.1', port=5000, workers=2, watch_interval=1.0, preload=True, backlog=1024):
+        self.workers = workers
+        self.watch_interval = watch_interval
+        self.preload = preload
+        self.listener = socket.create_server((host, port), backlog=backlog)
+        # Non-blocking, so a worker that loses the race for a connection goes back to waiting instead of blocking
+        self.listener.setblocking(False)
+        self.children = {}      # pid -> generation
+        self.generation = 0
+        self.stopping = False
+        self.app = None
+
+    def load(self):
+        gc.unfreeze()       # Let the previous version be collected
+        gc.collect()
+        if self.app is None:
+            import app
+            self.app = app
+        else:
+            self.app.refresh_graph()
+        vectors = self.app.current_state.vectors
+        if vectors is not None and len(vectors):
+            # Similarity queries for text that names no node embed it with the model's word vectors: loaded here once
+            # and shared by the workers, instead of a copy loaded by each worker on its first such query
+            try:
+                self.app.kgc.get_vectors_nlp()
+            except OSError as e:
+                logger.warning("Word vectors not loaded: %s", e)
+        gc.freeze()
+
+    def graph_changed(self):
+        state = self.app.current_state
+        return (self.app.file_signature(self.app.GRAPH_FILE) != state.file_signature
+                or self.app.journal_position() != state.updates_position)
+
+    # Fork one worker of the current generation; returns once it accepts connections
+    def spawn(self):
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            try:
+                run_worker(self.listener, write_end, self.preload)
+            except BaseException:
+                logger.exception("Worker failed")
+            os._exit(1)
+        os.close(write_end)
+        os.read(read_end, 1)        # Empty if the worker died while starting
+        os.close(read_end)
+        self.children[pid] = self.generation
+        return pid
+
+    def stop_workers(self, generation=None):
+        for pid, child_generation in list(self.children.items()):
+            if generation is None or child_generation == generation:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation = self.children.pop(pid, None)
+            if generation == self.generation and not self.stopping:
+                logger.warning("Worker %s exited with status %s, starting a new one", pid, status)
+                self.spawn()
+
+    def request_stop(self, signum, frame):
+        self.stopping = True
+
+    def serve_forever(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        if self.preload:
+            self.load()
+        for _ in range(self.workers):
+            self.spawn()
+        host, port = self.listener.getsockname()[:2]
+        logger.warning("Serving on http://%s:%s with %s workers", host, port, self.workers)
+        print(f"ready {os.getpid()} {port}", flush=True)      # For scripts waiting for the server (benchmark.py --serving)
+        last_check = time.monotonic()
+        while not self.stopping:
+            time.sleep(0.2)
+            self.reap()
+            if self.preload and self.watch_interval > 0 and time.monotonic() - last_check >= self.watch_interval:
+                last_check = time.monotonic()
+                if self.graph_changed():
+                    self.load()
+                    # Rolling replacement: the new workers run next to the old ones until those are told to stop
+                    old_generation, self.generation = self.generation, self.generation + 1
+                    for _ in range(self.workers):
+                        self.spawn()
+                    self.stop_workers(old_generation)
+                    logger.warning("Graph update %s: workers replaced",
+                                   self.app.current_state.store.attributes().get('seq', 0))
+        self.stop_workers()
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            self.children.pop(pid, None)
+        self.listener.close()
+
+
+# Main execution block
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve app.py with pre-forked workers sharing one read-only graph")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--watch-interval', type=float, default=float(os.environ.get('KG_WATCH_INTERVAL', 1.0)),
+                        help="Seconds between checks for a new graph version (0: never)")
+    parser.add_argument('--no-preload', action='store_true', help="Let every worker load its own graph")
+    parser.add_argument('--access-log', action='store_true', help="Log every request")
+    args = parser.parse_args()
+
+    if not args.access_log:
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    # The array store is read-only and flat, which is what keeps the pages shared; KG_GRAPH_STORE overrides it
+    os.environ.setdefault('KG_GRAPH_STORE', 'array')
+    os.environ['KG_WATCH_INTERVAL'] = '0'       # The parent watches the graph, not a thread in each process
+    server = PreforkServer(args.host, args.port, args.workers, args.watch_interval, preload=not args.no_preload)
+    server.serve_forever()
+    sys.exit(0)
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+import spacy
+
+# The modules of the project live at the top of the repository, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import KnowledgeGraphConstruction as kgc     # noqa: E402
+
+
+# Stand-in for the spaCy model that counts how often text goes through the pipeline: one __call__ per paragraph
+# in the serial path, one item per paragraph through pipe in the batched path
+class CountingNLP:
+    def __init__(self):
+        self.nlp = spacy.blank('en')
+        ruler = self.nlp.add_pipe('entity_ruler')
+        ruler.add_patterns([{'label': 'ORG', 'pattern': [{'IS_TITLE': True}]},
+                            {'label': 'DATE', 'pattern': [{'SHAPE': 'dddd'}]}])
+        self.meta = self.nlp.meta
+        self.calls = 0
+        self.piped = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return self.nlp(text)
+
+    def pipe(self, texts, batch_size=None, n_process=1):
+        for doc in self.nlp.pipe(texts, batch_size=batch_size or kgc.DEFAULT_BATCH_SIZE):
+            self.piped += 1
+            yield doc
+
+
+@pytest.fixture
+def counting_nlp(monkeypatch):
+    nlp = CountingNLP()
+    monkeypatch.setattr(kgc, 'nlp', nlp)
+    return nlp
@@ -0,0 +1,54 @@
+import importlib.util
+import os
+import time
+
+import pytest
+
+import KnowledgeGraphConstruction as kgc
+
+BACKEND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'My_Knowledge_Graph', 'backend.py')
+
+
+@pytest.fixture(scope='module')
+def backend(tmp_path_factory):
+    # The backend opens its parse cache when it is imported
+    os.environ['KG_PARSE_CACHE'] = str(tmp_path_factory.mktemp('backend') / 'parse_cache.sqlite')
+    try:
+        spec = importlib.util.spec_from_file_location('backend', BACKEND)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        del os.environ['KG_PARSE_CACHE']
+    return module
+
+
+# Function to wait until a job has left the queue and finished running
+def wait_for(job, timeout=10):
+    deadline = time.monotonic() + timeout
+    while job['status'] in ('queued', 'running'):
+        assert time.monotonic() < deadline, f"job still {job['status']}"
+        time.sleep(0.01)
+    return job
+
+
+# A missing model raises OSError from get_nlp; spacy.info() on its own exits the interpreter instead
+@pytest.mark.parametrize('failure', [OSError("spaCy model 'en_core_web_lg' is not installed"),
+                                     SystemExit("Can't find model 'en_core_web_lg'")])
+def test_failed_model_load_finishes_the_job(backend, tmp_path, monkeypatch, failure):
+    def fail(model):
+        raise failure
+
+    monkeypatch.setattr(kgc, 'nlp', None)
+    monkeypatch.setattr(kgc, 'require_model', fail)
+    csv_file = tmp_path / 'page.csv'
+    csv_file.write_text('paragraphs\nAltera makes FPGAs.\n')
+
+    job, duplicate = backend.submit_job(str(csv_file))
+    assert not duplicate
+    assert wait_for(job)['status'] == 'failed' and job['error'] == str(failure)
+    assert job['key'] not in backend.active_jobs
+
+    # The same file is accepted again as a new job rather than joining the failed one
+    again, duplicate = backend.submit_job(str(csv_file))
+    assert not duplicate and again['id'] != job['id']
+    wait_for(again)
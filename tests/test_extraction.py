@@ -0,0 +1,101 @@
+import pytest
+import spacy
+
+import KnowledgeGraphConstruction as kgc
+
+PARAGRAPHS = [
+    "Altera introduced the Stratix family in 2002.",
+    "Xilinx acquired a company in 2011.",
+    "Intel bought Altera in 2015.",
+    "The Virtex chips use lookup tables.",
+    "Lattice makes small FPGAs.",
+]
+
+
+def test_serial_path_parses_each_paragraph_once(counting_nlp):
+    results = list(kgc.extract_paragraphs(PARAGRAPHS))
+    assert len(results) == len(PARAGRAPHS)
+    assert (counting_nlp.calls, counting_nlp.piped) == (len(PARAGRAPHS), 0)
+
+
+def test_batched_path_pipes_each_paragraph_once(counting_nlp):
+    serial = [kgc.extract_from_doc(counting_nlp.nlp(paragraph)) for paragraph in PARAGRAPHS]
+    results = list(kgc.extract_paragraphs(PARAGRAPHS, batch_size=2))
+    assert results == serial
+    assert (counting_nlp.calls, counting_nlp.piped) == (0, len(PARAGRAPHS))
+
+
+def test_build_parses_each_paragraph_once(counting_nlp):
+    kgc.build_knowledge_graph(PARAGRAPHS, canonicalize=False)
+    assert counting_nlp.calls == len(PARAGRAPHS)
+    kgc.build_knowledge_graph(PARAGRAPHS, batch_size=2, canonicalize=True)
+    assert counting_nlp.piped == len(PARAGRAPHS)
+
+
+def test_parse_cache_parses_only_missing_paragraphs(counting_nlp, tmp_path, monkeypatch):
+    cache = kgc.ParseCache(str(tmp_path / 'parse_cache.sqlite'))
+    try:
+        first = list(kgc.extract_paragraphs(PARAGRAPHS, cache=cache))
+        assert (counting_nlp.calls, counting_nlp.piped) == (len(PARAGRAPHS), 0)
+
+        # Everything cached: the pipeline is not touched again, and not even loaded in the batched path
+        assert list(kgc.extract_paragraphs(PARAGRAPHS, cache=cache)) == first
+        with monkeypatch.context() as patch:
+            patch.setattr(kgc, 'get_nlp', lambda: pytest.fail("the model was loaded"))
+            assert list(kgc.extract_paragraphs(PARAGRAPHS, batch_size=2, cache=cache)) == first
+        assert (counting_nlp.calls, counting_nlp.piped) == (len(PARAGRAPHS), 0)
+
+        # One new paragraph, repeated: parsed once, through pipe in the batched path
+        new = "Achronix builds Speedster chips."
+        results = list(kgc.extract_paragraphs(PARAGRAPHS + [new, new], batch_size=2, cache=cache))
+        assert results[:len(PARAGRAPHS)] == first and results[-1] == results[-2]
+        assert (counting_nlp.calls, counting_nlp.piped) == (len(PARAGRAPHS), 1)
+        assert cache.stats()['entries'] == len(PARAGRAPHS) + 1
+    finally:
+        cache.close()
+
+
+def test_names_are_normalized_by_the_lemma_of_their_head_noun():
+    words = ['Altera', 'makes', 'logic', 'blocks', 'for', 'news', 'series', 'species', 'always', 'buses', 'FPGAs']
+    doc = spacy.tokens.Doc(
+        spacy.blank('en').vocab, words=words,
+        pos=['PROPN', 'VERB', 'NOUN', 'NOUN', 'ADP', 'NOUN', 'NOUN', 'NOUN', 'ADV', 'NOUN', 'PROPN'],
+        lemmas=['Altera', 'make', 'logic', 'block', 'for', 'news', 'series', 'species', 'always', 'bus', 'FPGAs'],
+        ents=['B-ORG', 'O', 'B-PRODUCT', 'I-PRODUCT', 'O', 'B-WORK_OF_ART', 'I-WORK_OF_ART', 'I-WORK_OF_ART', 'O',
+              'B-PRODUCT', 'B-PRODUCT'])
+    entities, _, lemmas = kgc.extract_from_doc(doc)
+    assert [name for name, _ in entities] == ['Altera', 'logic blocks', 'news series species', 'buses', 'FPGAs']
+    assert lemmas == {'logic blocks': 'block', 'buses': 'bus'}
+    normalized = [kgc.normalize_name(name, lemmas.get(name)) for name, _ in entities]
+    assert normalized == ['Altera', 'logic block', 'news series species', 'bus', 'FPGA']
+    for word in ('news', 'series', 'species', 'always'):
+        assert kgc.normalize_name(word) == word
+    assert kgc.normalize_name('Chips', 'chip') == 'Chip' and kgc.normalize_name('Technologies', 'technology') == 'Technology'
+    assert kgc.normalize_name('Intel.[45') == 'Intel'
+
+
+def test_canonicalization_finds_existing_nodes_by_normalized_name():
+    G = kgc.nx.Graph()
+    kgc.add_extraction_to_graph(G, [('Logic block', 'PRODUCT'), ('Altera', 'ORG')],
+                                [('Altera', 'make', 'Logic block')], source='a.csv')
+    extractions = [([('logic blocks', 'PRODUCT')], [('Intel', 'use', 'logic blocks')], {'logic blocks': 'block'}),
+                   ([('FPGAs', 'PRODUCT')], [('Intel', 'make', 'FPGAs')], {})]
+    (entities, triples, _), (fpga_entities, _, _) = kgc.canonicalize_extractions(extractions, graph=G)
+    assert entities == [('Logic block', 'PRODUCT')] and triples == [('Intel', 'use', 'Logic block')]
+    assert fpga_entities == [('FPGA', 'PRODUCT')]
+
+    # The index of the graph's node names follows merges and removals
+    keys = kgc.node_keys(G)
+    kgc.add_extraction_to_graph(G, fpga_entities, [('Intel', 'make', 'FPGA')], source='b.csv')
+    kgc.remove_source(G, 'a.csv')
+    assert kgc.node_keys(G) is keys and keys.nodes == kgc.NodeKeys(G).nodes
+    assert keys.get('fpga') == 'FPGA' and keys.get('logic block') is None
+
+
+def test_missing_model_raises_oserror(monkeypatch):
+    monkeypatch.setattr(kgc, 'nlp', None)
+    monkeypatch.setattr(kgc, 'vectors_nlp', None)
+    monkeypatch.setattr(spacy.util, 'is_package', lambda name: False)
+    for load in (kgc.get_nlp, kgc.get_vectors_nlp, kgc.pipeline_version):
+        with pytest.raises(OSError, match='is not installed'):
+            load()
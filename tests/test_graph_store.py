@@ -0,0 +1,26 @@
+import networkx as nx
+
+import KnowledgeGraphConstruction as kgc
+from graph_store import ArrayGraphStore, NetworkXGraphStore
+
+
+def test_stores_serve_the_same_payload(tmp_path):
+    G = nx.Graph()
+    kgc.add_extraction_to_graph(G, [('Altera', 'ORG'), ('Stratix', 'PRODUCT')],
+                                [('Altera', 'make', 'Stratix'), ('Intel', 'buy', 'Altera')], source='a.csv')
+    G.add_edge('Stratix', 'Cyclone')        # No relation, and Cyclone has no label
+    kgc.compute_importance(G)
+    snapshot_file = str(tmp_path / 'graph.kgsnap')
+    kgc.save_graph(G, snapshot_file)
+
+    payload = NetworkXGraphStore(G).node_link_data()
+    assert ArrayGraphStore.from_networkx(G).node_link_data() == payload
+    store = ArrayGraphStore.open(snapshot_file)
+    try:
+        assert store.node_link_data() == payload
+    finally:
+        store.close()
+    # Only the labels and relations are served, not the importance scores or the provenance
+    assert {key for node in payload['nodes'] for key in node} == {'id', 'label'}
+    assert {key for edge in payload['edges'] for key in edge} == {'source', 'target', 'relation'}
+    assert {'label': 'No label', 'id': 'Cyclone'} in payload['nodes']
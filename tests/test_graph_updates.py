@@ -0,0 +1,91 @@
+import copy
+
+import networkx as nx
+
+import KnowledgeGraphConstruction as kgc
+from graph_index import GraphSearchIndex
+from graph_store import NetworkXGraphStore
+
+PAGES = {
+    'a.csv': ([('Altera', 'ORG'), ('Intel', 'ORG'), ('Stratix', 'PRODUCT')],
+              [('Intel', 'buy', 'Altera'), ('Altera', 'make', 'Stratix')]),
+    'b.csv': ([('Xilinx', 'ORG'), ('Virtex', 'PRODUCT'), ('Intel', 'ORG')],
+              [('Xilinx', 'make', 'Virtex'), ('Xilinx', 'compete with', 'Intel')]),
+    'c.csv': ([('Lattice', 'ORG'), ('ECP', 'PRODUCT')], [('Lattice', 'make', 'ECP'), ('ECP', 'use', 'Altera')]),
+}
+
+UPDATES = [
+    # Stratix loses its only source; Cyclone is new; Intel -- Altera keeps the source of b.csv
+    {'seq': 1, 'source': 'a.csv', 'entities': [('Altera', 'ORG'), ('Cyclone', 'PRODUCT')],
+     'triples': [('Altera', 'make', 'Cyclone')]},
+    {'seq': 2, 'source': 'b.csv', 'entities': [('Xilinx', 'ORG'), ('Virtex', 'PRODUCT')],
+     'triples': [('Xilinx', 'make', 'Virtex'), ('Xilinx', 'acquire', 'Altera')]},
+    # The same source twice in one batch, and a source the graph did not have
+    {'seq': 3, 'source': 'a.csv', 'entities': [('Altera', 'ORG'), ('Arria', 'PRODUCT')],
+     'triples': [('Altera', 'make', 'Arria'), ('Intel', 'buy', 'Altera')]},
+    {'seq': 4, 'source': 'd.csv', 'entities': [('Achronix', 'ORG')], 'triples': [('Achronix', 'use', 'Intel')]},
+]
+
+
+def build_graph():
+    G = nx.Graph(seq=0)
+    for source, (entities, triples) in PAGES.items():
+        kgc.add_extraction_to_graph(G, entities, triples, source=source)
+    kgc.compute_importance(G)
+    return G
+
+
+def unordered(provenance):
+    return {source: (nodes, {frozenset(pair) for pair in pairs}) for source, (nodes, pairs) in provenance.items()}
+
+
+def contents(G):
+    return ({node: data for node, data in G.nodes(data=True)},
+            {frozenset((u, v)): data for u, v, data in G.edges(data=True)}, dict(G.graph))
+
+
+def test_incremental_updates_match_a_full_copy():
+    G = build_graph()
+    before = copy.deepcopy(contents(G))
+    expected = kgc.copy_graph(G)
+    for update in UPDATES:
+        kgc.apply_graph_update(expected, update)
+
+    H, nodes, changed, provenance = kgc.apply_graph_updates(G, UPDATES, kgc.graph_provenance(G))
+    assert contents(H) == contents(expected)
+    assert contents(G) == before        # The served version is left as it was
+    assert unordered(provenance) == unordered(kgc.graph_provenance(H))
+    changed = {frozenset(pair) for pair in changed}
+    assert {frozenset((u, v)) for u, v in G.edges()} ^ {frozenset((u, v)) for u, v in H.edges()} <= changed
+    assert set(G) ^ set(H) <= nodes
+
+
+def test_cloned_index_matches_a_rebuilt_one():
+    G = build_graph()
+    index = GraphSearchIndex(NetworkXGraphStore(G))
+    terms = ['altera', 'make', 'in', 'virtex', 'cyclone', 'arria', 'xilinx', 'achronix', 'stratix']
+    before = {term: index.search(term) for term in terms}
+
+    H, nodes, changed, _ = kgc.apply_graph_updates(G, UPDATES, kgc.graph_provenance(G))
+    clone = index.clone()
+    for u, v in changed:
+        clone.sync_edge(H, u, v)
+    for node in nodes:
+        clone.sync_node(H, node)
+    rebuilt = GraphSearchIndex(NetworkXGraphStore(H))
+    for term in terms:
+        assert {frozenset(edge[:2]) for edge in clone.search(term)} == {frozenset(edge[:2]) for edge in rebuilt.search(term)}
+        assert index.search(term) == before[term]
+    assert len(clone) == H.number_of_edges()
+    for name in ['altera', 'stratix', 'cyclone', 'achronix', 'lattice']:
+        assert clone.node_named(name) == rebuilt.node_named(name)
+    assert index.node_named('stratix') == 'Stratix' and clone.node_named('stratix') is None
+    assert index.node_named('cyclone') is None
+
+
+def test_nodes_without_edges_resolve():
+    G = build_graph()
+    G.add_node('Achronix', label='ORG')
+    index = GraphSearchIndex(NetworkXGraphStore(G))
+    assert index.node_named('achronix') == 'Achronix'
+    assert index.node_named('altera') == 'Altera' and index.node_named('zzz') is None
@@ -0,0 +1,18 @@
+import KnowledgeGraphConstruction as kgc
+import pipeline
+
+URL = 'http://127.0.0.1/fpga'
+PAGE = "<html><head><title>FPGAs</title></head><body><p>Intel bought Altera in 2015.</p></body></html>"
+
+
+def test_unchanged_page_is_merged_until_the_graph_has_it(counting_nlp, monkeypatch):
+    # The HTTP cache says the page has not changed since it was last fetched
+    monkeypatch.setattr(pipeline.scraper, 'fetch_webpage_if_changed', lambda url, cache, **kwargs: (PAGE, False))
+    http_cache = object()
+
+    G, report = pipeline.stream_to_graph([URL], http_cache=http_cache, per_host_rate=0)
+    assert (report['changed'], report['unchanged']) == ([URL], [])
+    assert pipeline.scraper.csv_filename(URL) in kgc.graph_sources(G)
+
+    G, report = pipeline.stream_to_graph([URL], graph=G, http_cache=http_cache, per_host_rate=0)
+    assert (report['changed'], report['unchanged']) == ([], [URL])
@@ -0,0 +1,141 @@
+import importlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+scraper = importlib.import_module('WebScraping_Small-2')
+
+PAGE = b"<html><head><title>Stand-in</title></head><body><h1>FPGAs</h1><p>Altera makes FPGAs.</p></body></html>"
+
+
+# Local stand-in for the scraped sites. statuses maps a path to the status codes its next requests get (200 once
+# they run out); every request is recorded with its arrival time, and the largest number in flight at once is kept
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.latency = latency
+        self.statuses = {}
+        self.requests = []      # (path, arrival time)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, time.monotonic()))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            pending = server.statuses.get(self.path)
+            status = pending.pop(0) if pending else 200
+        try:
+            time.sleep(server.latency)
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(PAGE)))
+            self.end_headers()
+            self.wfile.write(PAGE)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in():
+    servers = []
+
+    def start(latency=0.0):
+        server = StandInServer(latency)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_permanent_error_is_requested_once(stand_in):
+    server = stand_in()
+    server.statuses['/forbidden'] = [403] * 3
+    assert scraper.get_with_retries(server.url('/forbidden'), retries=3, delay=0) is None
+    assert [path for path, _ in server.requests] == ['/forbidden']
+
+
+def test_transient_error_is_retried(stand_in):
+    server = stand_in()
+    server.statuses['/busy'] = [503]
+    response = scraper.get_with_retries(server.url('/busy'), retries=3, delay=0)
+    assert response is not None and response.status_code == 200
+    assert [path for path, _ in server.requests] == ['/busy', '/busy']
+
+
+def test_per_host_concurrency_is_capped(stand_in, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)     # scrape_websites writes one CSV file per page
+    server = stand_in(latency=0.1)
+    urls = [server.url(f"/page{number}") for number in range(8)]
+    results = scraper.scrape_websites(urls, max_workers=8, per_host_concurrency=2, per_host_rate=0)
+    assert all(csv_file and changed for csv_file, changed in results.values())
+    assert len(server.requests) == len(urls)
+    assert server.max_in_flight == 2
+
+
+def test_requests_to_one_host_are_spaced_by_rate(stand_in, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = stand_in()
+    rate = 10.0
+    # Record when each request leaves the client, i.e. when the limiter let it go
+    sent = []
+    create_session = scraper.create_session
+
+    def recording_session(pool_size=10):
+        session = create_session(pool_size)
+        get = session.get
+        session.get = lambda *args, **kwargs: sent.append(time.monotonic()) or get(*args, **kwargs)
+        return session
+
+    monkeypatch.setattr(scraper, 'create_session', recording_session)
+    urls = [server.url(f"/page{number}") for number in range(5)]
+    scraper.scrape_websites(urls, max_workers=5, per_host_concurrency=5, per_host_rate=rate)
+    assert len(sent) == len(server.requests) == len(urls)
+    sent.sort()
+    assert min(later - earlier for earlier, later in zip(sent, sent[1:])) >= 1 / rate - 0.005     # Clock granularity
+
+
+def test_rewritten_csv_is_reported_changed(stand_in, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = stand_in()
+    url = server.url('/page')
+    cache = scraper.HTTPCache(str(tmp_path / 'http_cache.sqlite'))
+    try:
+        csv_file, changed = scraper.scrape_page(url, cache=cache)
+        assert changed
+        assert scraper.scrape_page(url, cache=cache) == (csv_file, False)       # Fresh in the cache, CSV still there
+        (tmp_path / csv_file).unlink()
+        assert scraper.scrape_page(url, cache=cache) == (csv_file, True)        # Fresh in the cache, CSV rewritten
+        assert (tmp_path / csv_file).exists() and len(server.requests) == 1
+    finally:
+        cache.close()
+
+
+# Markup where BeautifulSoup's rules are easy to miss: Tag.string of a title with a single child, CDATA as text
+@pytest.mark.parametrize('page', [
+    '<title><b>x</b></title>', '<title><!--c--></title>', '<title><b><i>y</i></b></title>', '<title><b>x</b>y</title>',
+    '<title><![CDATA[t]]></title>', '<title></title>', '<title><br></title>', '<p>a<![CDATA[zz]]>b</p>',
+    '<h1>a<!--c-->b</h1>', '<div><p>a</div>b</p>',
+])
+def test_stream_extractor_matches_beautifulsoup(page):
+    assert scraper.extract_page(page, 'stream') == scraper.extract_page(page, 'bs4')